@@ -85,10 +85,50 @@ async function fetchJobStatus(jobId) {
     return await response.json();
 }
 
+/**
+ * Fetches the counters of a dataset processing job, without its results.
+ * @param {string} jobId - The ID of the job to check.
+ * @returns {Promise<Object>} A promise that resolves to the job progress object.
+ */
+async function fetchJobProgress(jobId) {
+    const response = await fetch(`${API_BASE_URL}/dataset/progress/${jobId}`);
+    if (!response.ok) {
+        throw new Error(`Failed to fetch progress for job ${jobId}`);
+    }
+    return await response.json();
+}
+
+/**
+ * Fetches one page of a job's results.
+ * @param {string} jobId - The ID of the job.
+ * @param {number} cursor - Where the page starts (the `next_cursor` of the previous page).
+ * @returns {Promise<Object>} A promise that resolves to { results, next_cursor, complete }.
+ */
+async function fetchJobResults(jobId, cursor = 0) {
+    const response = await fetch(`${API_BASE_URL}/dataset/results/${jobId}?cursor=${cursor}&limit=500`);
+    if (!response.ok) {
+        throw new Error(`Failed to fetch results for job ${jobId}`);
+    }
+    return await response.json();
+}
+
+/**
+ * Opens the server-sent-events stream of a job (`result`, `progress` and `end` events).
+ * @param {string} jobId - The ID of the job.
+ * @param {number} cursor - The number of results the caller already has.
+ * @returns {EventSource} The event source.
+ */
+function openJobEvents(jobId, cursor = 0) {
+    return new EventSource(`${API_BASE_URL}/dataset/events/${jobId}?cursor=${cursor}`);
+}
+
 export { 
     fetchNodeStatuses, 
     fetchAlerts, 
     fetchAvailableModels,
     uploadDataset,
-    fetchJobStatus
+    fetchJobStatus,
+    fetchJobProgress,
+    fetchJobResults,
+    openJobEvents
 };
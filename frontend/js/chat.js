@@ -61,6 +61,7 @@ async function sendMessage() {
                 messages: conversationHistory,
                 model: modelSelect.value || null,
                 stream: true,
+                stream_format: 'openai',
             }),
         });
 
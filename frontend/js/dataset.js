@@ -3,10 +3,12 @@
  *
  * This module handles the UI and logic for the dataset processing feature.
  * It allows users to upload a dataset, start a batch processing job, and
- * monitor its progress in real-time.
+ * monitor its progress in real-time: new results and counters are pushed over a
+ * server-sent-events stream, with polling of the lightweight progress and result
+ * page endpoints as a fallback.
  */
 
-import { uploadDataset, fetchJobStatus } from './api.js';
+import { uploadDataset, fetchJobProgress, fetchJobResults, openJobEvents } from './api.js';
 
 // DOM Elements
 const datasetForm = document.getElementById('dataset-form');
@@ -20,6 +22,9 @@ const jobResultsContainer = document.getElementById('job-results');
 // State
 let currentJobId = null;
 let jobStatusInterval = null;
+let jobEvents = null;
+// Number of results received so far (the cursor into the job's results).
+let resultsCursor = 0;
 
 /**
  * Initializes the dataset processing form and related event listeners.
@@ -41,16 +46,18 @@ async function handleFormSubmit(e) {
         return;
     }
 
+    // data_count goes first, so the gateway knows the cut-off before the file streams in.
     const formData = new FormData();
-    formData.append('file', fileInput.files[0]);
     if (dataCountInput.value) {
         formData.append('data_count', dataCountInput.value);
     }
+    formData.append('file', fileInput.files[0]);
 
     try {
         const response = await uploadDataset(formData);
         if (response.job_id) {
             currentJobId = response.job_id;
+            resultsCursor = 0;
             jobStatusContainer.classList.remove('hidden');
             jobResultsContainer.innerHTML = ''; // Clear previous results
             startJobMonitoring();
@@ -64,69 +71,142 @@ async function handleFormSubmit(e) {
 }
 
 /**
- * Starts periodically polling for the status of the current job.
+ * Starts following the current job: over its event stream if the browser supports it,
+ * otherwise by polling.
  */
 function startJobMonitoring() {
+    stopJobMonitoring();
+    if (!window.EventSource) {
+        startJobPolling();
+        return;
+    }
+
+    const jobId = currentJobId;
+    jobEvents = openJobEvents(jobId, resultsCursor);
+    jobEvents.addEventListener('result', (event) => {
+        renderJobResults([JSON.parse(event.data)]);
+        resultsCursor += 1;
+    });
+    jobEvents.addEventListener('progress', (event) => renderJobProgress(JSON.parse(event.data)));
+    jobEvents.addEventListener('end', stopJobMonitoring);
+    jobEvents.onerror = () => {
+        // The browser reconnects by itself (resuming after the last result); only give up
+        // on the stream if it was closed for good, and poll instead.
+        if (jobEvents && jobEvents.readyState === EventSource.CLOSED && currentJobId === jobId) {
+            stopJobMonitoring();
+            startJobPolling();
+        }
+    };
+}
+
+/**
+ * Stops following the current job.
+ */
+function stopJobMonitoring() {
+    if (jobEvents) {
+        jobEvents.close();
+        jobEvents = null;
+    }
     if (jobStatusInterval) {
         clearInterval(jobStatusInterval);
+        jobStatusInterval = null;
     }
+}
+
+/**
+ * Starts periodically polling for the progress and new results of the current job.
+ */
+function startJobPolling() {
     // Poll for status every 2 seconds
     jobStatusInterval = setInterval(updateJobStatus, 2000);
 }
 
 /**
- * Fetches and updates the UI with the latest job status.
+ * Fetches the job's counters and the results added since the last poll, and updates the UI.
  */
 async function updateJobStatus() {
     if (!currentJobId) return;
 
     try {
-        const status = await fetchJobStatus(currentJobId);
-        const progressPercent = status.total_items > 0 
-            ? (status.processed_items / status.total_items) * 100 
-            : 0;
+        const progress = await fetchJobProgress(currentJobId);
+        // Only fetch the results that are new since the last poll
+        while (resultsCursor < progress.results_available) {
+            const page = await fetchJobResults(currentJobId, resultsCursor);
+            if (!page.results.length) break;
+            renderJobResults(page.results);
+            resultsCursor = page.next_cursor;
+        }
+        renderJobProgress(progress);
+    } catch (error) {
+        console.error('Failed to update job status:', error);
+        stopJobMonitoring();
+        jobProgressText.textContent = '错误: 无法获取任务状态';
+    }
+}
 
-        jobProgress.style.width = `${progressPercent}%`;
-        jobProgressText.textContent = `处理中: ${status.processed_items} / ${status.total_items} (${status.status})`;
+/**
+ * Updates the progress bar from a job's counters.
+ * @param {Object} progress - The job progress object.
+ */
+function renderJobProgress(progress) {
+    const progressPercent = progress.total_items > 0 
+        ? (progress.processed_items / progress.total_items) * 100 
+        : 0;
 
-        // Render new results incrementally
-        renderJobResults(status.results);
+    jobProgress.style.width = `${progressPercent}%`;
+    const eta = progress.eta_seconds != null ? `, 预计剩余 ${Math.ceil(progress.eta_seconds)} 秒` : '';
+    jobProgressText.textContent = `处理中: ${progress.processed_items} / ${progress.total_items} (${progress.status}${eta})`;
 
-        if (status.status === 'completed' || status.status === 'failed') {
+    if (progress.status === 'completed' || progress.status === 'failed') {
+        if (jobStatusInterval) {
             clearInterval(jobStatusInterval);
             jobStatusInterval = null;
-            jobProgressText.textContent = `任务完成: ${status.processed_items} / ${status.total_items} (${status.status})`;
         }
-    } catch (error) {
-        console.error('Failed to update job status:', error);
-        clearInterval(jobStatusInterval);
-        jobStatusInterval = null;
-        jobProgressText.textContent = '错误: 无法获取任务状态';
+        jobProgressText.textContent = `任务完成: ${progress.processed_items} / ${progress.total_items} (${progress.status})`;
     }
 }
 
 /**
- * Renders the results of the dataset processing job.
- * This function is designed to be incremental, only adding new results.
- * @param {Array} results - The array of result objects from the job status.
+ * Appends newly received results of the dataset processing job.
+ * @param {Array} results - The new result objects.
  */
 function renderJobResults(results) {
-    // Get the number of currently rendered results
-    const renderedCount = jobResultsContainer.children.length;
-
-    // Only append new results
-    for (let i = renderedCount; i < results.length; i++) {
-        const result = results[i];
+    for (const result of results) {
         const resultEl = document.createElement('div');
         resultEl.className = 'p-3 bg-gray-700 rounded-md text-sm';
-        resultEl.innerHTML = `
-            <p><span class="font-semibold text-gray-400">输入:</span> ${JSON.stringify(result.original)}</p>
-            <p><span class="font-semibold text-green-400">输出:</span> ${JSON.stringify(result.output)}</p>
-        `;
+        // Inputs, outputs and errors (which quote node responses) are text, never markup.
+        resultEl.appendChild(resultLine('text-gray-400', '输入:', JSON.stringify(result.original)));
+        if (result.error) {
+            resultEl.appendChild(resultLine('text-red-400', '错误:', result.error));
+        } else {
+            resultEl.appendChild(resultLine('text-green-400', '输出:', JSON.stringify(result.output)));
+        }
+        if (result.node) {
+            const nodeEl = document.createElement('p');
+            nodeEl.className = 'text-xs text-gray-500';
+            nodeEl.textContent = `节点: ${result.node}`;
+            resultEl.appendChild(nodeEl);
+        }
         jobResultsContainer.appendChild(resultEl);
     }
     // Auto-scroll to the bottom
     jobResultsContainer.scrollTop = jobResultsContainer.scrollHeight;
 }
 
+/**
+ * Creates a labelled line of a result, with its text set as text rather than HTML.
+ * @param {string} labelColor - The color class of the label.
+ * @param {string} label - The label.
+ * @param {string} text - The text after the label.
+ * @returns {HTMLParagraphElement} The line.
+ */
+function resultLine(labelColor, label, text) {
+    const lineEl = document.createElement('p');
+    const labelEl = document.createElement('span');
+    labelEl.className = `font-semibold ${labelColor}`;
+    labelEl.textContent = label;
+    lineEl.append(labelEl, ` ${text}`);
+    return lineEl;
+}
+
 export { initDatasetProcessing };
@@ -5,89 +5,362 @@ This router handles all real-time chat completion requests. It serves as the pri
 entry point for user interaction with the LLMs on the compute nodes.
 """
 
+import asyncio
 import json
+import time
 import httpx
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import StreamingResponse
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse, Response
 
 from gateway.models.api_models import ChatRequest
-from gateway.core.scheduler import get_best_node
-from gateway.services.locking import lock_node, unlock_node
+from gateway.core.scheduler import select_node, scheduler_index, conversation_affinity_key
+from gateway.core.latency import tokens_per_sec_from_final_chunk
+from gateway.core.health import quarantine_node
+from gateway.services.locking import LeaseLost, acquire_lease, renew_lease, release_lease
+from gateway.services.admission import admission_queue, AdmissionError
+from gateway.services.hedging import hedge_budget, hedge_delay, race_with_hedge
+from gateway.services.http_pool import node_clients
+from gateway.services.disconnect import cancel_on_disconnect, until_disconnect, record_abandoned_generation
+from gateway.services.response_cache import request_cache_key, response_cache, chat_flights, CACHE_LOOKUPS
+from gateway.utils.streaming import NDJSONFramer, FramingError, StreamRenderer, ChatAggregator
 from gateway.config import settings
 
 router = APIRouter()
 
-# A dedicated, long-timeout client for streaming LLM responses
-streaming_client = httpx.AsyncClient(timeout=settings.REQUEST_TIMEOUT)
+# ChatRequest fields that only steer the gateway and are not sent to the node.
+GATEWAY_ONLY_FIELDS = {"model", "priority", "deadline_ms", "hedge", "stream_format"}
 
 @router.post("/chat/completions", tags=["Chat"])
-async def chat_proxy(request: ChatRequest):
+async def chat_proxy(request: ChatRequest, http_request: Request):
     """
     This endpoint is the core of the real-time inference pipeline. It demonstrates:
     1.  **Task Scheduling**: Selects the best available node using the dynamic scheduler.
-    2.  **Resource Locking**: Reserves the chosen node to prevent conflicts.
+    2.  **Resource Locking**: Leases a slot on the chosen node to prevent conflicts.
     3.  **Failure Handling (Re-routing)**: If the initial node choice fails, it attempts to find another.
+        If every suitable node is busy, the request waits in the admission queue until one frees up.
     4.  **Streaming Response**: Streams the LLM's response back to the client token by token.
+    5.  **Latency Feedback**: Measures TTFT and decode rate and feeds them back to the scheduler.
+    6.  **Mid-Stream Failover**: If the node dies mid-stream, the conversation plus the partial
+        answer is resubmitted to another node and the client stream simply continues.
+    7.  **Hedging**: With `hedge` set, a second node is raced if the first is slow to start.
+    8.  **Response Cache**: Identical deterministic requests are served from one upstream stream.
+    9.  **Output Formats**: Ollama's NDJSON lines, or OpenAI `chat.completion.chunk` events.
+    10. **Disconnect Handling**: If the client goes away, the upstream generation is aborted
+        and the slot released at once.
+    11. **Non-Streaming Mode**: With `stream=false`, the stream is aggregated in the gateway and
+        returned as one JSON document with usage and timing fields.
     """
-    # --- 1. Task Scheduling ---
-    # Attempt to find the best node, optionally filtering by the requested model.
-    selected_node_config = await get_best_node(request.model)
-    
-    # --- 2. Resource Locking & Failure Handling (Re-routing) ---
-    if not selected_node_config or not await lock_node(selected_node_config):
-        # If no node is found or locking fails, try again without model preference.
-        # This is a simple re-routing strategy.
-        print("Initial node selection failed or could not be locked. Retrying without model preference...")
-        selected_node_config = await get_best_node()
-        if not selected_node_config or not await lock_node(selected_node_config):
-            raise HTTPException(status_code=503, detail="All suitable nodes are busy or unavailable.")
+    received = time.monotonic()
+    if request.stream:
+        renderer = StreamRenderer(request.stream_format, request.model)
+    else:
+        renderer = ChatAggregator(request.stream_format, request.model, size_hint=_expected_messages(request))
+
+    cache_key = request_cache_key(request) if settings.RESPONSE_CACHE_ENABLED else None
+    if cache_key is not None:
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            CACHE_LOOKUPS.inc(outcome="hit")
+            return await _respond(request, http_request, _replay(cached))
+        flight = chat_flights.get(cache_key)
+        CACHE_LOOKUPS.inc(outcome="coalesced" if flight is not None else "miss")
+        while flight is not None:
+            # An identical request is already running; share its stream instead of taking a slot.
+            await cancel_on_disconnect(http_request, flight.admitted.wait())
+            if not flight.aborted and not flight.abandoned:
+                return await _respond(request, http_request, flight.subscribe(), flight.failure)
+            # Its leader gave up before getting a slot, or everyone left it before the end. Look
+            # again: the first follower back starts a new flight and queues for admission
+            # itself, the others join that one.
+            flight = chat_flights.get(cache_key)
+        flight = chat_flights.start(cache_key)
+
+    affinity_key = conversation_affinity_key(request.messages)
+    hedge_budget.record_request()
+
+    def try_acquire(exclude=()):
+        # --- 1. Task Scheduling ---
+        # Attempt to find the best node, optionally filtering by the requested model.
+        # In prefix-affinity mode, follow-up turns go back to the node holding the KV cache.
+        node = select_node(request.model, affinity_key, exclude)
+
+        # --- 2. Resource Locking & Failure Handling (Re-routing) ---
+        # The lease lives in the gateway, so this costs no round-trip to the node. It is
+        # renewed as the stream makes progress and expires on its own if the task dies.
+        lease = acquire_lease(node, ttl=settings.REQUEST_TIMEOUT) if node else None
+        if not lease and request.model:
+            # If no node is found or no slot can be leased, try again without model preference.
+            # This is a simple re-routing strategy.
+            node = select_node(exclude=exclude)
+            lease = acquire_lease(node, ttl=settings.REQUEST_TIMEOUT) if node else None
+        return (node, lease) if lease else None
+
+    try:
+        selected_node_config, lease = await cancel_on_disconnect(http_request, admission_queue.admit(
+            try_acquire,
+            release=lambda reservation: release_lease(reservation[1]),
+            priority=request.priority,
+            timeout=request.deadline_ms / 1000 if request.deadline_ms is not None else None,
+        ))
+    except AdmissionError as e:
+        if cache_key is not None:
+            chat_flights.abort(cache_key)
+        raise HTTPException(status_code=503, detail=str(e))
+    except BaseException:
+        if cache_key is not None:
+            chat_flights.abort(cache_key)
+        raise
+
+    # Set once the final message has been forwarded; only complete answers are cached.
+    completed = False
+    # Set to the status to answer with if the request fails: the node's own 4xx if it rejected
+    # the request itself, 502 otherwise. Shared with the requests of the same flight.
+    failure = flight.failure if cache_key is not None else {}
 
     async def stream_generator():
         """
         A generator function that streams the response from the backend LLM.
-        It includes crucial logic for failure handling and ensuring the node is unlocked.
+        It includes crucial logic for failure handling and ensuring the lease is released.
         """
-        unlocked = False
+        nonlocal completed
+        node, current_lease = selected_node_config, lease
+        # Content already sent to the client, kept so another node can pick up where this one stopped.
+        emitted = []
+        failovers = 0
         try:
             # --- Custom Event: Inform client which node was chosen ---
-            node_name = selected_node_config["name"]
-            event_data = json.dumps({"node_name": node_name})
-            yield f"event: node_assigned\ndata: {event_data}\n\n"
-
-            # --- 3. Stream the request to the selected node ---
-            async with streaming_client.stream(
-                "POST",
-                selected_node_config["llm_url"],
-                json=request.dict(exclude={"model"}), # Exclude model as it's for our scheduler
-                timeout=settings.REQUEST_TIMEOUT
-            ) as response:
-                # Raise an exception for non-200 responses to trigger failure handling
-                response.raise_for_status()
-
-                # Stream the response chunk by chunk
-                async for chunk in response.aiter_bytes():
-                    yield chunk
-                    # A simple way to detect the end of a stream from Ollama
-                    if b'"done":true' in chunk and not unlocked:
-                        await unlock_node(selected_node_config)
-                        unlocked = True
-        
-        except (httpx.RequestError, httpx.HTTPStatusError) as e:
-            # --- 4. Failure Handling (During Stream) ---
-            # This block catches connection errors or non-200 responses.
-            print(f"🚨 Stream failed from node {selected_node_config['id']}: {e}. Task reassignment would be triggered here.")
-            # In a real system, the gateway would capture the conversation history 
-            # and resubmit the task to a different node. Here, we just inform the client.
-            error_message = json.dumps({"error": "The compute node failed during the request."})
-            yield f"data: {error_message}\n\n"
-        
+            notice = renderer.node_assigned(node["name"])
+            if notice:
+                yield notice
+
+            while True:
+                payload = request.dict(exclude=GATEWAY_ONLY_FIELDS) # Exclude fields that are for our scheduler
+                # The gateway always streams from the node, also when it aggregates for the client.
+                payload["stream"] = True
+                if emitted:
+                    # Resubmit with the partial answer as an assistant prefix; the node continues it.
+                    payload["messages"].append({"role": "assistant", "content": "".join(emitted)})
+
+                response = None
+                try:
+                    # --- 3. Stream the request to the selected node ---
+                    if request.hedge and not emitted and failovers == 0:
+                        # --- 7. Hedging: race a second node if the first is slow to start ---
+                        hedge = {}
+
+                        def launch_hedge():
+                            # Only a node serving the requested model may answer: unlike
+                            # `try_acquire`, there is no fallback to other models.
+                            hedge_node = select_node(request.model, affinity_key, (node["id"],))
+                            hedge_lease = acquire_lease(hedge_node, ttl=settings.REQUEST_TIMEOUT) if hedge_node else None
+                            if hedge_lease is None:
+                                return None
+                            hedge["node"], hedge["lease"] = hedge_node, hedge_lease
+                            return _open_stream(hedge_node, payload)
+
+                        async def discard(_index, opened):
+                            await opened[0].aclose()
+
+                        try:
+                            winner, (response, lines, ttft) = await race_with_hedge(
+                                _open_stream(node, payload), hedge_delay(request.model), launch_hedge, discard,
+                            )
+                        finally:
+                            # Release the loser's slot at once. The winner's lease is released when its
+                            # stream completes; if both failed, the primary's goes with the failover below.
+                            if hedge and response is not None and winner == 1:
+                                release_lease(current_lease)
+                            elif hedge:
+                                release_lease(hedge["lease"])
+                        if winner == 1:
+                            print(f"🏁 Hedge on node {hedge['node']['id']} beat node {node['id']} to the first token.")
+                            node, current_lease = hedge["node"], hedge["lease"]
+                            notice = renderer.node_assigned(node["name"])
+                            if notice:
+                                yield notice
+                    else:
+                        response, lines, ttft = await _open_stream(node, payload)
+
+                    # Forward complete NDJSON lines only, so a failover never leaves a torn line behind
+                    async for line in lines:
+                        message = json.loads(line)
+                        emitted.append(message.get("message", {}).get("content", ""))
+                        chunk = renderer.message(line, message)
+
+                        if message.get("done"):
+                            # Free the slot as soon as the final message is parsed, before the
+                            # client has even read it.
+                            completed = True
+                            release_lease(current_lease)
+                            # --- 5. Latency Feedback ---
+                            scheduler_index.observe_latency(
+                                node["id"],
+                                ttft=ttft,
+                                tokens_per_sec=tokens_per_sec_from_final_chunk(message),
+                            )
+                            yield chunk
+                            return
+                        if chunk is not None:
+                            yield chunk
+                        if not renew_lease(current_lease, ttl=settings.REQUEST_TIMEOUT):
+                            # The node refused the lease (it has no slot for us) or it expired.
+                            raise LeaseLost(f"The lease on node {node['id']} was refused or expired.")
+
+                    # The node closed the stream without a final message.
+                    raise httpx.RemoteProtocolError("Stream ended before the final message.")
+
+                except (httpx.RequestError, httpx.HTTPStatusError, json.JSONDecodeError, FramingError, LeaseLost) as e:
+                    if isinstance(e, httpx.HTTPStatusError) and e.response.status_code < 500:
+                        # The request itself was rejected (e.g. bad options or an unknown model).
+                        # The node is healthy, and any other node would reject it as well.
+                        release_lease(current_lease)
+                        failure["status"] = e.response.status_code
+                        print(f"⛔ Node {node['id']} rejected the request: {e.response.status_code}.")
+                        yield renderer.error(f"The compute node rejected the request: {_error_detail(e.response)}")
+                        return
+                    # --- 4. Failure Handling (During Stream) ---
+                    # This block catches connection errors, 5xx responses and garbled streams, and
+                    # a lease the node refused: the node is healthy then, only full.
+                    print(f"🚨 Stream failed from node {node['id']}: {e}. Reassigning the task.")
+                    release_lease(current_lease)
+                    if not isinstance(e, LeaseLost):
+                        # Keep the node out of the pool for a while, even if its agent still reports in.
+                        quarantine_node(node, f"🚨 Node {node['id']} failed a chat stream. Quarantining it.")
+
+                    failovers += 1
+                    if failovers > settings.STREAM_FAILOVER_ATTEMPTS:
+                        failure["status"] = 502
+                        yield renderer.error("The compute node failed during the request.")
+                        return
+                    try:
+                        node, current_lease = await admission_queue.admit(
+                            try_acquire,
+                            release=lambda reservation: release_lease(reservation[1]),
+                            priority=request.priority,
+                            # Only what is left of the client's deadline.
+                            timeout=(max(request.deadline_ms / 1000 - (time.monotonic() - received), 0.0)
+                                     if request.deadline_ms is not None else None),
+                        )
+                    except AdmissionError:
+                        failure["status"] = 502
+                        yield renderer.error("The compute node failed and no other node is available.")
+                        return
+                    print(f"🔁 Resuming stream on node {node['id']} after {len(emitted)} messages.")
+                    notice = renderer.node_assigned(node["name"])
+                    if notice:
+                        yield notice
+                finally:
+                    # Closing an unfinished response drops the connection, which stops Ollama's generation.
+                    if response is not None:
+                        await response.aclose()
+
+        except (asyncio.CancelledError, GeneratorExit):
+            # --- 10. Client Disconnected ---
+            # The upstream stream has just been aborted by the block above.
+            if not completed:
+                saved = record_abandoned_generation(node["id"], len(emitted))
+                print(f"✂️ Client disconnected; aborted generation on node {node['id']} (~{saved:.1f} GPU-seconds saved).")
+            raise
+
         finally:
-            # --- Final Unlock ---
+            # --- Final Release ---
             # This 'finally' block is a critical part of the failure handling module.
-            # It ensures that the node is ALWAYS unlocked, even if the client disconnects
-            # or an unexpected error occurs.
-            if not unlocked:
-                print(f"Force-unlocking node {selected_node_config['id']} due to stream interruption or error.")
-                await unlock_node(selected_node_config)
+            # It ensures that the lease is ALWAYS released, even if the client disconnects
+            # or an unexpected error occurs. Should it be skipped anyway, the lease expires.
+            # Releasing an already released lease is a no-op thanks to its fencing token.
+            if release_lease(current_lease):
+                print(f"Force-released lease on node {node['id']} due to stream interruption or error.")
+
+    if cache_key is not None:
+        def store(chunks):
+            if completed:
+                response_cache.put(cache_key, chunks)
+
+        leader = chat_flights.run(cache_key, stream_generator(), on_complete=store)
+        return await _respond(request, http_request, leader, failure)
+    return await _respond(request, http_request, stream_generator(), failure)
+
+
+async def _respond(request: ChatRequest, http_request: Request, body, failure: Optional[dict] = None):
+    """
+    Returns `body` to the client: streamed as it is produced, or, for `stream=false`,
+    collected into a single JSON response, with the status in `failure` if the request failed
+    (set by `stream_generator` before it yields the error) and 200 otherwise.
+    """
+    if request.stream:
+        return StreamingResponse(until_disconnect(http_request, body), media_type="text/event-stream")
+
+    async def collect():
+        return "".join([chunk async for chunk in body])
+
+    # The generator counts its own abandoned generation; this is not a wait in the queue.
+    content = await cancel_on_disconnect(http_request, collect(), queued=False)
+    status_code = (failure or {}).get("status", 200)
+    return Response(content, status_code=status_code, media_type="application/json")
+
+
+def _expected_messages(request: ChatRequest) -> int:
+    """The expected number of streamed messages (about one per token), to pre-size buffers."""
+    num_predict = (request.options or {}).get("num_predict")
+    if isinstance(num_predict, int) and num_predict > 0:
+        return min(num_predict, 8192) + 1
+    return settings.EXPECTED_OUTPUT_TOKENS + 1
+
+
+def _error_detail(response: httpx.Response) -> str:
+    """The error message of a node's error response (Ollama answers `{"error": ...}`)."""
+    try:
+        detail = response.json().get("error")
+    except (ValueError, AttributeError, httpx.ResponseNotRead):
+        detail = None
+    return f"{response.status_code} {detail or response.reason_phrase}"
+
+
+async def _replay(chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+async def _open_stream(node: dict, payload: dict):
+    """
+    Sends a chat request to a node and waits for its first NDJSON line.
+
+    Returns (response, lines, ttft): the open response, which the caller must close, an
+    iterator over its non-empty lines starting with the first one, and the time to that line.
+    """
+    # Each node has its own long-timeout, keep-alive connection pool for streaming LLM responses
+    client = node_clients.llm(node)
+    request_started = time.monotonic()
+    response = await client.send(client.build_request("POST", node["llm_url"], json=payload), stream=True)
+    try:
+        if response.is_error:
+            await response.aread()  # For the error message.
+        # Raise an exception for non-200 responses to trigger failure handling
+        response.raise_for_status()
+        lines = _ndjson_lines(response)
+        try:
+            first_line = await lines.__anext__()
+        except StopAsyncIteration:
+            raise httpx.RemoteProtocolError("Stream ended before the first message.")
+    except BaseException:
+        await response.aclose()
+        raise
+    return response, _prepend(first_line, lines), time.monotonic() - request_started
+
+
+async def _ndjson_lines(response: httpx.Response):
+    """Yields the complete NDJSON lines (as bytes) of a streaming response."""
+    framer = NDJSONFramer()
+    async for chunk in response.aiter_bytes():
+        for line in framer.feed(chunk):
+            yield line
+    rest = framer.flush()
+    if rest is not None:
+        yield rest
+
 
-    return StreamingResponse(stream_generator(), media_type="text/event-stream")
+async def _prepend(first_line: bytes, lines):
+    yield first_line
+    async for line in lines:
+        yield line
@@ -7,112 +7,499 @@ and the principles of the "Incremental Result Aggregation Module".
 
 import asyncio
 import json
-import time
+import os
 import uuid
-import random
-from fastapi import APIRouter, HTTPException, UploadFile, File, Form, BackgroundTasks
+from typing import Any, AsyncIterator, Dict, FrozenSet, Iterator, List, Optional, Tuple
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.requests import ClientDisconnect
 
-from gateway.core import state
-from gateway.core.scheduler import get_best_node
-from gateway.models.api_models import JobStatus
+from gateway.models.api_models import JobStatus, JobProgress, JobResultsPage
+from gateway.services.aggregation import AggregatorHub, aggregator_hubs, build_merges
+from gateway.services.batch_engine import run_batch, item_key, BatchStats, ItemOutcome
+from gateway.services.disconnect import until_disconnect
+from gateway.services.export import EXPORT_FORMATS, MEDIA_TYPES, export_results, format_available
+from gateway.services.ingest import DatasetSpool, upload_parts
+from gateway.services.job_store import job_store, FINISHED_STATUSES
+from gateway.services.memo_store import memo_store
+from gateway.utils.json_stream import JSONItemParser, DatasetFormatError
 from gateway.config import settings
 
 router = APIRouter()
 
-async def run_dataset_processing_job(job_id: str, dataset: list):
+# The tasks of the jobs that are running, by job ID (so they are not garbage-collected).
+_RUNNING_JOBS: Dict[str, asyncio.Task] = {}
+# The throughput of the batches of the running jobs, for their time estimates; by job ID.
+_BATCH_STATS: Dict[str, BatchStats] = {}
+
+# Largest page of results returned at once (also the largest burst of SSE result events).
+RESULTS_PAGE_MAX = 1000
+# Results read from the job store per chunk of an export (a Parquet row group each).
+EXPORT_PAGE_RESULTS = 5000
+# A progress stream sends a comment this often when nothing happens, to keep proxies from closing it.
+EVENTS_KEEPALIVE_SECONDS = 15.0
+
+# Set (and replaced) whenever a job changes, to wake its progress streams; by job ID.
+_JOB_UPDATES: Dict[str, asyncio.Event] = {}
+
+
+def _notify(job_id: str):
+    """Wakes every progress stream of a job."""
+    event = _JOB_UPDATES.pop(job_id, None)
+    if event is not None:
+        event.set()
+
+
+def _forget_job(job_id: str):
+    """Drops what the router holds for a job that was evicted from the job store."""
+    aggregator_hubs.pop(job_id, None)
+    _notify(job_id)
+
+
+job_store.add_evict_listener(_forget_job)
+
+
+def _eta(job: Dict[str, Any]) -> Optional[float]:
+    """The estimated seconds until a job has processed all of its items, once it can be told."""
+    stats = _BATCH_STATS.get(job["job_id"])
+    if stats is None or job["status"] != "processing" or job["ingesting"]:
+        return None
+    eta = stats.eta(job["total_items"] - job["processed_items"])
+    return round(eta, 1) if eta is not None else None
+
+
+def _progress(job: Dict[str, Any]) -> Dict[str, Any]:
+    """The counters of a job (as returned by `job_store.get`), without its results."""
+    progress = {field: job.get(field) for field in JobProgress.__annotations__}
+    progress["eta_seconds"] = _eta(job)
+    return progress
+
+
+async def _missing_items(spool: DatasetSpool, done: FrozenSet[int]) -> AsyncIterator[Tuple[int, Any]]:
+    """The (index, item) pairs of the items that have no result yet."""
+    index = 0
+    async for item in spool.items():
+        if index not in done:
+            yield index, item
+        index += 1
+
+
+async def run_dataset_processing_job(job_id: str, spool: DatasetSpool):
     """
     A background task that manages the batch processing of a dataset.
 
-    This function simulates:
-    1.  **Data Parallelism**: Distributing individual data items to available nodes.
-    2.  **Dynamic Scheduling**: Using `get_best_node` for each item to spread the load.
-    3.  **Incremental Aggregation**: The results are collected as they are completed.
-        A real implementation of the "Aggregator Hub" would start merging/post-processing
-        results as soon as a certain threshold is met.
-    """
-    print(f"🚀 Starting dataset processing job {job_id} with {len(dataset)} items.")
-    with state.JOBS_LOCK:
-        job_info = state.DATASET_JOBS[job_id]
-        job_info["status"] = "processing"
-
-    # This loop simulates distributing data items and processing them.
-    for i, item in enumerate(dataset):
-        # For each item, find the best available node
-        node = await get_best_node()
-        if not node:
-            print(f"⚠️ No available nodes for job {job_id}. Stopping processing.")
-            break
-        
-        # Simulate the processing time on the node
-        await asyncio.sleep(random.uniform(0.5, 2.0)) # Fake processing time
-        
-        with state.JOBS_LOCK:
-            job_info["processed_items"] = i + 1
-            # Store a fake result
-            job_info["results"].append({"original": item, "output": f"Fake result for item {i+1}"})
-
-            # --- Incremental Merging Simulation ---
-            # This check simulates the trigger for the Aggregator Hub.
-            # In a real system, this could publish an event or call another service
-            # to begin post-processing the partially completed results.
-            if job_info["processed_items"] >= job_info["total_items"] * settings.INCREMENTAL_MERGE_THRESHOLD:
-                if not job_info.get("merge_triggered"):
-                    print(f"✨ Job {job_id}: Incremental merge threshold reached. Aggregation can begin.")
-                    job_info["merge_triggered"] = True
-
-    with state.JOBS_LOCK:
-        job_info["status"] = "completed"
-        job_info["end_time"] = time.time()
+    This function demonstrates:
+    1.  **Data Parallelism**: Items run concurrently on every node, up to each node's
+        concurrency slots (see `gateway.services.batch_engine`). They are read from the
+        upload's spool as it fills, so processing starts before the upload has finished.
+    2.  **Dynamic Scheduling**: Each item goes to the best node with a free slot, longest items
+        first and to the fastest nodes; failed items are retried on other nodes. The job's
+        throughput so far gives its estimated time to completion.
+    3.  **Incremental Aggregation**: The results are collected as they are completed. Once
+        `INCREMENTAL_MERGE_THRESHOLD` of them are in, the job's Aggregator Hub starts merging
+        them and keeps its aggregate up to date as more results arrive.
+    4.  **Checkpointing**: Every result is stored as soon as it completes, under its item's
+        index. A job resumed after a restart only runs the items that have no result yet.
+    5.  **Deduplication**: Unless the job opted out, identical items run once. A copy of an
+        item that already succeeded reuses its stored output, as does an item whose output
+        the memo store knows from an earlier job.
+    6.  **Fair Sharing**: The job shares the nodes with the other running jobs in proportion
+        to its weight, with at most `max_concurrency` of its items running at once.
+
+    Outputs go to the memo store under the model of the node that produced them, and only a
+    job with a `model` looks them up: a job without one may run on nodes serving any model.
+    """
+    job = job_store.get(job_id)
+    model = job.get("model")
+    dedupe = job.get("dedupe", False)
+    weight = job.get("weight") or settings.BATCH_DEFAULT_WEIGHT
+    max_in_flight = job.get("max_concurrency") or settings.BATCH_JOB_MAX_IN_FLIGHT or None
+    done = set()
+    # Where the output of each item key that succeeded is, among the job's results.
+    outputs: Dict[str, int] = {}
+    for position, result in enumerate(job_store.iter_results(job_id)):
+        done.add(result["index"])
+        if dedupe and result.get("error") is None:
+            outputs.setdefault(item_key(result["original"], model), position)
+    if done:
+        print(f"♻️ Resuming dataset processing job {job_id} ({len(done)} items already done).")
+    else:
+        print(f"🚀 Starting dataset processing job {job_id}.")
+    job_store.update(job_id, status="processing")
+    _notify(job_id)
+
+    def record(outcome: ItemOutcome):
+        if outcome.index in done:
+            return  # Each item is recorded once, whatever happens to the job.
+        result = outcome.to_result()
+        position = job_store.append_result(job_id, result, failed=outcome.error is not None)
+        done.add(outcome.index)
+        if dedupe and outcome.error is None:
+            outputs.setdefault(outcome.key, position)
+            if memo_store and not outcome.reused and (model or outcome.model):
+                memo_store.put(item_key(outcome.item, model or outcome.model), outcome.output)
+
+        # --- Incremental Merging ---
+        hub = aggregator_hubs[job_id]
+        if hub.started:
+            hub.add(result)
+        else:
+            job = job_store.get(job_id)
+            # While the upload is still arriving, the total is not known yet.
+            if not job["ingesting"] and job["processed_items"] >= job["total_items"] * settings.INCREMENTAL_MERGE_THRESHOLD:
+                print(f"✨ Job {job_id}: Incremental merge threshold reached. Aggregation begins.")
+                job_store.update(job_id, merge_triggered=True)
+                hub.start(_result_pages(job_id))
+        _notify(job_id)
+
+    def recall(key: str) -> Optional[str]:
+        if key in outputs:
+            return job_store.read_results(job_id, outputs[key], 1)[0]["output"]
+        return memo_store.get(key) if memo_store and model else None
+
+    stats = _BATCH_STATS[job_id] = BatchStats()
+    try:
+        await run_batch(_missing_items(spool, frozenset(done)), record, model=model, indexed=True,
+                        dedupe=dedupe, memo=recall if dedupe else None, stats=stats,
+                        weight=weight, max_in_flight=max_in_flight)
+        spool.close()
+        _BATCH_STATS.pop(job_id, None)
+
+        # Merges such as `summarize` may still have work to do on the last results.
+        hub = aggregator_hubs[job_id]
+        job_store.update(job_id, status="aggregating")
+        if not hub.started:
+            job_store.update(job_id, merge_triggered=True)
+            hub.start(_result_pages(job_id))
+        _notify(job_id)
+        await hub.finish()
+        # Hubs live in memory; the final aggregate is kept with the results.
+        job_store.save_aggregate(job_id, hub.snapshot())
+    except asyncio.CancelledError:
+        # The gateway is shutting down; the items stay on disk for the job to resume.
+        spool.close(keep=True)
+        _BATCH_STATS.pop(job_id, None)
+        raise
+    except Exception as e:
+        # The upload turned out to be invalid or was interrupted (a DatasetFormatError), or
+        # the nodes, the disk or a merge failed; the job stops where it is.
+        spool.close()
+        _BATCH_STATS.pop(job_id, None)
+        job_store.update(job_id, status="failed", error=str(e))
+        _notify(job_id)
+        print(f"❌ Job {job_id} failed: {e}")
+        return
+    finally:
+        _RUNNING_JOBS.pop(job_id, None)
+
+    job_store.update(job_id, status="completed")
+    _notify(job_id)
     print(f"✅ Job {job_id} completed.")
 
 
+def _result_pages(job_id: str) -> Iterator[List[Dict[str, Any]]]:
+    """The pages of the results a job has so far, for its hub to catch up on; later ones are added to it."""
+    return job_store.iter_result_pages(job_id, stop=job_store.result_count(job_id))
+
+
+def resume_unfinished_jobs():
+    """
+    Restarts the jobs that a previous run of the gateway left unfinished (see
+    `job_store.load`). Called once at startup.
+    """
+    for job_id in job_store.unfinished_job_ids():
+        job = job_store.get(job_id)
+        path = job_store.items_path(job_id)
+        if not os.path.exists(path):
+            job_store.update(job_id, status="failed", error="The items of the job were lost.")
+            continue
+        aggregator_hubs[job_id] = AggregatorHub(build_merges(job.get("aggregate") or settings.AGGREGATE_DEFAULT_MERGES))
+        spool = DatasetSpool.restore(path, job["total_items"])
+        _RUNNING_JOBS[job_id] = asyncio.create_task(run_dataset_processing_job(job_id, spool))
+
+
+def _parse_count(value: Optional[str]) -> Optional[int]:
+    """A count such as the `data_count` cut-off, if one was given (0 or an invalid value means none)."""
+    if value and value.strip().isdigit() and int(value.strip()) > 0:
+        return int(value.strip())
+    return None
+
+
+def _parse_flag(value: Optional[str]) -> Optional[bool]:
+    """A yes/no option, if one was given."""
+    value = (value or "").strip().lower()
+    if value in ("1", "true", "yes", "on"):
+        return True
+    if value in ("0", "false", "no", "off"):
+        return False
+    return None
+
+
+def _parse_weight(value: Optional[str]) -> Optional[float]:
+    """A job's `weight`, if a valid (positive) one was given."""
+    try:
+        weight = float((value or "").strip())
+    except ValueError:
+        return None
+    return weight if 0 < weight < float("inf") else None
+
+
 @router.post("/dataset/upload", tags=["Dataset Processing"])
-async def upload_dataset(
-    background_tasks: BackgroundTasks,
-    file: UploadFile = File(...),
-    data_count: str = Form(None)
-):
+async def upload_dataset(http_request: Request):
     """
-    Receives a dataset file, creates a background processing job, and returns a job ID.
+    Receives a dataset, creates a processing job for it, and returns the job ID.
+
+    The dataset is a JSON array or JSON Lines. It is sent either as the `file` field of a
+    multipart form, with an optional `data_count` field (placed before the file, it stops the
+    upload from being parsed any further once that many items were read), or as the raw
+    request body with `data_count` as a query parameter. The upload is parsed as it arrives
+    and the job starts processing the first items while the rest is still being received.
+
+    `aggregate` (a form field before the file, or a query parameter) picks the merges of the
+    job's Aggregator Hub, e.g. `vote,stats:topic`; see `gateway.services.aggregation`.
+
+    `dedupe` (a form field before the file, or a query parameter) turns the deduplication of
+    identical items on or off. It defaults to `DATASET_DEDUPE`, except for jobs that aggregate
+    with `vote`, whose identical items are meant to be sampled independently.
+
+    `weight` and `max_concurrency` (form fields before the file, or query parameters) set the
+    job's share of the nodes relative to the other running jobs (`BATCH_DEFAULT_WEIGHT` by
+    default) and the most items it runs at once (`BATCH_JOB_MAX_IN_FLIGHT` by default).
+
+    `model` (a form field before the file, or a query parameter) runs the job only on the
+    nodes serving that model.
     """
     job_id = str(uuid.uuid4())
-    content = await file.read()
+    aggregate = http_request.query_params.get("aggregate") or settings.AGGREGATE_DEFAULT_MERGES
+    try:
+        hub = AggregatorHub(build_merges(aggregate))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    aggregator_hubs[job_id] = hub
+
+    job_store.create(job_id, ingesting=True, aggregate=aggregate)
+    # The items are kept with the job, so that it can resume after a restart.
+    spool = DatasetSpool(limit=_parse_count(http_request.query_params.get("data_count")),
+                         path=job_store.items_path(job_id))
+    parser = JSONItemParser(max_item_bytes=settings.DATASET_MAX_ITEM_BYTES)
+
+    fields = {name: bytearray() for name in ("data_count", "aggregate", "dedupe", "weight", "max_concurrency", "model")}
+    file_started = False
+    job_started = False
+
+    def start_job():
+        # The job runs alongside the upload, reading items from the spool as they are parsed.
+        nonlocal job_started
+        if not job_started:
+            job_started = True
+            _RUNNING_JOBS[job_id] = asyncio.create_task(run_dataset_processing_job(job_id, spool))
+
+    def apply_fields():
+        # The form fields that came before the file are complete once the file starts.
+        if spool.limit is None:
+            spool.limit = _parse_count(fields["data_count"].decode("utf-8", "replace"))
+        if fields["aggregate"] and not aggregator_hubs[job_id].started:
+            aggregate = fields["aggregate"].decode("utf-8", "replace")
+            aggregator_hubs[job_id] = AggregatorHub(build_merges(aggregate))
+            job_store.update(job_id, aggregate=aggregate)
+        if not job_started:
+            dedupe = _parse_flag(fields["dedupe"].decode("utf-8", "replace") or http_request.query_params.get("dedupe"))
+            if dedupe is None:
+                merges = {merge.name for merge in aggregator_hubs[job_id].merges}
+                dedupe = settings.DATASET_DEDUPE and "vote" not in merges
+            weight = _parse_weight(fields["weight"].decode("utf-8", "replace") or http_request.query_params.get("weight"))
+            max_concurrency = _parse_count(fields["max_concurrency"].decode("utf-8", "replace")
+                                           or http_request.query_params.get("max_concurrency"))
+            model = (fields["model"].decode("utf-8", "replace") or http_request.query_params.get("model") or "").strip()
+            job_store.update(job_id, dedupe=dedupe, weight=weight, max_concurrency=max_concurrency, model=model or None)
+            start_job()
+
     try:
-        dataset = json.loads(content)
-        if not isinstance(dataset, list):
-            raise ValueError("JSON content must be an array of items.")
-    except (json.JSONDecodeError, ValueError) as e:
-        raise HTTPException(status_code=400, detail=f"Invalid JSON file: {e}")
-
-    # Allow user to select a subset of the data for processing
-    if data_count and str(data_count).strip().isdigit():
-        count = int(str(data_count).strip())
-        if 0 < count <= len(dataset):
-            dataset = dataset[:count]
-
-    with state.JOBS_LOCK:
-        state.DATASET_JOBS[job_id] = {
-            "status": "queued",
-            "total_items": len(dataset),
-            "processed_items": 0,
-            "start_time": time.time(),
-            "end_time": None,
-            "results": [],
-        }
-
-    # Add the processing task to run in the background
-    background_tasks.add_task(run_dataset_processing_job, job_id, dataset)
-    
-    return {"job_id": job_id, "message": f"Job created with {len(dataset)} items."}
+        async for name, data in upload_parts(http_request):
+            if name in fields:
+                fields[name] += data
+            elif name == "file":
+                if not file_started:
+                    file_started = True
+                    apply_fields()
+                if spool.full:
+                    continue  # Cut off: the rest of the upload is drained without being parsed.
+                spool.append(parser.feed(data))
+                job_store.update(job_id, total_items=spool.count)
+                _notify(job_id)
+        apply_fields()
+        if not spool.full:
+            spool.append(parser.close())
+    except (DatasetFormatError, ValueError, ClientDisconnect) as e:
+        if isinstance(e, ClientDisconnect):
+            error = DatasetFormatError("The upload was interrupted.")
+        else:
+            # A plain ValueError comes from an unknown merge name in `aggregate`.
+            error = e if isinstance(e, DatasetFormatError) else DatasetFormatError(str(e))
+        # The client never got the job's ID: the job is stopped and deleted with its files.
+        task = _RUNNING_JOBS.pop(job_id, None)
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        spool.close()
+        job_store.delete(job_id)
+        raise HTTPException(status_code=400, detail=f"Invalid dataset: {error}")
+
+    spool.finish()
+    job_store.update(job_id, total_items=spool.count, ingesting=False)
+    _notify(job_id)
+
+    return {"job_id": job_id, "message": f"Job created with {spool.count} items."}
 
 @router.get("/dataset/status/{job_id}", response_model=JobStatus, tags=["Dataset Processing"])
 async def get_dataset_status(job_id: str):
     """
-    Retrieves the current status and progress of a dataset processing job.
+    Retrieves the current status and progress of a dataset processing job, with all of its
+    results. For large jobs, prefer `/dataset/progress`, `/dataset/results` and `/dataset/events`.
+    """
+    job = job_store.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    job["results"] = job_store.read_results(job_id, 0, job["results_available"])
+    job["eta_seconds"] = _eta(job)
+    return job
+
+
+@router.get("/dataset/progress/{job_id}", response_model=JobProgress, tags=["Dataset Processing"])
+async def get_dataset_progress(job_id: str):
+    """
+    Retrieves the counters of a job without its results; its cost does not grow with the job.
+    """
+    job = job_store.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return _progress(job)
+
+
+@router.get("/dataset/results/{job_id}", response_model=JobResultsPage, tags=["Dataset Processing"])
+async def get_dataset_results(job_id: str, cursor: int = 0, limit: int = 100):
+    """
+    Returns up to `limit` results of a job, starting at `cursor` (0 for the first page).
+    Results are kept in the order they completed and never move, so a cursor stays valid
+    while the job is still adding results.
+    """
+    cursor = max(cursor, 0)
+    limit = min(max(limit, 1), RESULTS_PAGE_MAX)
+    job = job_store.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    page = job_store.read_results(job_id, cursor, limit)
+    next_cursor = cursor + len(page)
+    complete = job["status"] in FINISHED_STATUSES and next_cursor >= job["results_available"]
+    return {"job_id": job_id, "results": page, "next_cursor": next_cursor, "complete": complete}
+
+
+@router.get("/dataset/export/{job_id}", tags=["Dataset Processing"])
+async def export_dataset_results(job_id: str, fmt: str = Query("jsonl", alias="format"),
+                                 cursor: int = 0, end: Optional[int] = None, header: bool = True):
+    """
+    Downloads the results of a job as `jsonl`, `csv` or `parquet` (see
+    `gateway.services.export`), streamed from the job store a page at a time.
+
+    `cursor` and `end` pick the results [cursor, end), in the order of `/dataset/results`; a
+    download that broke off resumes at the cursor it got to, with `header=false` for CSV.
+    `X-Export-End` tells where a download ends (results added later are not included). The
+    full JSONL export of a finished job is its results file itself, which also supports
+    HTTP range requests.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown format '{fmt}'. Available: {', '.join(EXPORT_FORMATS)}.")
+    if not format_available(fmt):
+        raise HTTPException(status_code=501, detail=f"The {fmt} export needs pyarrow, which is not installed.")
+    job = job_store.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found.")
+
+    cursor = max(cursor, 0)
+    end = job["results_available"] if end is None else min(max(end, cursor), job["results_available"])
+    headers = {"X-Export-Start": str(cursor), "X-Export-End": str(end)}
+
+    results_file = job_store.results_file(job_id)
+    if fmt == "jsonl" and results_file and cursor == 0 and end == job["results_available"]:
+        return FileResponse(results_file, media_type=MEDIA_TYPES[fmt], filename=f"{job_id}.{fmt}", headers=headers)
+
+    headers["Content-Disposition"] = f'attachment; filename="{job_id}.{fmt}"'
+    pages = job_store.iter_result_pages(job_id, cursor, end, page_size=EXPORT_PAGE_RESULTS)
+    return StreamingResponse(export_results(fmt, pages, header=header), media_type=MEDIA_TYPES[fmt], headers=headers)
+
+
+@router.get("/dataset/events/{job_id}", tags=["Dataset Processing"])
+async def stream_dataset_events(job_id: str, http_request: Request, cursor: int = 0):
+    """
+    A server-sent-events stream of a job. It pushes each new result once (`result` events,
+    whose `id` is the cursor after that result) and the job's counters whenever they change
+    (`progress` events), and ends with an `end` event when the job has finished.
+
+    The stream starts at `cursor`, or after the `Last-Event-ID` an EventSource sends when it
+    reconnects, so no result is missed or sent twice.
+    """
+    last_event_id = http_request.headers.get("last-event-id", "")
+    if last_event_id.isdigit():
+        cursor = int(last_event_id)
+    cursor = max(cursor, 0)
+    if job_store.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+
+    async def events():
+        nonlocal cursor
+        last_progress = None
+        while True:
+            # Taken before reading the job, so an update made while we send is not missed.
+            update = _JOB_UPDATES.setdefault(job_id, asyncio.Event())
+            job = job_store.get(job_id)
+            if job is None:
+                return  # Evicted.
+            new_results = job_store.read_results(job_id, cursor, RESULTS_PAGE_MAX)
+            progress = _progress(job)
+
+            for result in new_results:
+                cursor += 1
+                yield f"id: {cursor}\nevent: result\ndata: {json.dumps(result, ensure_ascii=False)}\n\n"
+            if progress != last_progress:
+                last_progress = progress
+                yield f"event: progress\ndata: {json.dumps(progress)}\n\n"
+            if progress["status"] in FINISHED_STATUSES and cursor >= progress["results_available"]:
+                _JOB_UPDATES.pop(job_id, None)
+                yield "event: end\ndata: {}\n\n"
+                return
+            if len(new_results) == RESULTS_PAGE_MAX:
+                continue  # More results are waiting already.
+
+            try:
+                await asyncio.wait_for(update.wait(), EVENTS_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+
+    return StreamingResponse(until_disconnect(http_request, events()), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+
+@router.get("/dataset/aggregate/{job_id}", tags=["Dataset Processing"])
+async def get_dataset_aggregate(job_id: str):
+    """
+    Returns the running aggregate of a job's Aggregator Hub. Its `state` is `waiting` until
+    the merge threshold is reached, `catching_up` while the results that were in by then are
+    merged, `running` while results are still being merged in as they arrive, and
+    `final` once the job has completed.
+
+    Hubs live in memory. The final aggregate of a job that completed before the gateway
+    restarted is served from the job store; a job that failed has none after a restart.
     """
-    with state.JOBS_LOCK:
-        job = state.DATASET_JOBS.get(job_id)
-        if not job:
-            raise HTTPException(status_code=404, detail="Job not found.")
-        # Return a copy to avoid modification outside the lock
-        return job.copy()
+    hub = aggregator_hubs.get(job_id)
+    job = job_store.get(job_id)
+    if hub is not None:
+        aggregate = hub.snapshot()
+    elif job is not None:
+        aggregate = job_store.read_aggregate(job_id)
+        if aggregate is None:
+            raise HTTPException(status_code=404, detail="The aggregate of this job is no longer available.")
+    else:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    job = job or {}
+    progress = {"processed_items": job.get("processed_items", 0), "total_items": job.get("total_items", 0)}
+    return {"job_id": job_id, **progress, **aggregate}
@@ -6,12 +6,16 @@ of the InferOps cluster. It exposes cached data collected by the background
 health and monitoring services.
 """
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+from starlette.requests import ClientDisconnect
 from typing import List, Set
 
 from gateway.core import state
+from gateway.core.health import is_node_address, receive_telemetry
 from gateway.models.api_models import NodeStatus, Alert
 from gateway.services.locking import unlock_node
+from gateway.utils.metrics import render_metrics
 from gateway.config import settings
 
 router = APIRouter()
@@ -53,12 +57,43 @@ async def get_available_models() -> List[str]:
                 models.add(status["metrics"]["model_id"])
     return sorted(list(models))
 
+@router.get("/metrics", response_class=PlainTextResponse, tags=["Monitoring"])
+async def get_gateway_metrics():
+    """
+    Exposes the gateway's own metrics (routing, queueing, latency) in the Prometheus
+    text format, so they can be scraped alongside the node exporters.
+    """
+    return render_metrics()
+
+@router.post("/nodes/{node_id}/telemetry", tags=["Monitoring"])
+async def push_node_telemetry(node_id: int, http_request: Request):
+    """
+    The endpoint the monitor agents push their metrics to, as one long-lived chunked request
+    of NDJSON messages (see `gateway.core.health.receive_telemetry`). It answers once the
+    agent ends the stream, or after its heartbeat has stopped and the node was marked offline.
+    Only the node itself (an address its configured URLs resolve to) may push its metrics.
+    """
+    node_config = next((node for node in settings.NODES if node["id"] == node_id), None)
+    if node_config is None:
+        raise HTTPException(status_code=404, detail="Node not found.")
+    client = http_request.client
+    if client is None or not await is_node_address(node_config, client.host):
+        raise HTTPException(status_code=403, detail="Telemetry must come from the node itself.")
+    try:
+        received = await receive_telemetry(node_config, http_request.stream())
+    except ClientDisconnect:
+        # The agent went away; the node is polled again until it reconnects.
+        return {"status": "disconnected"}
+    except (ValueError, KeyError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid telemetry: {e}")
+    return {"status": "closed", "received": received}
+
 @router.post("/unlock/all", tags=["Admin"])
 async def unlock_all_nodes():
     """
-    An administrative endpoint to force-unlock all configured nodes.
-    This is a safety measure to recover nodes that might get stuck in a 'locked'
-    state due to an unexpected error or client disconnection.
+    An administrative endpoint to force-unlock all configured nodes, freeing every slot.
+    Gateway leases expire on their own, so this is no longer needed for recovery; it
+    remains as a manual override, e.g. for slots taken directly through an agent's `/lock`.
     """
     unlocked_nodes = []
     failed_nodes = []
@@ -18,7 +18,29 @@ class Settings:
     
     # --- Monitoring and Health Checks ---
     HEALTH_CHECK_INTERVAL: int = config("HEALTH_CHECK_INTERVAL", default=5, cast=int) # seconds
+    # A node that pushes its metrics is marked offline once it sends nothing for this long
+    # (agents send a heartbeat at least every `TELEMETRY_INTERVAL`; see monitor_agent/agent.py).
+    TELEMETRY_HEARTBEAT_TIMEOUT: float = config("TELEMETRY_HEARTBEAT_TIMEOUT", default=2.0, cast=float) # seconds
     REQUEST_TIMEOUT: int = config("REQUEST_TIMEOUT", default=120, cast=int) # seconds
+    # How many times a chat stream is moved to another node when its node fails mid-stream.
+    STREAM_FAILOVER_ATTEMPTS: int = config("STREAM_FAILOVER_ATTEMPTS", default=2, cast=int)
+    # A node that failed a request stays out of the pool this long, whatever its agent reports
+    # (the agent may still answer while the node's LLM server is down).
+    NODE_QUARANTINE_SECONDS: float = config("NODE_QUARANTINE_SECONDS", default=10.0, cast=float) # seconds
+
+    # --- Per-Node HTTP Connection Pools ---
+    # Each node's LLM pool holds one connection per concurrency slot plus this many spare ones
+    # (for hedges and failovers); connections stay open for HTTP_KEEPALIVE_EXPIRY when idle.
+    HTTP_POOL_EXTRA_CONNECTIONS: int = config("HTTP_POOL_EXTRA_CONNECTIONS", default=2, cast=int)
+    HTTP_MONITOR_CONNECTIONS: int = config("HTTP_MONITOR_CONNECTIONS", default=4, cast=int)
+    HTTP_KEEPALIVE_EXPIRY: float = config("HTTP_KEEPALIVE_EXPIRY", default=60.0, cast=float) # seconds
+    HTTP_CONNECT_TIMEOUT: float = config("HTTP_CONNECT_TIMEOUT", default=3.0, cast=float) # seconds
+
+    # --- Node Leases ---
+    # Slots are reserved through gateway-local leases. A lease that is not renewed within
+    # LEASE_TTL expires on its own; agents receive batched renewals every LEASE_RENEW_INTERVAL.
+    LEASE_TTL: int = config("LEASE_TTL", default=15, cast=int) # seconds
+    LEASE_RENEW_INTERVAL: int = config("LEASE_RENEW_INTERVAL", default=5, cast=int) # seconds
 
     # --- Node Configuration ---
     # In a real-world scenario, this would be loaded from a dynamic configuration source
@@ -30,6 +52,7 @@ class Settings:
             "monitor_base_url": "http://100.76.208.127:8001",
             "llm_url": "http://100.76.208.127:11434/api/chat", # Ollama endpoint
             "static_weight": 10.0,  # Represents static performance factors like TFLOPS.
+            "max_concurrency": 4,   # Parallel requests the node may serve (Ollama's OLLAMA_NUM_PARALLEL).
         },
         {
             "id": 2, 
@@ -37,6 +60,7 @@ class Settings:
             "monitor_base_url": "http://100.118.49.57:8001",
             "llm_url": "http://100.118.49.57:11434/api/chat", # Ollama endpoint
             "static_weight": 7.5,
+            "max_concurrency": 2,
         },
         {
             "id": 3, 
@@ -44,13 +68,109 @@ class Settings:
             "monitor_base_url": "http://100.99.253.87:8001",
             "llm_url": "http://100.99.253.87:11434/api/chat", # Ollama endpoint
             "static_weight": 5.0,
+            "max_concurrency": 1,
         },
     ]
 
+    # --- Latency-Aware Scheduling ---
+    # Smoothing factor of the per-node, per-model TTFT and tokens/sec EWMAs.
+    LATENCY_EWMA_ALPHA: float = config("LATENCY_EWMA_ALPHA", default=0.2, cast=float)
+    # Typical response length used to turn TTFT and decode rate into an expected completion time.
+    EXPECTED_OUTPUT_TOKENS: int = config("EXPECTED_OUTPUT_TOKENS", default=256, cast=int)
+    # Expected completion time at which latency neither raises nor lowers a node's score.
+    LATENCY_REFERENCE_SECONDS: float = config("LATENCY_REFERENCE_SECONDS", default=10.0, cast=float)
+
+    # --- Routing Mode ---
+    # 'score' sends every request to the best-scoring node. 'prefix_affinity' keeps the turns
+    # of a conversation on the node holding its KV cache, via bounded-load consistent hashing.
+    ROUTING_MODE: str = config("ROUTING_MODE", default="score")
+    # A node may carry at most this multiple of its fair share of load before conversations spill over.
+    AFFINITY_LOAD_FACTOR: float = config("AFFINITY_LOAD_FACTOR", default=1.25, cast=float)
+    # Number of conversations whose last node is remembered for hit-rate reporting.
+    AFFINITY_TABLE_SIZE: int = config("AFFINITY_TABLE_SIZE", default=100000, cast=int)
+
+    # --- Admission Control ---
+    # Requests that find every suitable node busy wait in a bounded queue instead of failing.
+    ADMISSION_MAX_DEPTH: int = config("ADMISSION_MAX_DEPTH", default=256, cast=int)
+    ADMISSION_ORDERING: str = config("ADMISSION_ORDERING", default="fifo") # 'fifo' or 'priority'
+    ADMISSION_DEFAULT_DEADLINE: float = config("ADMISSION_DEFAULT_DEADLINE", default=30.0, cast=float) # seconds
+
+    # --- Traffic Classes (QoS) ---
+    # Slots kept free for interactive chat: batch items only take a slot while more than this
+    # many are free in their pool, and none while chat requests wait for one. A pool smaller
+    # than this still lets batch work use one slot.
+    QOS_INTERACTIVE_RESERVED_SLOTS: int = config("QOS_INTERACTIVE_RESERVED_SLOTS", default=1, cast=int)
+
+    # --- Hedged Requests ---
+    # A request with `hedge` set is sent to a second node if the first has not produced a token
+    # within the HEDGE_QUANTILE of recently observed TTFTs; the first node to stream wins.
+    HEDGE_QUANTILE: float = config("HEDGE_QUANTILE", default=0.95, cast=float)
+    HEDGE_MIN_DELAY: float = config("HEDGE_MIN_DELAY", default=0.05, cast=float) # seconds
+    HEDGE_FALLBACK_DELAY: float = config("HEDGE_FALLBACK_DELAY", default=1.0, cast=float) # seconds, until enough TTFTs are known
+    # Hedges may add at most this percentage of extra requests to the cluster.
+    HEDGE_BUDGET_PERCENT: float = config("HEDGE_BUDGET_PERCENT", default=5.0, cast=float)
+
+    # --- Response Cache ---
+    # Deterministic requests (temperature 0) are coalesced while running and their answers cached.
+    RESPONSE_CACHE_ENABLED: bool = config("RESPONSE_CACHE_ENABLED", default=True, cast=bool)
+    RESPONSE_CACHE_MAX_ENTRIES: int = config("RESPONSE_CACHE_MAX_ENTRIES", default=1024, cast=int)
+    RESPONSE_CACHE_MAX_BYTES: int = config("RESPONSE_CACHE_MAX_BYTES", default=64 * 1024 * 1024, cast=int)
+    RESPONSE_CACHE_TTL: float = config("RESPONSE_CACHE_TTL", default=300.0, cast=float) # seconds
+
     # --- Batch Processing & Aggregation ---
+    # A dataset item is tried on up to this many nodes before it is reported as failed.
+    BATCH_MAX_ATTEMPTS: int = config("BATCH_MAX_ATTEMPTS", default=3, cast=int)
+    # A job that finds no node online to run its items on for this long fails its remaining items
+    # (waiting for busy nodes, or for slots reserved for interactive traffic, does not count).
+    BATCH_IDLE_TIMEOUT: float = config("BATCH_IDLE_TIMEOUT", default=60.0, cast=float) # seconds
+    # Order in which a job dispatches its items: `longest_first` (by estimated cost, with the
+    # longest items going to the fastest nodes; see services/batch_engine.py) or `fifo`.
+    BATCH_DISPATCH_ORDER: str = config("BATCH_DISPATCH_ORDER", default="longest_first")
+    # Number of upcoming items a job looks at to choose the next one to dispatch.
+    BATCH_LOOKAHEAD: int = config("BATCH_LOOKAHEAD", default=256, cast=int)
+    # Concurrent jobs share the nodes in proportion to their weights (weighted fair queueing).
+    # This is the weight of a job whose upload does not give one.
+    BATCH_DEFAULT_WEIGHT: float = config("BATCH_DEFAULT_WEIGHT", default=1.0, cast=float)
+    # Most items of one job running at once, unless its upload gives a cap (0 means no cap).
+    BATCH_JOB_MAX_IN_FLIGHT: int = config("BATCH_JOB_MAX_IN_FLIGHT", default=0, cast=int)
+    # Largest single item accepted in a dataset upload (uploads themselves are not size-limited).
+    DATASET_MAX_ITEM_BYTES: int = config("DATASET_MAX_ITEM_BYTES", default=16 * 1024 * 1024, cast=int)
     # Threshold for the incremental merging strategy in the Result Aggregation Module.
     # The aggregation process begins once this percentage of results is available.
     INCREMENTAL_MERGE_THRESHOLD: float = config("INCREMENTAL_MERGE_THRESHOLD", default=0.5, cast=float)
+    # The merges a job's Aggregator Hub runs unless the upload names others (see services/aggregation.py).
+    AGGREGATE_DEFAULT_MERGES: str = config("AGGREGATE_DEFAULT_MERGES", default="stats")
+    # Number of texts the `summarize` merge reduces into one summary at a time.
+    AGGREGATE_SUMMARY_FAN_IN: int = config("AGGREGATE_SUMMARY_FAN_IN", default=8, cast=int)
+    # Most characters of output the `concat` merge keeps; the rest is in the job's results.
+    AGGREGATE_CONCAT_MAX_CHARS: int = config("AGGREGATE_CONCAT_MAX_CHARS", default=1_000_000, cast=int)
+    # Most distinct inputs the `vote` merge keeps the answers of.
+    AGGREGATE_VOTE_MAX_GROUPS: int = config("AGGREGATE_VOTE_MAX_GROUPS", default=10_000, cast=int)
+    # Most distinct categories the `stats` merge keeps apart; the rest are counted together as other.
+    AGGREGATE_STATS_MAX_CATEGORIES: int = config("AGGREGATE_STATS_MAX_CATEGORIES", default=1000, cast=int)
+
+    # --- Job Store ---
+    # Where dataset jobs keep their metadata and (append-only) result files.
+    JOB_STORE_DIR: str = config("JOB_STORE_DIR", default="data/jobs")
+    # Finished jobs are deleted this long after they end.
+    JOB_STORE_TTL: float = config("JOB_STORE_TTL", default=24 * 3600.0, cast=float) # seconds
+    # Once the finished jobs take more disk space than this, the oldest ones are deleted.
+    JOB_STORE_MAX_BYTES: int = config("JOB_STORE_MAX_BYTES", default=1024 * 1024 * 1024, cast=int)
+    # Jobs are only deleted for size once they ended at least this long ago (the TTL still applies),
+    # so their results can be fetched even if they alone exceed the budget.
+    JOB_STORE_MIN_RETENTION: float = config("JOB_STORE_MIN_RETENTION", default=3600.0, cast=float) # seconds
+    # Number of newest results of each running job kept in memory for progress streams.
+    JOB_STORE_HOT_RESULTS: int = config("JOB_STORE_HOT_RESULTS", default=1000, cast=int)
+    JOB_STORE_EVICT_INTERVAL: float = config("JOB_STORE_EVICT_INTERVAL", default=60.0, cast=float) # seconds
+
+    # --- Item Deduplication & Memo Store ---
+    # Identical items (same messages and model) of a job run once and share the output, unless
+    # the upload says otherwise (and by default when it aggregates with `vote`).
+    DATASET_DEDUPE: bool = config("DATASET_DEDUPE", default=True, cast=bool)
+    # A SQLite file that keeps item outputs across jobs, for reprocessing runs; empty to disable.
+    MEMO_STORE_PATH: str = config("MEMO_STORE_PATH", default="")
+    # Once the stored outputs take more than this, the least recently used ones are deleted.
+    MEMO_STORE_MAX_BYTES: int = config("MEMO_STORE_MAX_BYTES", default=256 * 1024 * 1024, cast=int)
 
     # --- External Services ---
     PROMETHEUS_URL: str = config("PROMETHEUS_URL", default="http://localhost:9090")
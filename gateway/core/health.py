@@ -3,15 +3,46 @@ InferOps - Automated Failure Handling Module (Health Checks)
 
 This module is a key part of the platform's resilience strategy. It continuously
 monitors the health of all registered compute nodes to ensure high availability.
+
+Agents push their metrics to the gateway over a long-lived chunked HTTP request (see
+`receive_telemetry`): a full snapshot first, then only the fields that changed, at
+sub-second intervals, with empty heartbeats in between. A node whose heartbeat stops for
+`TELEMETRY_HEARTBEAT_TIMEOUT` seconds is marked offline. A node that failed a request is
+quarantined: it stays offline for `NODE_QUARANTINE_SECONDS` whatever its agent reports. Nodes that do not push (or whose
+stream has ended) are polled on their `/status` endpoint every `HEALTH_CHECK_INTERVAL`.
+When an agent reconnects, its new stream supersedes the old one, which is dropped at once.
 """
 
 import asyncio
+import ipaddress
+import itertools
+import json
+import socket
+import time
 import httpx
+from typing import Any, AsyncIterator, Dict, Set
+from urllib.parse import urlparse
 from gateway.config import settings
 from gateway.core import state
+from gateway.core.scheduler import scheduler_index
+from gateway.services.http_pool import node_clients
+from gateway.utils.metrics import Counter, Gauge
+from gateway.utils.streaming import NDJSONFramer
+
+TELEMETRY_STREAMS = Gauge("inferops_telemetry_streams", "Agents currently pushing their metrics to the gateway.")
+TELEMETRY_UPDATES = Counter(
+    "inferops_telemetry_updates_total",
+    "Telemetry messages pushed by the agents, by kind ('snapshot', 'delta' or 'heartbeat').",
+    ["kind"],
+)
+TELEMETRY_TIMEOUTS = Counter("inferops_telemetry_timeouts_total", "Telemetry streams whose heartbeat stopped.")
 
-# Create a reusable HTTP client for health checks
-health_client = httpx.AsyncClient(timeout=settings.HEALTH_CHECK_INTERVAL - 1)
+# The nodes whose agents are pushing their metrics (they are not polled), with the generation
+# of their latest stream. Only that stream's messages are applied.
+_pushing: Dict[int, int] = {}
+_stream_generations = itertools.count(1)
+# The quarantined nodes, with the (monotonic) time their quarantine ends.
+_quarantined_until: Dict[int, float] = {}
 
 async def health_check_nodes_periodically():
     """
@@ -24,11 +55,47 @@ async def health_check_nodes_periodically():
     """
     print("🩺 Health check service started.")
     while True:
-        # Run checks for all nodes concurrently
-        await asyncio.gather(*(fetch_single_node_status(node) for node in settings.NODES))
+        # Run checks for all nodes concurrently; the nodes that push their metrics are skipped
+        await asyncio.gather(*(
+            fetch_single_node_status(node) for node in settings.NODES if node["id"] not in _pushing
+        ))
         # Wait for the next interval
         await asyncio.sleep(settings.HEALTH_CHECK_INTERVAL)
 
+def apply_node_metrics(node_config: dict, metrics: Dict[str, Any]):
+    """Records the latest metrics of a node that answered, marking it as online."""
+    node_id = node_config["id"]
+    if node_id in _quarantined_until:
+        if time.monotonic() < _quarantined_until[node_id]:
+            return  # The metrics are taken up again once the quarantine is over.
+        del _quarantined_until[node_id]
+    with state.CACHE_LOCK:
+        came_online = not state.NODE_STATUS_CACHE[node_id]["online"]
+        # Update the cache with the latest metrics and mark the node as online
+        state.NODE_STATUS_CACHE[node_id].update(online=True, metrics=metrics)
+        # Cache the static CPU info if available
+        if metrics.get("cpu_info"):
+            state.CPU_INFO_CACHE[node_id] = metrics.get("cpu_info")
+    # Keep the scheduler index in step with the cache
+    scheduler_index.update_node(node_config, online=True, metrics=metrics)
+    if came_online:
+        # Open the LLM connections now rather than on the first user request
+        asyncio.create_task(node_clients.warm_up(node_config))
+
+def mark_node_offline(node_config: dict, message: str):
+    """Takes a node out of the scheduling pool, logging `message` if it was online."""
+    node_id = node_config["id"]
+    with state.CACHE_LOCK:
+        if state.NODE_STATUS_CACHE[node_id]["online"]:
+            print(message)
+        state.NODE_STATUS_CACHE[node_id].update(online=False, metrics=None)
+    scheduler_index.update_node(node_config, online=False, metrics=None)
+
+def quarantine_node(node_config: dict, message: str):
+    """Takes a node that failed a request out of the pool for `NODE_QUARANTINE_SECONDS`, logging `message`."""
+    _quarantined_until[node_config["id"]] = time.monotonic() + settings.NODE_QUARANTINE_SECONDS
+    mark_node_offline(node_config, message)
+
 async def fetch_single_node_status(node_config: dict):
     """
     Asynchronously fetches the status of a single compute node.
@@ -40,27 +107,101 @@ async def fetch_single_node_status(node_config: dict):
     url = f"{node_config['monitor_base_url']}/status"
     
     try:
-        response = await health_client.get(url)
+        # Health checks use the node's own monitor pool, so a hung node cannot starve the others
+        response = await node_clients.monitor(node_config).get(url)
         
         # If the node responds with a 200 OK status
         if response.status_code == 200:
-            metrics = response.json()
-            with state.CACHE_LOCK:
-                # Update the cache with the latest metrics and mark the node as online
-                state.NODE_STATUS_CACHE[node_id].update(online=True, metrics=metrics)
-                # Cache the static CPU info if available
-                if metrics.get("cpu_info"):
-                    state.CPU_INFO_CACHE[node_id] = metrics.get("cpu_info")
+            apply_node_metrics(node_config, response.json())
         else:
             # If the node returns a non-200 status, it's considered offline
-            with state.CACHE_LOCK:
-                if state.NODE_STATUS_CACHE[node_id]["online"]:
-                    print(f"⚠️ Node {node_id} is now offline. Status: {response.status_code}")
-                state.NODE_STATUS_CACHE[node_id].update(online=False, metrics=None)
+            mark_node_offline(node_config, f"⚠️ Node {node_id} is now offline. Status: {response.status_code}")
                 
     except httpx.RequestError as e:
         # If there's a connection error (e.g., timeout, DNS failure), mark as offline
-        with state.CACHE_LOCK:
-            if state.NODE_STATUS_CACHE[node_id]["online"]:
-                print(f"🚨 Node {node_id} connection failed: {e}. Marking as offline.")
-            state.NODE_STATUS_CACHE[node_id].update(online=False, metrics=None)
+        mark_node_offline(node_config, f"🚨 Node {node_id} connection failed: {e}. Marking as offline.")
+
+async def is_node_address(node_config: dict, host: str) -> bool:
+    """Whether `host` (a client IP) is an address of the node, as given by its configured URLs."""
+    addresses: Set[str] = set()
+    loop = asyncio.get_running_loop()
+    for url in (node_config.get("monitor_base_url"), node_config.get("llm_url")):
+        hostname = urlparse(url).hostname if url else None
+        if not hostname:
+            continue
+        try:
+            addresses.add(_normalize_ip(hostname))
+            continue
+        except ValueError:
+            pass
+        try:
+            infos = await loop.getaddrinfo(hostname, None, type=socket.SOCK_STREAM)
+        except socket.gaierror:
+            continue
+        addresses.update(_normalize_ip(info[4][0]) for info in infos)
+    try:
+        return _normalize_ip(host) in addresses
+    except ValueError:
+        return False
+
+def _normalize_ip(address: str) -> str:
+    """An IP address in canonical form (IPv4-mapped IPv6 addresses as plain IPv4); raises ValueError."""
+    ip = ipaddress.ip_address(address.split("%")[0])
+    return str(getattr(ip, "ipv4_mapped", None) or ip)
+
+async def receive_telemetry(node_config: dict, chunks: AsyncIterator[bytes]) -> int:
+    """
+    Applies the metrics an agent pushes, until its stream ends or its heartbeat stops.
+
+    The stream is NDJSON: `{"full": true, "metrics": {...}}` carries a whole status snapshot
+    (it must come first), `{"metrics": {...}}` only the top-level fields that changed, and
+    `{}` is a heartbeat. While the stream is open the node is not polled.
+
+    Returns:
+        int: The number of messages received.
+    """
+    node_id = node_config["id"]
+    framer = NDJSONFramer()
+    metrics = None
+    received = 0
+    generation = _pushing[node_id] = next(_stream_generations)
+    TELEMETRY_STREAMS.set(len(_pushing))
+    chunks = chunks.__aiter__()
+    try:
+        while True:
+            try:
+                chunk = await asyncio.wait_for(chunks.__anext__(), settings.TELEMETRY_HEARTBEAT_TIMEOUT)
+            except StopAsyncIteration:
+                return received
+            except asyncio.TimeoutError:
+                if _pushing.get(node_id) != generation:
+                    return received  # Superseded; the newer stream speaks for the node.
+                TELEMETRY_TIMEOUTS.inc()
+                mark_node_offline(node_config, f"🚨 Node {node_id} stopped sending heartbeats. Marking as offline.")
+                return received
+            if _pushing.get(node_id) != generation:
+                # The agent has reconnected: samples still arriving here are older than its new stream's.
+                return received
+            for line in framer.feed(chunk):
+                message = json.loads(line)
+                received += 1
+                if message.get("full"):
+                    kind = "snapshot"
+                    metrics = message["metrics"]
+                elif message.get("metrics"):
+                    if metrics is None:
+                        raise ValueError("A telemetry delta came before the first snapshot.")
+                    kind = "delta"
+                    metrics = {**metrics, **message["metrics"]}
+                else:
+                    TELEMETRY_UPDATES.inc(kind="heartbeat")
+                    if metrics is not None and node_id in _quarantined_until:
+                        # An idle node may send nothing but heartbeats after its quarantine.
+                        apply_node_metrics(node_config, metrics)
+                    continue
+                TELEMETRY_UPDATES.inc(kind=kind)
+                apply_node_metrics(node_config, metrics)
+    finally:
+        if _pushing.get(node_id) == generation:  # Not replaced by a newer stream of the same agent.
+            del _pushing[node_id]
+        TELEMETRY_STREAMS.set(len(_pushing))
@@ -0,0 +1,92 @@
+"""
+InferOps - Latency Tracking
+
+This module keeps exponentially weighted moving averages (EWMAs) of the latency
+actually observed on each node, per model:
+- time-to-first-token (TTFT), measured by the gateway on the chat stream;
+- decode rate in tokens/sec, taken from Ollama's `eval_count` / `eval_duration`
+  in the final message of a stream.
+
+The scheduler uses these to favour the node that is expected to finish fastest.
+"""
+
+import threading
+from collections import deque
+from typing import Dict, Any, Optional, Tuple
+from gateway.config import settings
+
+
+class LatencyTracker:
+    """Per-node, per-model EWMAs of TTFT and decode throughput."""
+
+    def __init__(self, alpha: float = 0.2, window: int = 512):
+        self.alpha = alpha
+        self._lock = threading.Lock()
+        # Key: (node_id, model_id)
+        # Value: {"ttft": seconds, "tokens_per_sec": float, "samples": int}
+        self._stats: Dict[Tuple[int, Optional[str]], Dict[str, Any]] = {}
+        # The most recent raw TTFTs per model (and across all models under None), for quantiles.
+        self._window = window
+        self._ttft_samples: Dict[Optional[str], deque] = {}
+
+    def record(self, node_id: int, model_id: Optional[str], ttft: Optional[float] = None, tokens_per_sec: Optional[float] = None):
+        """Folds one observation into the EWMAs of a node/model pair."""
+        with self._lock:
+            stats = self._stats.setdefault((node_id, model_id), {"ttft": None, "tokens_per_sec": None, "samples": 0})
+            if ttft is not None:
+                stats["ttft"] = self._blend(stats["ttft"], ttft)
+                for key in {model_id, None}:
+                    self._ttft_samples.setdefault(key, deque(maxlen=self._window)).append(ttft)
+            if tokens_per_sec:
+                stats["tokens_per_sec"] = self._blend(stats["tokens_per_sec"], tokens_per_sec)
+            stats["samples"] += 1
+
+    def estimate(self, node_id: int, model_id: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Returns a copy of the current EWMAs, or None until both TTFT and throughput are known."""
+        with self._lock:
+            stats = self._stats.get((node_id, model_id))
+            if not stats or stats["ttft"] is None or not stats["tokens_per_sec"]:
+                return None
+            return dict(stats)
+
+    def ttft_quantile(self, q: float, model_id: Optional[str] = None, min_samples: int = 20) -> Optional[float]:
+        """
+        Returns the q-quantile of the recent TTFTs of a model (of all models if None),
+        or None while fewer than `min_samples` have been observed.
+        """
+        with self._lock:
+            samples = sorted(self._ttft_samples.get(model_id, ()))
+        if len(samples) < min_samples:
+            return None
+        return samples[min(int(q * len(samples)), len(samples) - 1)]
+
+    def snapshot(self) -> Dict[Tuple[int, Optional[str]], Dict[str, Any]]:
+        """Returns a copy of all tracked statistics."""
+        with self._lock:
+            return {key: dict(stats) for key, stats in self._stats.items()}
+
+    def _blend(self, current: Optional[float], sample: float) -> float:
+        if current is None:
+            return sample
+        return self.alpha * sample + (1 - self.alpha) * current
+
+
+# The process-wide tracker, fed by the chat stream.
+latency_tracker = LatencyTracker(alpha=settings.LATENCY_EWMA_ALPHA)
+
+
+def expected_completion_seconds(estimate: Dict[str, Any], output_tokens: int) -> float:
+    """Expected wall time of a request: TTFT plus the time to decode `output_tokens`."""
+    return estimate["ttft"] + output_tokens / estimate["tokens_per_sec"]
+
+
+def tokens_per_sec_from_final_chunk(final: Dict[str, Any]) -> Optional[float]:
+    """
+    Extracts the decode rate (tokens/sec) from the final message of an Ollama stream.
+    `eval_duration` is reported in nanoseconds.
+    """
+    eval_count = final.get("eval_count")
+    eval_duration = final.get("eval_duration")
+    if not eval_count or not eval_duration:
+        return None
+    return eval_count / (eval_duration / 1e9)
@@ -5,77 +5,522 @@ This module implements the core logic for the dynamic task scheduling algorithm,
 as described in the InferOps research paper. Its primary responsibility is to select
 the most suitable compute node for a given task based on a combination of static
 performance metrics and real-time dynamic load data.
+
+Scores are not recomputed on every request. Instead, the `SchedulerIndex` keeps one
+priority heap per model id (plus one for "any model") that is updated incrementally
+whenever a health check or a reservation changes a node. Picking the best node is then
+an O(log n) heap operation, so selection cost stays flat as the cluster grows.
+
+Each node exposes a number of concurrency slots (`max_concurrency` in the node config,
+capped by what the node's agent reports). A node stays schedulable while it has a free
+slot, and its score is scaled by the share of slots that are still free, so strong nodes
+can take several requests at once before weaker ones are used.
+
+Once a node has served a model, the TTFT and decode rate observed on the chat stream (see
+`gateway.core.latency`) also feed into its score, favouring the node expected to finish fastest.
+
+Slots are taken by one of two traffic classes: `interactive` (chat) and `batch` (dataset
+items). Batch work only fills the slots left over once `QOS_INTERACTIVE_RESERVED_SLOTS` are
+kept free for interactive requests (see `batch_headroom`); it never preempts running work.
+
+In the `prefix_affinity` routing mode, follow-up turns of a conversation are sent back to
+the node that already holds its KV cache. Conversations are placed with consistent hashing
+with bounded loads: a conversation goes to the first node clockwise on a hash ring whose load
+stays within `AFFINITY_LOAD_FACTOR` times its fair share, so stickiness cannot overload a node.
 """
 
-from typing import Optional, Dict, Any
-from gateway.core import state
+import bisect
+import hashlib
+import heapq
+import math
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Set, Tuple, Iterable, Callable
 from gateway.config import settings
+from gateway.core.latency import LatencyTracker, latency_tracker, expected_completion_seconds
+from gateway.utils.metrics import Counter, Gauge, Histogram
+
+# Heap key used for requests that do not ask for a specific model.
+ANY_MODEL = None
+
+# Traffic classes of the slots (see the module docstring).
+QOS_INTERACTIVE = "interactive"
+QOS_BATCH = "batch"
+QOS_CLASSES = (QOS_INTERACTIVE, QOS_BATCH)
+
+# Virtual points per node on the affinity hash ring.
+RING_REPLICAS = 64
+
+AFFINITY_ROUTES = Counter(
+    "inferops_affinity_routes_total",
+    "Prefix-affinity routing decisions. 'hit' reused the node holding the conversation's KV cache, "
+    "'miss' had to move the conversation, 'new' is a first turn.",
+    ["outcome"],
+)
+AFFINITY_HIT_RATIO = Gauge(
+    "inferops_affinity_hit_ratio",
+    "Share of follow-up turns routed to the node that served the previous turn.",
+)
+QOS_SLOTS_IN_USE = Gauge("inferops_qos_slots_in_use", "Node slots held by each traffic class.", ["qos"])
+QOS_UTILISATION = Gauge("inferops_qos_utilisation", "Share of the cluster's node slots held by each traffic class.", ["qos"])
+QOS_WAIT = Histogram("inferops_qos_wait_seconds", "Time work of each traffic class waited for a slot.", ["qos"])
+QOS_HOLD = Histogram("inferops_qos_hold_seconds", "Time work of each traffic class held its slot.", ["qos"])
+
+
+def _hash64(data: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "big")
 
-async def get_best_node(requested_model: Optional[str] = None) -> Optional[Dict[str, Any]]:
+
+def conversation_affinity_key(messages: Iterable[Any]) -> Optional[str]:
     """
-    Implements the dynamic weighted scheduling algorithm of the Task Scheduling Module.
-    
-    This algorithm calculates a real-time composite score for each available (online and not locked)
-    compute node. The score is a function of the node's static performance weight and its current
-    dynamic load, including GPU utilization, memory usage, and temperature.
+    Derives the routing key of a conversation from its prefix: every message up to and
+    including the first user message. This prefix is identical in every turn of the
+    conversation, so all turns map to the same point on the hash ring.
+
+    Args:
+        messages: `ChatMessage` objects or dicts with `role` and `content`.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    found = False
+    for message in messages:
+        role = message["role"] if isinstance(message, dict) else message.role
+        content = message["content"] if isinstance(message, dict) else message.content
+        digest.update(role.encode() + b"\x00" + content.encode() + b"\x01")
+        found = True
+        if role == "user":
+            break
+    return digest.hexdigest() if found else None
+
+
+def compute_node_score(
+    node_config: Dict[str, Any],
+    metrics: Dict[str, Any],
+    free_slots: int = 1,
+    total_slots: int = 1,
+    latency: Optional[Dict[str, Any]] = None,
+) -> float:
+    """
+    Calculates the composite score of a node from its static weight and dynamic load.
 
     The formula (simplified for this implementation) is:
         Score = StaticWeight / (DynamicLoadFactor + Epsilon)
-    
+
     Where:
     - StaticWeight: A pre-assigned value representing the node's raw power (e.g., TFLOPS).
     - DynamicLoadFactor: A weighted average of current GPU load, memory load, and GPU temperature.
     - Epsilon: A small constant to prevent division by zero.
 
+    The result is then scaled by `free_slots / total_slots`, so every in-flight request
+    on a node makes it proportionally less attractive.
+
+    If latency observations are available for the node's model, the score is further
+    multiplied by `LATENCY_REFERENCE_SECONDS / ExpectedCompletionSeconds`, where the
+    expected completion is the TTFT EWMA plus `EXPECTED_OUTPUT_TOKENS` divided by the
+    decode-rate EWMA. A node that finishes in half the reference time counts double.
+    """
+    # Extract dynamic metrics, with sane defaults for stability
+    gpu_load = metrics.get("gpu", {}).get("utilization_percent", 100)
+    mem_load = metrics.get("memory", {}).get("percent", 100)
+    gpu_temp = metrics.get("gpu", {}).get("temperature_celsius", 80)
+
+    # Calculate the dynamic load factor. The weights (0.6, 0.3, 0.1) can be tuned.
+    # GPU utilization is the most heavily weighted factor.
+    dynamic_load_factor = (gpu_load * 0.6) + (mem_load * 0.3) + (gpu_temp * 0.1)
+
+    score = node_config.get("static_weight", 1.0) / (dynamic_load_factor + 1e-6)
+    score *= free_slots / max(total_slots, 1)
+
+    if latency:
+        expected = expected_completion_seconds(latency, settings.EXPECTED_OUTPUT_TOKENS)
+        score *= settings.LATENCY_REFERENCE_SECONDS / (expected + 1e-6)
+    return score
+
+
+class SchedulerIndex:
+    """
+    An incrementally maintained index of schedulable nodes, keyed by model id.
+
+    Every node has one entry holding its latest metrics, slot usage, score and a version
+    counter. Whenever the entry changes (new metrics, reservation, release), the score is
+    recomputed, the version is bumped and a fresh `(-score, order, version, node_id)` tuple
+    is pushed onto the heaps for the node's model and for `ANY_MODEL`. Outdated tuples are
+    discarded lazily when they reach the top of a heap, which keeps both updates and picks
+    at O(log n).
+
+    For affinity routing, the index also keeps one consistent-hash ring per model key,
+    rebuilt only when the set of online nodes changes, and running load totals per key.
+    """
+
+    def __init__(self, latency: Optional[LatencyTracker] = None):
+        self.latency = latency
+        self._lock = threading.Lock()
+        self._entries: Dict[int, Dict[str, Any]] = {}
+        self._heaps: Dict[Optional[str], List[Tuple[float, int, int, int]]] = {}
+        self._next_order = 0
+        # Affinity routing state
+        self._members: Dict[Optional[str], set] = {}
+        self._load_totals: Dict[Optional[str], List[int]] = {}  # key -> [slots in use, total slots]
+        self._rings: Dict[Optional[str], Tuple[List[int], List[int]]] = {}
+        self._dirty_rings: set = set()
+        self._affinity_owners: "OrderedDict[str, int]" = OrderedDict()
+        # Called (without arguments) whenever capacity may have been freed.
+        self._capacity_listeners: List[Callable[[], None]] = []
+        # Slots held by each traffic class.
+        self._class_in_use: Dict[str, int] = {qos: 0 for qos in QOS_CLASSES}
+
+    # --- Updates ---
+
+    def update_node(self, node_config: Dict[str, Any], online: bool, metrics: Optional[Dict[str, Any]]):
+        """
+        Applies a fresh health-check result for a node. Called by the health service.
+        """
+        with self._lock:
+            entry = self._entries.get(node_config["id"])
+            if entry is None:
+                entry = {
+                    "config": node_config,
+                    "order": self._next_order,
+                    "version": 0,
+                    "in_flight": 0,
+                }
+                self._next_order += 1
+                self._entries[node_config["id"]] = entry
+
+            slots = node_config.get("max_concurrency", 1)
+            if metrics and metrics.get("slots_total"):
+                slots = min(slots, metrics["slots_total"])
+
+            entry["config"] = node_config
+            entry["online"] = online and bool(metrics)
+            entry["metrics"] = metrics
+            entry["slots"] = slots
+            # Slots taken on the agent by anything other than this gateway's leases.
+            # Agents without slot reporting only expose the binary 'locked' flag.
+            if metrics and "slots_in_use" in metrics:
+                entry["external_in_use"] = max(metrics["slots_in_use"] - metrics.get("leases_in_use", 0), 0)
+            else:
+                entry["external_in_use"] = slots if metrics and metrics.get("locked") else 0
+            entry["model_id"] = metrics.get("model_id") if metrics else None
+            self._publish(entry)
+            self._publish_classes()
+        self.notify_capacity()
+
+    def reserve(self, node_id: int, qos: str = QOS_INTERACTIVE):
+        """Takes one concurrency slot on a node for a task of traffic class `qos`."""
+        with self._lock:
+            entry = self._entries.get(node_id)
+            if entry is not None:
+                entry["in_flight"] += 1
+                self._publish(entry)
+                self._class_in_use[qos] += 1
+                self._publish_classes()
+
+    def release(self, node_id: int, qos: str = QOS_INTERACTIVE):
+        """Returns one slot of a node, taken by a task of traffic class `qos`, to the scheduling pool."""
+        with self._lock:
+            entry = self._entries.get(node_id)
+            if entry is not None:
+                entry["in_flight"] = max(entry["in_flight"] - 1, 0)
+                self._publish(entry)
+            self._class_in_use[qos] = max(self._class_in_use[qos] - 1, 0)
+            self._publish_classes()
+        self.notify_capacity()
+
+    def observe_latency(self, node_id: int, ttft: Optional[float] = None, tokens_per_sec: Optional[float] = None):
+        """
+        Records the latency of a finished request against the model the node is serving
+        and rescores the node.
+        """
+        if self.latency is None:
+            return
+        with self._lock:
+            entry = self._entries.get(node_id)
+            if entry is None:
+                return
+            self.latency.record(node_id, entry["model_id"], ttft=ttft, tokens_per_sec=tokens_per_sec)
+            self._publish(entry)
+
+    def latency_estimate(self, node_id: int) -> Optional[Dict[str, Any]]:
+        """Returns the latency EWMAs of a node for the model it is serving, if known."""
+        with self._lock:
+            entry = self._entries.get(node_id)
+            model_id = entry["model_id"] if entry is not None else None
+        if self.latency is None or entry is None:
+            return None
+        return self.latency.estimate(node_id, model_id)
+
+    def node_model(self, node_id: int) -> Optional[str]:
+        """Returns the model a node is serving, if it reported one."""
+        with self._lock:
+            entry = self._entries.get(node_id)
+            return entry["model_id"] if entry is not None else None
+
+    def free_slots(self, node_id: int) -> int:
+        """Returns the number of currently free concurrency slots of a node."""
+        with self._lock:
+            entry = self._entries.get(node_id)
+            return self._free_slots(entry) if entry is not None and entry["online"] else 0
+
+    def online_nodes(self, requested_model: Optional[str] = None) -> Set[int]:
+        """Returns the IDs of the online nodes (serving `requested_model`, if given), busy or not."""
+        with self._lock:
+            return {
+                node_id for node_id, entry in self._entries.items()
+                if entry["online"] and (requested_model is None or entry["model_id"] == requested_model)
+            }
+
+    def node_speeds(self, requested_model: Optional[str] = None) -> Dict[int, float]:
+        """
+        The relative speeds of the online nodes (serving `requested_model`, if given): their
+        decode-rate EWMAs once all of them are known, their static weights until then.
+        """
+        with self._lock:
+            nodes = [
+                (node_id, entry["model_id"], entry["config"]) for node_id, entry in self._entries.items()
+                if entry["online"] and (requested_model is None or entry["model_id"] == requested_model)
+            ]
+        rates = {}
+        for node_id, model_id, _ in nodes:
+            estimate = self.latency.estimate(node_id, model_id) if self.latency else None
+            rates[node_id] = estimate["tokens_per_sec"] if estimate else None
+        if rates and all(rates.values()):
+            return rates
+        return {node_id: node_config.get("static_weight", 1.0) for node_id, _, node_config in nodes}
+
+    def batch_headroom(self, requested_model: Optional[str] = None) -> int:
+        """
+        The number of slots batch work may take right now from the pool of nodes serving
+        `requested_model` (all nodes if None): the free ones, less the slots reserved for
+        interactive traffic. The reservation leaves at least one slot of the pool to batch work.
+        """
+        with self._lock:
+            in_use, total_slots = self._load_totals.get(requested_model, [0, 0])
+        reserved = min(settings.QOS_INTERACTIVE_RESERVED_SLOTS, max(total_slots - 1, 0))
+        return max(total_slots - in_use - reserved, 0)
+
+    def class_usage(self) -> Dict[str, int]:
+        """The number of slots held by each traffic class."""
+        with self._lock:
+            return dict(self._class_in_use)
+
+    def add_capacity_listener(self, listener: Callable[[], None]):
+        """Registers a callback invoked whenever a slot is released or a node is updated."""
+        self._capacity_listeners.append(listener)
+
+    def remove_capacity_listener(self, listener: Callable[[], None]):
+        """Unregisters a callback added with `add_capacity_listener`."""
+        try:
+            self._capacity_listeners.remove(listener)
+        except ValueError:
+            pass
+
+    def remove_node(self, node_id: int):
+        """Drops a node from the index entirely (e.g., when it is deregistered)."""
+        with self._lock:
+            entry = self._entries.pop(node_id, None)
+            if entry is not None:
+                entry["online"] = False
+                self._account(entry)
+                self._publish_classes()
+
+    # --- Selection ---
+
+    def pick(self, requested_model: Optional[str] = None, exclude: Iterable[int] = ()) -> Optional[Dict[str, Any]]:
+        """
+        Returns the configuration of the highest-scoring schedulable node, or None.
+        Nodes in `exclude` are skipped (e.g., the node a hedged request already runs on).
+        """
+        exclude = set(exclude)
+        with self._lock:
+            heap = self._heaps.get(requested_model, [])
+            chosen = None
+            skipped = []  # The excluded nodes' current tuples, pushed back after the pick.
+            while heap and chosen is None:
+                entry = self._live_entry(heap[0])
+                if entry is None:
+                    heapq.heappop(heap)
+                elif heap[0][3] in exclude:
+                    skipped.append(heapq.heappop(heap))
+                else:
+                    chosen = entry["config"]
+            for item in skipped:
+                heapq.heappush(heap, item)
+            return chosen
+
+    def pick_affinity(self, affinity_key: str, requested_model: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Returns a node for a conversation using consistent hashing with bounded loads.
+
+        Walks the ring clockwise from the conversation's hash and takes the first node with
+        a free slot whose load, including this request, stays within `AFFINITY_LOAD_FACTOR`
+        times its slot-weighted share of the total load. Falls back to `pick` if none qualifies.
+        """
+        with self._lock:
+            chosen = self._walk_ring(affinity_key, requested_model)
+            owner = self._affinity_owners.get(affinity_key)
+            if chosen is not None:
+                self._affinity_owners[affinity_key] = chosen["id"]
+                self._affinity_owners.move_to_end(affinity_key)
+                while len(self._affinity_owners) > settings.AFFINITY_TABLE_SIZE:
+                    self._affinity_owners.popitem(last=False)
+
+        if chosen is None:
+            chosen = self.pick(requested_model)
+            if chosen is None:
+                return None
+        outcome = "new" if owner is None else ("hit" if chosen["id"] == owner else "miss")
+        AFFINITY_ROUTES.inc(outcome=outcome)
+        hits, misses = AFFINITY_ROUTES.value(outcome="hit"), AFFINITY_ROUTES.value(outcome="miss")
+        AFFINITY_HIT_RATIO.set(hits / (hits + misses) if hits + misses else 0.0)
+        return chosen
+
+    # --- Internals ---
+
+    def _live_entry(self, item: Tuple[float, int, int, int]) -> Optional[Dict[str, Any]]:
+        """Returns the entry of a heap tuple if the tuple is current and the node schedulable."""
+        entry = self._entries.get(item[3])
+        if entry is not None and entry["version"] == item[2] and self._is_schedulable(entry):
+            return entry
+        return None
+
+    def _publish_classes(self):
+        """Exports the slots held by each traffic class, and their share of the cluster's slots."""
+        total_slots = self._load_totals.get(ANY_MODEL, [0, 0])[1]
+        for qos, in_use in self._class_in_use.items():
+            QOS_SLOTS_IN_USE.set(in_use, qos=qos)
+            QOS_UTILISATION.set(in_use / total_slots if total_slots else 0.0, qos=qos)
+
+    def notify_capacity(self):
+        """Calls the capacity listeners, e.g. when capacity was held back from some of them."""
+        for listener in list(self._capacity_listeners):
+            listener()
+
+    def _walk_ring(self, affinity_key: str, requested_model: Optional[str]) -> Optional[Dict[str, Any]]:
+        if requested_model in self._dirty_rings:
+            self._rebuild_ring(requested_model)
+        points, owners = self._rings.get(requested_model, ([], []))
+        if not points:
+            return None
+
+        in_use, total_slots = self._load_totals.get(requested_model, [0, 0])
+        start = bisect.bisect(points, _hash64(affinity_key.encode()))
+        seen = set()
+        for i in range(len(points)):
+            node_id = owners[(start + i) % len(points)]
+            if node_id in seen:
+                continue
+            seen.add(node_id)
+            entry = self._entries[node_id]
+            if not self._is_schedulable(entry):
+                continue
+            used = entry["slots"] - self._free_slots(entry)
+            bound = math.ceil(settings.AFFINITY_LOAD_FACTOR * (in_use + 1) * entry["slots"] / max(total_slots, 1))
+            if used + 1 <= bound:
+                return entry["config"]
+            if len(seen) == len(self._members.get(requested_model, ())):
+                break
+        return None
+
+    def _rebuild_ring(self, key: Optional[str]):
+        points = sorted(
+            (_hash64(f"{node_id}#{replica}".encode()), node_id)
+            for node_id in self._members.get(key, ())
+            for replica in range(RING_REPLICAS)
+        )
+        self._rings[key] = ([p for p, _ in points], [n for _, n in points])
+        self._dirty_rings.discard(key)
+
+    def _account(self, entry: Dict[str, Any]):
+        """Updates ring membership and load totals with the entry's current state."""
+        old_keys, old_used, old_slots = entry.get("contribution", ((), 0, 0))
+        node_id = entry["config"]["id"]
+        if not entry["online"]:
+            keys = ()
+        else:
+            keys = (ANY_MODEL,) if entry["model_id"] is None else (ANY_MODEL, entry["model_id"])
+        used = entry["in_flight"] + entry["external_in_use"] if keys else 0
+        slots = entry["slots"] if keys else 0
+
+        for key in old_keys:
+            totals = self._load_totals[key]
+            totals[0] -= old_used
+            totals[1] -= old_slots
+            if key not in keys:
+                self._members[key].discard(node_id)
+                self._dirty_rings.add(key)
+        for key in keys:
+            totals = self._load_totals.setdefault(key, [0, 0])
+            totals[0] += used
+            totals[1] += slots
+            if key not in old_keys:
+                self._members.setdefault(key, set()).add(node_id)
+                self._dirty_rings.add(key)
+        entry["contribution"] = (keys, used, slots)
+
+    @staticmethod
+    def _free_slots(entry: Dict[str, Any]) -> int:
+        return max(entry["slots"] - entry["in_flight"] - entry["external_in_use"], 0)
+
+    def _is_schedulable(self, entry: Dict[str, Any]) -> bool:
+        return entry["online"] and self._free_slots(entry) > 0
+
+    def _publish(self, entry: Dict[str, Any]):
+        """Rescores the entry, invalidates its old heap tuples and pushes its current state."""
+        entry["version"] += 1
+        self._account(entry)
+        if not self._is_schedulable(entry):
+            return
+        latency = self.latency.estimate(entry["config"]["id"], entry["model_id"]) if self.latency else None
+        entry["score"] = compute_node_score(entry["config"], entry["metrics"], self._free_slots(entry), entry["slots"], latency)
+        item = (-entry["score"], entry["order"], entry["version"], entry["config"]["id"])
+        keys = (ANY_MODEL,) if entry["model_id"] is None else (ANY_MODEL, entry["model_id"])
+        for key in keys:
+            heap = self._heaps.setdefault(key, [])
+            heapq.heappush(heap, item)
+            if len(heap) > 2 * len(self._entries) + 16:
+                self._compact(key)
+
+    def _compact(self, key: Optional[str]):
+        """Rebuilds a heap from live entries once stale tuples dominate it."""
+        heap = [
+            (-e["score"], e["order"], e["version"], e["config"]["id"])
+            for e in self._entries.values()
+            if self._is_schedulable(e) and (key is ANY_MODEL or e["model_id"] == key)
+        ]
+        heapq.heapify(heap)
+        self._heaps[key] = heap
+
+
+# The process-wide scheduler index, kept current by the health service and the chat stream.
+scheduler_index = SchedulerIndex(latency=latency_tracker)
+
+
+def select_node(requested_model: Optional[str] = None, affinity_key: Optional[str] = None, exclude: Iterable[int] = ()) -> Optional[Dict[str, Any]]:
+    """Synchronous core of `get_best_node`, for callers that must not yield to the event loop."""
+    if affinity_key and not exclude and settings.ROUTING_MODE == "prefix_affinity":
+        return scheduler_index.pick_affinity(affinity_key, requested_model)
+    return scheduler_index.pick(requested_model, exclude)
+
+
+async def get_best_node(requested_model: Optional[str] = None, affinity_key: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    Implements the dynamic weighted scheduling algorithm of the Task Scheduling Module.
+
+    The composite score of each available (online, with a free slot) compute node is kept
+    up to date by the `SchedulerIndex` as health checks arrive (see `compute_node_score`),
+    so this call only has to read the top of the relevant heap.
+
     The node with the highest score is selected as the "best" node for the incoming task.
-    
+    When `ROUTING_MODE` is `prefix_affinity` and an `affinity_key` is given, the node is
+    instead chosen by bounded-load consistent hashing (see `SchedulerIndex.pick_affinity`).
+
     Args:
         requested_model (Optional[str]): If specified, the scheduler will only consider nodes
                                          that are currently running this specific model.
+        affinity_key (Optional[str]): The conversation key from `conversation_affinity_key`.
 
     Returns:
         Optional[Dict[str, Any]]: The configuration dictionary of the selected best node,
                                   or None if no suitable node is found.
     """
-    best_node = None
-    highest_score = -1
-
-    with state.CACHE_LOCK:
-        # Iterate through all configured nodes
-        for node_config in settings.NODES:
-            node_id = node_config["id"]
-            status = state.NODE_STATUS_CACHE.get(node_id)
-
-            # --- Filtering Conditions ---
-            # 1. Node must be online.
-            # 2. Node must have metrics available.
-            # 3. Node must not be locked by another task.
-            if not status or not status.get("online") or not status.get("metrics") or status["metrics"].get("locked"):
-                continue
-
-            # 4. If a specific model is requested, filter by model ID.
-            if requested_model and status["metrics"].get("model_id") != requested_model:
-                continue
-            
-            # --- Dynamic Composite Score Calculation ---
-            metrics = status.get("metrics", {})
-            
-            # Extract dynamic metrics, with sane defaults for stability
-            gpu_load = metrics.get("gpu", {}).get("utilization_percent", 100)
-            mem_load = metrics.get("memory", {}).get("percent", 100)
-            gpu_temp = metrics.get("gpu", {}).get("temperature_celsius", 80)
-
-            # Calculate the dynamic load factor. The weights (0.6, 0.3, 0.1) can be tuned.
-            # GPU utilization is the most heavily weighted factor.
-            dynamic_load_factor = (gpu_load * 0.6) + (mem_load * 0.3) + (gpu_temp * 0.1)
-            
-            # Calculate the final score
-            score = node_config.get("static_weight", 1.0) / (dynamic_load_factor + 1e-6)
-
-            # --- Selection ---
-            # If the current node's score is the highest so far, it becomes the new candidate.
-            if score > highest_score:
-                highest_score = score
-                best_node = node_config
-    
-    return best_node
+    return select_node(requested_model, affinity_key)
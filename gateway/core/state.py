@@ -31,12 +31,8 @@ CPU_INFO_CACHE: Dict[int, str] = {}
 
 
 # --- Dataset Processing Jobs ---
-# Stores the state and results of ongoing and completed batch processing jobs.
-# Key: job_id (str)
-# Value: A dictionary containing job metadata, progress, and results.
-DATASET_JOBS: Dict[str, Dict[str, Any]] = {}
-# A lock for thread-safe operations on the DATASET_JOBS dictionary.
-JOBS_LOCK = threading.Lock()
+# Batch processing jobs and their results are kept by the disk-backed job store
+# (see `gateway.services.job_store`), so they do not grow the gateway's memory.
 
 
 # --- Alerting System State ---
@@ -18,6 +18,9 @@ from gateway.config import settings
 from gateway.core import state
 from gateway.core.health import health_check_nodes_periodically
 from gateway.services.alerting import alert_checker_periodically
+from gateway.services.locking import lease_maintenance_periodically
+from gateway.services.http_pool import node_clients
+from gateway.services.job_store import job_store, job_store_maintenance_periodically
 from gateway.api.v1 import chat, status, dataset
 
 # --- Application Initialization ---
@@ -74,15 +77,27 @@ def create_app() -> FastAPI:
     @app.on_event("startup")
     async def startup_event():
         """
-        On application startup, launch the background tasks for health checks and alerting.
+        On application startup, load the stored dataset jobs (resuming the unfinished ones) and
+        launch the background tasks for health checks, leases, alerting and job store maintenance.
         """
         print("🚀 InferOps Gateway starting up...")
+        job_store.load()
+        dataset.resume_unfinished_jobs()
         # Start the health check loop
         asyncio.create_task(health_check_nodes_periodically())
+        # Start the lease expiry and renewal loop
+        asyncio.create_task(lease_maintenance_periodically())
         # Start the alert checking loop
         asyncio.create_task(alert_checker_periodically())
+        # Start the job store eviction loop
+        asyncio.create_task(job_store_maintenance_periodically())
         print("✅ Background services started.")
 
+    @app.on_event("shutdown")
+    async def shutdown_event():
+        """Closes the per-node connection pools."""
+        await node_clients.aclose()
+
     return app
 
 app = create_app()
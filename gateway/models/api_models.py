@@ -7,7 +7,7 @@ and adheres to the expected types, which is crucial for robustness and clarity.
 """
 
 from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Literal
 
 # --- Chat Completion Models ---
 
@@ -21,6 +21,12 @@ class ChatRequest(BaseModel):
     messages: List[ChatMessage]
     model: Optional[str] = None
     stream: bool = True
+    options: Optional[Dict[str, Any]] = None  # Ollama model options, e.g. {"temperature": 0}.
+    # --- Gateway-only fields (not forwarded to the node) ---
+    priority: int = 0                   # Higher is admitted first when ADMISSION_ORDERING is 'priority'.
+    deadline_ms: Optional[int] = None   # Longest time the request may wait for a free node.
+    hedge: bool = False                 # Race a second node if the first is slow to produce a token.
+    stream_format: Literal["ollama", "openai"] = "ollama"  # Ollama NDJSON lines or OpenAI SSE chunks.
 
 class NodeAssignedEvent(BaseModel):
     """A special event sent to the client to indicate which node is handling the request."""
@@ -35,11 +41,40 @@ class JobStatus(BaseModel):
     status: str
     total_items: int
     processed_items: int
+    failed_items: int = 0
     start_time: float
     end_time: Optional[float] = None
+    error: Optional[str] = None
+    # Estimated seconds until the job has processed all of its items, while it is processing.
+    eta_seconds: Optional[float] = None
     results: List[Dict[str, Any]]
 
 
+class JobProgress(BaseModel):
+    """The counters of a batch processing job, without its results."""
+    job_id: str
+    status: str
+    total_items: int
+    processed_items: int
+    failed_items: int = 0
+    # Number of results so far; results are numbered 0.. in the order they completed.
+    results_available: int
+    ingesting: bool = False
+    start_time: float
+    end_time: Optional[float] = None
+    error: Optional[str] = None
+    eta_seconds: Optional[float] = None
+
+
+class JobResultsPage(BaseModel):
+    """A page of a job's results. Pass `next_cursor` as `cursor` to get the next page."""
+    job_id: str
+    results: List[Dict[str, Any]]
+    next_cursor: int
+    # True once the job has finished and there are no results past this page.
+    complete: bool
+
+
 # --- Node and System Status Models ---
 
 class GPUInfo(BaseModel):
@@ -63,6 +98,9 @@ class MemoryInfo(BaseModel):
 class NodeMetrics(BaseModel):
     """Comprehensive metrics for a single compute node."""
     locked: bool
+    slots_total: Optional[int] = None
+    slots_in_use: Optional[int] = None
+    leases_in_use: Optional[int] = None
     model_id: Optional[str] = None
     cpu_usage_percent: float
     memory: MemoryInfo
@@ -0,0 +1,166 @@
+"""
+InferOps - Admission Control Service
+
+When every suitable node is busy, a request no longer fails immediately. It waits in a
+bounded admission queue until a slot frees up or its deadline passes. This turns short
+load spikes into a little extra latency instead of client errors.
+
+Waiters are ordered FIFO or by priority (`ADMISSION_ORDERING`). They are woken by the
+scheduler index whenever a slot is released or a node's state changes; there is no polling.
+"""
+
+import asyncio
+import bisect
+import itertools
+import time
+from typing import Any, Callable, List, Optional, Tuple
+
+from gateway.config import settings
+from gateway.core.scheduler import scheduler_index, QOS_INTERACTIVE, QOS_WAIT
+from gateway.utils.metrics import Counter, Gauge, Histogram
+
+QUEUE_DEPTH = Gauge("inferops_admission_queue_depth", "Requests currently waiting for a free slot.")
+QUEUE_WAIT = Histogram(
+    "inferops_admission_wait_seconds",
+    "Time requests spent in the admission queue.",
+    ["outcome"],
+)
+QUEUE_REJECTED = Counter(
+    "inferops_admission_rejected_total",
+    "Requests rejected by admission control.",
+    ["reason"],
+)
+
+
+class AdmissionError(Exception):
+    """Raised when a request cannot be admitted. `reason` is 'queue_full' or 'deadline'."""
+
+    def __init__(self, reason: str, message: str):
+        super().__init__(message)
+        self.reason = reason
+
+
+class AdmissionQueue:
+    """
+    A bounded queue of requests waiting for capacity.
+
+    Each waiter carries a `try_acquire` callable that returns a reservation (e.g. a node and
+    its lease) or None. Whenever capacity may have been freed, the waiters are offered the
+    chance to acquire in queue order; a waiter that cannot be served (e.g. its model has no
+    free node) does not block the ones behind it.
+    """
+
+    def __init__(self, max_depth: int, ordering: str = "fifo"):
+        self.max_depth = max_depth
+        self.ordering = ordering
+        # Sorted (sort_key, seq, future, try_acquire) tuples; seq is unique, so ties never
+        # fall through to comparing futures.
+        self._waiters: List[Tuple[int, int, asyncio.Future, Callable[[], Optional[Any]]]] = []
+        self._seq = itertools.count()
+        self._dispatch_scheduled = False
+
+    def __len__(self) -> int:
+        return len(self._waiters)
+
+    async def admit(
+        self,
+        try_acquire: Callable[[], Optional[Any]],
+        release: Callable[[Any], None],
+        priority: int = 0,
+        timeout: Optional[float] = None,
+    ) -> Any:
+        """
+        Returns the reservation made by `try_acquire`, waiting for capacity if necessary.
+
+        Args:
+            try_acquire: Attempts a reservation; returns None if there is no capacity.
+            release: Undoes a reservation that was made for a waiter that has gone away.
+            priority: Higher values are served first when `ordering` is 'priority'.
+            timeout: Seconds the request may wait. Defaults to `ADMISSION_DEFAULT_DEADLINE`.
+
+        Raises:
+            AdmissionError: If the queue is full or the deadline passes.
+        """
+        # Fast path: serve immediately unless others are already waiting in line.
+        if not self._waiters:
+            reservation = try_acquire()
+            if reservation is not None:
+                QUEUE_WAIT.observe(0.0, outcome="admitted")
+                QOS_WAIT.observe(0.0, qos=QOS_INTERACTIVE)
+                return reservation
+
+        if len(self._waiters) >= self.max_depth:
+            QUEUE_REJECTED.inc(reason="queue_full")
+            raise AdmissionError("queue_full", "All suitable nodes are busy and the admission queue is full.")
+
+        future = asyncio.get_running_loop().create_future()
+        seq = next(self._seq)
+        sort_key = -priority if self.ordering == "priority" else 0
+        waiter = (sort_key, seq, future, try_acquire)
+        bisect.insort(self._waiters, waiter)
+        QUEUE_DEPTH.set(len(self._waiters))
+        # Capacity may already be free (e.g. only the fast path was skipped).
+        self.notify()
+
+        enqueued = time.monotonic()
+        timeout = settings.ADMISSION_DEFAULT_DEADLINE if timeout is None else timeout
+        try:
+            reservation = await asyncio.wait_for(asyncio.shield(future), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            self._remove(waiter)
+            if future.done():
+                # The waiter gave up (deadline or client gone) right after being served.
+                release(future.result())
+            else:
+                future.cancel()
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            QUEUE_WAIT.observe(time.monotonic() - enqueued, outcome="deadline")
+            QUEUE_REJECTED.inc(reason="deadline")
+            raise AdmissionError("deadline", f"No node became available within {timeout:.1f}s.")
+
+        QUEUE_WAIT.observe(time.monotonic() - enqueued, outcome="admitted")
+        QOS_WAIT.observe(time.monotonic() - enqueued, qos=QOS_INTERACTIVE)
+        return reservation
+
+    def notify(self):
+        """
+        Signals that capacity may be available. Dispatching is deferred to the event loop so
+        it never runs inside the scheduler's or the lease table's critical sections.
+        """
+        if self._dispatch_scheduled or not self._waiters:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._dispatch_scheduled = True
+        loop.call_soon(self._dispatch)
+
+    def _dispatch(self):
+        self._dispatch_scheduled = False
+        for waiter in list(self._waiters):
+            future, try_acquire = waiter[2], waiter[3]
+            if future.done():
+                self._remove(waiter)
+                continue
+            reservation = try_acquire()
+            if reservation is not None:
+                future.set_result(reservation)
+                self._remove(waiter)
+
+    def _remove(self, waiter: Tuple[int, int, asyncio.Future, Callable[[], Optional[Any]]]):
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            return
+        QUEUE_DEPTH.set(len(self._waiters))
+        if not self._waiters:
+            # Batch work waits while interactive requests are queued; it may go ahead again.
+            scheduler_index.notify_capacity()
+
+
+# The process-wide admission queue for interactive requests. Batch work takes no slot while
+# it holds waiters (see `batch_engine`).
+admission_queue = AdmissionQueue(max_depth=settings.ADMISSION_MAX_DEPTH, ordering=settings.ADMISSION_ORDERING)
+scheduler_index.add_capacity_listener(admission_queue.notify)
@@ -0,0 +1,357 @@
+"""
+InferOps - Aggregator Hub
+
+Merges the results of a dataset job while it runs. Once `INCREMENTAL_MERGE_THRESHOLD` of the
+items are done, the job's hub catches up on the results so far and from then on folds in each
+new result as it arrives, so the running aggregate can be read before the job finishes. The
+catch-up runs a page of results at a time, yielding to the event loop in between; results
+that arrive meanwhile wait until it is done.
+
+Merges are pluggable: each one is a `Merge` registered in `MERGES` under a name, and a job
+picks its merges with a spec such as `"vote,stats:topic"` (`name[:argument]`, comma-separated):
+
+- `concat`: the outputs joined in item order, up to `AGGREGATE_CONCAT_MAX_CHARS` (the
+  earliest items are kept; the full outputs are in the job's results).
+- `vote`: majority voting over the (normalised) answers given to identical inputs, e.g. for
+  self-consistency sampling. At most `AGGREGATE_VOTE_MAX_GROUPS` distinct inputs are tracked,
+  and a bounded number of distinct answers per input and overall (the rest count as other).
+- `summarize`: map-reduce summarisation. Every `AGGREGATE_SUMMARY_FAN_IN` outputs are reduced
+  to a summary by a node, and those summaries are reduced in turn, into a single summary.
+- `stats`: per-category counts, failures and output sizes; the argument names the item field
+  that holds the category (default `category`). At most `AGGREGATE_STATS_MAX_CATEGORIES`
+  categories are kept apart; the items of further ones are counted together as other.
+"""
+
+import abc
+import asyncio
+import heapq
+import json
+import re
+import threading
+from collections import Counter
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+from gateway.config import settings
+from gateway.services.batch_engine import ItemOutcome, run_batch
+
+
+class Merge(abc.ABC):
+    """A merge function: folds in results one at a time and can report its value at any point."""
+
+    name = ""
+
+    @abc.abstractmethod
+    def add(self, result: Dict[str, Any]):
+        """Folds in one result."""
+
+    @abc.abstractmethod
+    def value(self) -> Any:
+        """The merge of the results added so far."""
+
+    async def finish(self):
+        """Completes any outstanding work once the last result was added."""
+
+
+class ConcatMerge(Merge):
+    name = "concat"
+
+    def __init__(self, separator: Optional[str] = None, max_chars: Optional[int] = None):
+        self.separator = "\n\n" if separator is None else separator
+        self.max_chars = max_chars or settings.AGGREGATE_CONCAT_MAX_CHARS
+        self._outputs: Dict[int, str] = {}
+        self._latest: List[int] = []  # The indexes of the kept outputs, as a max-heap.
+        self._chars = 0
+        self._items = 0
+
+    def add(self, result: Dict[str, Any]):
+        if not result.get("output"):
+            return
+        self._items += 1
+        self._outputs[result["index"]] = result["output"]
+        heapq.heappush(self._latest, -result["index"])
+        self._chars += len(result["output"])
+        # Over the cap, the outputs of the latest items are dropped (the first one always stays).
+        while self._chars > self.max_chars and len(self._outputs) > 1:
+            self._chars -= len(self._outputs.pop(-heapq.heappop(self._latest)))
+
+    def value(self) -> Dict[str, Any]:
+        # Results arrive in completion order; the text is in item order.
+        text = self.separator.join(self._outputs[index] for index in sorted(self._outputs))
+        return {"items": self._items, "text": text, "truncated": len(self._outputs) < self._items}
+
+
+_TRAILING_PUNCTUATION = re.compile(r"[\s.!?。！？]+$")
+
+
+def normalize_answer(text: str) -> str:
+    """The form in which answers are compared when voting (case, spacing, final punctuation)."""
+    return _TRAILING_PUNCTUATION.sub("", " ".join(text.split())).casefold()
+
+
+class VoteMerge(Merge):
+    name = "vote"
+
+    # Number of groups (distinct inputs) whose winners are listed.
+    MAX_LISTED_GROUPS = 100
+    # Distinct answers counted one by one, per group and across groups; further ones count as "other".
+    MAX_GROUP_ANSWERS = 16
+    MAX_TRACKED_ANSWERS = 1000
+
+    def __init__(self, argument: Optional[str] = None, max_groups: Optional[int] = None):
+        self.max_groups = max_groups or settings.AGGREGATE_VOTE_MAX_GROUPS
+        self._groups: Dict[str, Counter] = {}
+        self._group_other: Counter = Counter()  # Votes for answers past a group's cap, by group.
+        self._answers: Counter = Counter()
+        self._other_answers = 0
+        self._votes = 0
+        self._untracked = 0
+
+    def add(self, result: Dict[str, Any]):
+        if result.get("output") is None:
+            return
+        answer = normalize_answer(result["output"])
+        key = json.dumps(result.get("original"), sort_keys=True, ensure_ascii=False)
+        if key not in self._groups and len(self._groups) >= self.max_groups:
+            self._untracked += 1  # Past the cap, answers to new inputs are only counted.
+            return
+        votes = self._groups.setdefault(key, Counter())
+        if answer in votes or len(votes) < self.MAX_GROUP_ANSWERS:
+            votes[answer] += 1
+        else:
+            self._group_other[key] += 1
+        if answer in self._answers or len(self._answers) < self.MAX_TRACKED_ANSWERS:
+            self._answers[answer] += 1
+        else:
+            self._other_answers += 1
+        self._votes += 1
+
+    def value(self) -> Dict[str, Any]:
+        winners = []
+        agreeing = 0
+        for key, votes in self._groups.items():
+            answer, count = votes.most_common(1)[0]
+            agreeing += count
+            of = sum(votes.values()) + self._group_other[key]
+            winners.append({"input": json.loads(key), "answer": answer, "votes": count, "of": of})
+        winners.sort(key=lambda winner: winner["of"], reverse=True)
+        return {
+            "votes": self._votes,
+            "groups": len(self._groups),
+            # Share of all answers that agree with the winner of their group.
+            "agreement": round(agreeing / self._votes, 4) if self._votes else None,
+            "winners": winners[:self.MAX_LISTED_GROUPS],
+            "top_answers": self._answers.most_common(10),
+            "other_answers": self._other_answers,
+            "untracked_votes": self._untracked,
+        }
+
+
+async def summarize_texts(texts: List[str]) -> str:
+    """Asks a node for one summary of `texts`; raises RuntimeError if no node could do it."""
+    numbered = "\n\n".join(f"[{i + 1}]\n{text}" for i, text in enumerate(texts))
+    prompt = (f"Summarize the following {len(texts)} texts into a single concise summary that keeps "
+              f"their key points.\n\n{numbered}")
+    outcomes: List[ItemOutcome] = []
+    await run_batch([prompt], outcomes.append)
+    if not outcomes or outcomes[0].error is not None:
+        raise RuntimeError(outcomes[0].error if outcomes else "No node available.")
+    return outcomes[0].output
+
+
+class SummaryMerge(Merge):
+    name = "summarize"
+
+    def __init__(self, argument: Optional[str] = None,
+                 summarize: Callable[[List[str]], Any] = summarize_texts, fan_in: Optional[int] = None):
+        self.fan_in = max(fan_in or settings.AGGREGATE_SUMMARY_FAN_IN, 2)
+        self._summarize = summarize
+        # Texts waiting to be reduced, by level: outputs are level 0, their summaries level 1, ...
+        self._levels: List[List[str]] = [[]]
+        self._tasks: Set[asyncio.Task] = set()
+        self._latest: Optional[str] = None  # The most recent summary from the highest level.
+        self._latest_level = 0
+        self._final: Optional[str] = None
+        self._finished = False
+        self._reductions = 0
+        self._errors = 0
+
+    def add(self, result: Dict[str, Any]):
+        if result.get("output"):
+            self._push(0, result["output"])
+
+    def _push(self, level: int, text: str):
+        while len(self._levels) <= level:
+            self._levels.append([])
+        self._levels[level].append(text)
+        if len(self._levels[level]) >= self.fan_in:
+            texts, self._levels[level] = self._levels[level], []
+            task = asyncio.ensure_future(self._reduce(level + 1, texts))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _summarize_or_none(self, texts: List[str]) -> Optional[str]:
+        try:
+            summary = await self._summarize(texts)
+        except RuntimeError as e:
+            self._errors += 1
+            print(f"⚠️ Summary reduction failed: {e}")
+            return None
+        self._reductions += 1
+        return summary
+
+    async def _reduce(self, level: int, texts: List[str]):
+        summary = await self._summarize_or_none(texts)
+        if summary is None:
+            return
+        if level >= self._latest_level:
+            self._latest, self._latest_level = summary, level
+        self._push(level, summary)
+
+    async def finish(self):
+        while self._tasks:
+            await asyncio.gather(*self._tasks)
+        # Whatever is left on the levels is reduced into the final summary, the summaries of
+        # the most (and earliest) outputs first.
+        remaining = [(level, text) for level, texts in reversed(list(enumerate(self._levels))) for text in texts]
+        self._levels = [[]]
+        if len(remaining) == 1 and remaining[0][0] > 0:
+            self._final = remaining[0][1]  # Already a summary of everything.
+        elif remaining:
+            self._final = await self._summarize_or_none([text for _, text in remaining]) or self._latest
+        else:
+            self._final = self._latest
+        self._finished = True
+
+    def value(self) -> Dict[str, Any]:
+        return {
+            "summary": self._final if self._final is not None else self._latest,
+            "final": self._finished,
+            "reductions": self._reductions,
+            "pending_reductions": len(self._tasks),
+            "failed_reductions": self._errors,
+        }
+
+
+class StatsMerge(Merge):
+    name = "stats"
+
+    def __init__(self, argument: Optional[str] = None, max_categories: Optional[int] = None):
+        self.field = argument or "category"
+        self.max_categories = max_categories or settings.AGGREGATE_STATS_MAX_CATEGORIES
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._other = _new_stats()  # The items of the categories past the cap.
+
+    def add(self, result: Dict[str, Any]):
+        original = result.get("original")
+        category = original.get(self.field) if isinstance(original, dict) else None
+        category = "uncategorized" if category is None else str(category)
+        if category in self._stats or len(self._stats) < self.max_categories:
+            stats = self._stats.setdefault(category, _new_stats())
+        else:
+            stats = self._other
+        stats["count"] += 1
+        if result.get("error") is not None:
+            stats["failed"] += 1
+        else:
+            stats["output_chars"] += len(result.get("output") or "")
+
+    def value(self) -> Dict[str, Any]:
+        categories = {category: _with_average(stats) for category, stats in self._stats.items()}
+        return {"field": self.field, "categories": categories, "other": _with_average(self._other)}
+
+
+def _new_stats() -> Dict[str, int]:
+    return {"count": 0, "failed": 0, "output_chars": 0}
+
+
+def _with_average(stats: Dict[str, int]) -> Dict[str, Any]:
+    succeeded = stats["count"] - stats["failed"]
+    return dict(stats, avg_output_chars=round(stats["output_chars"] / succeeded, 1) if succeeded else None)
+
+
+MERGES: Dict[str, Callable[[Optional[str]], Merge]] = {
+    ConcatMerge.name: ConcatMerge,
+    VoteMerge.name: VoteMerge,
+    SummaryMerge.name: SummaryMerge,
+    StatsMerge.name: StatsMerge,
+}
+
+
+def build_merges(spec: str) -> List[Merge]:
+    """Creates the merges of a spec like `"concat,stats:topic"`; raises ValueError for unknown names."""
+    merges = []
+    for part in spec.split(","):
+        name, _, argument = part.strip().partition(":")
+        if not name:
+            continue
+        if name not in MERGES:
+            raise ValueError(f"Unknown merge '{name}'. Available: {', '.join(sorted(MERGES))}.")
+        merges.append(MERGES[name](argument or None))
+    return merges
+
+
+class AggregatorHub:
+    """The running aggregate of one job: its merges, fed with the job's results."""
+
+    def __init__(self, merges: List[Merge]):
+        self.merges = merges
+        # -> "catching_up" (threshold reached) -> "running" (caught up) -> "final"
+        self.state = "waiting"
+        self.items_merged = 0
+        self._lock = threading.Lock()
+        self._queued: List[Dict[str, Any]] = []  # Results added during the catch-up.
+        self._catch_up: Optional[asyncio.Task] = None
+
+    @property
+    def started(self) -> bool:
+        return self.state != "waiting"
+
+    def start(self, pages: Iterable[List[Dict[str, Any]]]):
+        """
+        Begins merging with the results that are already available, given as pages. They are
+        merged in the background; `add` may be called from now on.
+        """
+        self.state = "catching_up"
+        self._catch_up = asyncio.ensure_future(self._replay(pages))
+
+    async def _replay(self, pages: Iterable[List[Dict[str, Any]]]):
+        for page in pages:
+            with self._lock:
+                for result in page:
+                    self._add(result)
+            await asyncio.sleep(0)  # Lets requests and streams run between pages.
+        with self._lock:
+            for result in self._queued:
+                self._add(result)
+            self._queued = []
+            self.state = "running"
+
+    def add(self, result: Dict[str, Any]):
+        with self._lock:
+            if self.state == "catching_up":
+                self._queued.append(result)
+            else:
+                self._add(result)
+
+    def _add(self, result: Dict[str, Any]):
+        for merge in self.merges:
+            merge.add(result)
+        self.items_merged += 1
+
+    async def finish(self):
+        if self._catch_up is not None:
+            await self._catch_up
+        await asyncio.gather(*(merge.finish() for merge in self.merges))
+        self.state = "final"
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self.state,
+                "items_merged": self.items_merged,
+                "merges": {merge.name: merge.value() for merge in self.merges},
+            }
+
+
+# The hubs of the dataset jobs, by job ID.
+aggregator_hubs: Dict[str, AggregatorHub] = {}
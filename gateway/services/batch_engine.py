@@ -0,0 +1,579 @@
+"""
+InferOps - Batch Processing Engine
+
+Runs the items of a dataset job on the compute nodes in parallel. Each item is sent to a
+node's `llm_url` as a non-streaming chat request. In-flight work on every node is bounded
+by its concurrency slots (an item holds a lease for as long as it runs), so a job keeps
+every slot in the cluster busy and its throughput grows with the number of nodes.
+
+An item that fails is retried on another node, up to `BATCH_MAX_ATTEMPTS` times.
+Items are pulled from the input lazily, only when a slot is free to run them; the input may
+be an async iterator (e.g., an upload that is still arriving).
+
+Items are dispatched longest first: the engine looks `BATCH_LOOKAHEAD` items ahead, estimates
+the cost of each from its prompt length and expected output (`estimate_cost`), and gives the
+longest ones to the fastest nodes, and shorter ones to slower nodes, so that a slow node is
+not left finishing a long item after the rest of the job is done. `BatchStats` follows the
+throughput of a batch in those cost units, for an estimate of its time to completion.
+
+Concurrent batches (one per dataset job) share the nodes through `batch_queue`, which hands
+out free slots by weighted fair queueing: each batch has a weight and an optional cap on its
+running items, and receives slots in proportion to its weight, counted in item cost, however
+many items it has queued. A small job is not starved by a huge one. Batch items are of the
+`batch` traffic class: they only take the slots that interactive chat leaves spare (see
+`SchedulerIndex.batch_headroom`), and none while chat requests wait in the admission queue.
+
+Identical items (see `item_key`) can be deduplicated: only the first one runs, and its
+outcome is reported for every copy that came while it was running. Outputs known from
+earlier runs can be supplied by a memo, in which case the item does not run at all.
+"""
+
+import asyncio
+import bisect
+import hashlib
+import itertools
+import json
+import time
+from collections import deque
+from dataclasses import dataclass, field, replace
+from typing import Any, AsyncIterable, AsyncIterator, Callable, Deque, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple, Union
+
+import httpx
+
+from gateway.config import settings
+from gateway.core.health import quarantine_node
+from gateway.core.latency import tokens_per_sec_from_final_chunk
+from gateway.core.scheduler import select_node, scheduler_index, QOS_BATCH, QOS_WAIT
+from gateway.services.admission import admission_queue
+from gateway.services.http_pool import node_clients
+from gateway.services.locking import Lease, LeaseLost, acquire_lease, renew_lease, release_lease
+from gateway.utils.metrics import Counter, Gauge
+
+BATCH_ITEMS = Counter(
+    "inferops_batch_items_total",
+    "Dataset items finished, by outcome: succeeded, failed, deduplicated (copied from an identical item) "
+    "or memoized (output from the memo).",
+    ["outcome"],
+)
+BATCH_RETRIES = Counter("inferops_batch_retries_total", "Dataset item attempts that failed and were retried.")
+BATCH_IN_FLIGHT = Gauge("inferops_batch_in_flight", "Dataset items currently running on a node.")
+BATCH_FLOWS = Gauge("inferops_batch_flows", "Batches (dataset jobs) sharing the nodes through the fair queue.")
+
+
+@dataclass
+class ItemOutcome:
+    """The result of one dataset item."""
+    index: int
+    item: Any
+    output: Optional[str] = None
+    node_name: Optional[str] = None
+    error: Optional[str] = None
+    attempts: int = 0
+    key: Optional[str] = None  # The item key, if it was computed (see `item_key`).
+    reused: bool = False  # The outcome of an identical item, or from the memo.
+    model: Optional[str] = None  # The model of the node that produced the output, if known.
+
+    def to_result(self) -> Dict[str, Any]:
+        """The item's entry in a job's results."""
+        result = {"index": self.index, "original": self.item, "output": self.output, "node": self.node_name}
+        if self.error is not None:
+            result["error"] = self.error
+        if self.reused:
+            result["reused"] = True
+        return result
+
+
+@dataclass
+class _Pending:
+    index: int
+    item: Any
+    attempts: int = 0
+    failed_nodes: Set[int] = field(default_factory=set)
+    key: Optional[str] = None
+    cost: float = 0.0
+
+
+@dataclass
+class BatchStats:
+    """The running totals of a batch in cost units (see `estimate_cost`), for time estimates."""
+    started: float = field(default_factory=time.monotonic)
+    seen_items: int = 0
+    seen_cost: float = 0.0
+    done_items: int = 0
+    done_cost: float = 0.0
+
+    def eta(self, remaining_items: int) -> Optional[float]:
+        """
+        Seconds until `remaining_items` more items are done at the throughput so far; items that
+        were not read yet are assumed to cost the average of those that were.
+        """
+        elapsed = time.monotonic() - self.started
+        if self.done_cost <= 0 or elapsed <= 0:
+            return None
+        waiting_items = self.seen_items - self.done_items
+        unseen_cost = max(remaining_items - waiting_items, 0) * self.seen_cost / self.seen_items
+        return (self.seen_cost - self.done_cost + unseen_cost) / (self.done_cost / elapsed)
+
+
+def item_to_messages(item: Any) -> List[Dict[str, str]]:
+    """
+    Turns a dataset item into chat messages. Items may be a ready-made `{"messages": [...]}`,
+    an object with a `prompt`, `input` or `text` field, a plain string, or any other JSON value
+    (which is sent as its JSON text).
+    """
+    if isinstance(item, dict):
+        if isinstance(item.get("messages"), list):
+            return item["messages"]
+        for key in ("prompt", "input", "text"):
+            if isinstance(item.get(key), str):
+                return [{"role": "user", "content": item[key]}]
+    if isinstance(item, str):
+        return [{"role": "user", "content": item}]
+    return [{"role": "user", "content": json.dumps(item, ensure_ascii=False)}]
+
+
+def item_max_tokens(item: Any) -> Optional[int]:
+    """The most tokens the item asks to be generated (its `max_tokens` field), if it sets a limit."""
+    if isinstance(item, dict) and isinstance(item.get("max_tokens"), int) and not isinstance(item["max_tokens"], bool):
+        return item["max_tokens"]
+    return None
+
+
+# Rough number of characters per token, to estimate the length of a prompt.
+CHARS_PER_TOKEN = 4
+# Cost of a prompt token relative to a generated one (a prompt is processed in one pass).
+PROMPT_TOKEN_COST = 0.1
+
+
+def estimate_cost(item: Any) -> float:
+    """
+    The expected work of an item, in generated tokens: its prompt length plus its expected
+    output. The output is the item's `max_tokens` if it has one; otherwise it is
+    `EXPECTED_OUTPUT_TOKENS`, scaled by the item's `metadata.complexity` hint (1-10, 5 being
+    average) if it has one.
+    """
+    prompt_chars = sum(
+        len(message["content"]) for message in item_to_messages(item)
+        if isinstance(message, dict) and isinstance(message.get("content"), str)
+    )
+    output_tokens = float(settings.EXPECTED_OUTPUT_TOKENS)
+    if isinstance(item, dict):
+        metadata = item.get("metadata") if isinstance(item.get("metadata"), dict) else {}
+        max_tokens = item_max_tokens(item)
+        if max_tokens is not None:
+            output_tokens = float(max_tokens)
+        elif isinstance(metadata.get("complexity"), (int, float)):
+            output_tokens *= max(metadata["complexity"], 1) / 5
+    return prompt_chars / CHARS_PER_TOKEN * PROMPT_TOKEN_COST + output_tokens
+
+
+def item_key(item: Any, model: Optional[str] = None) -> str:
+    """Identifies an item by the model, the messages and the token limit it is sent with: identical items share a key."""
+    fields = {"model": model, "messages": item_to_messages(item)}
+    max_tokens = item_max_tokens(item)
+    if max_tokens is not None:
+        fields["max_tokens"] = max_tokens
+    document = json.dumps(fields, sort_keys=True, ensure_ascii=False)
+    return f"{model or '*'}:{hashlib.blake2b(document.encode('utf-8'), digest_size=16).hexdigest()}"
+
+
+def _reserve(model: Optional[str], avoid: FrozenSet[int]) -> Optional[Tuple[Dict[str, Any], Lease]]:
+    """
+    Leases a slot for an item on a node it has not failed on yet. Only if no such node is
+    online at all (busy or not) may the item go back to one it failed on. Interactive
+    requests come first: nothing is leased while they wait or if no slot is spare for batch work.
+    """
+    if len(admission_queue) or scheduler_index.batch_headroom(model) <= 0:
+        return None
+    node = select_node(model, exclude=avoid)
+    if node is None and avoid and not scheduler_index.online_nodes(model) - avoid:
+        node = select_node(model)
+    lease = acquire_lease(node, ttl=settings.REQUEST_TIMEOUT, qos=QOS_BATCH) if node else None
+    return (node, lease) if lease else None
+
+
+class _Flow:
+    """The share of one batch in the fair queue."""
+
+    def __init__(self, model: Optional[str], weight: float, max_in_flight: Optional[int], wake: Callable[[], None]):
+        self.model = model
+        self.weight = weight
+        self.max_in_flight = max_in_flight
+        self.wake = wake
+        self.in_flight = 0
+        self.finish_tag = 0.0  # Virtual time at which its last granted item is paid for.
+        self.bid: Optional[_Pending] = None  # The item it is waiting to run.
+        self.grant: Optional[Tuple[Dict[str, Any], Lease]] = None  # A slot reserved for it.
+        self.waiting_since: Optional[float] = None
+
+
+class FairQueue:
+    """
+    Hands out free slots to the batches that wait for one, by start-time fair queueing: a
+    batch's items are stamped with a virtual start time (the later of the current virtual time
+    and the finish of its previous item), items are finished `cost / weight` later, and the
+    waiting batch with the earliest start goes first. A batch that cannot use any free node
+    (e.g. its model is not served) does not hold up the others.
+    """
+
+    def __init__(self):
+        self._flows: List[_Flow] = []
+        self._virtual_time = 0.0
+
+    def open(self, model: Optional[str], weight: float, max_in_flight: Optional[int],
+             wake: Callable[[], None]) -> _Flow:
+        """Adds a batch; `wake` is called when it is granted a slot or should ask for one again."""
+        flow = _Flow(model, max(weight, 1e-6), max_in_flight, wake)
+        self._flows.append(flow)
+        BATCH_FLOWS.set(len(self._flows))
+        return flow
+
+    def close(self, flow: _Flow):
+        """Removes a batch, giving back a slot it was granted but did not use."""
+        self._flows.remove(flow)
+        BATCH_FLOWS.set(len(self._flows))
+        flow.bid = None
+        if flow.grant is not None:
+            release_lease(flow.grant[1])  # Wakes the queue for the others.
+            flow.grant = None
+
+    def request(self, flow: _Flow, pending: _Pending) -> Optional[Tuple[Dict[str, Any], Lease]]:
+        """
+        Asks for a slot to run `pending`. Returns the reservation if the batch has one now;
+        otherwise `pending` waits in the queue, and the batch is woken once it is granted one.
+        """
+        grant, flow.grant = flow.grant, None
+        if grant is not None and grant[0]["id"] in pending.failed_nodes:
+            # Granted while waiting with another item, on a node this one failed on.
+            flow.in_flight -= 1
+            release_lease(grant[1])
+            grant = None
+        flow.bid = pending
+        if flow.waiting_since is None:
+            flow.waiting_since = time.monotonic()
+        if grant is None:
+            self.dispatch()
+            grant, flow.grant = flow.grant, None
+        if grant is not None:
+            flow.bid = None
+            QOS_WAIT.observe(time.monotonic() - flow.waiting_since, qos=QOS_BATCH)
+            flow.waiting_since = None
+        return grant
+
+    def recharge(self, flow: _Flow, granted: _Pending, chosen: _Pending):
+        """
+        Charges a batch for the item it runs on its latest slot, `chosen`, instead of the item
+        the slot was granted for, `granted` (see `choose_for` in `run_batch`).
+        """
+        flow.finish_tag += (max(chosen.cost, 1.0) - max(granted.cost, 1.0)) / flow.weight
+
+    def finished(self, flow: _Flow):
+        """Tells the queue that one of the batch's items has stopped running."""
+        flow.in_flight -= 1
+        self.dispatch()
+
+    def wake_waiting(self):
+        """
+        Wakes the batches waiting for a slot, which ask for one again. Called when a slot is
+        released or a node changes, possibly under the lease lock, so it does not grant itself.
+        """
+        for flow in self._flows:
+            if flow.bid is not None and flow.grant is None:
+                flow.wake()
+
+    def dispatch(self):
+        """Grants free slots to the waiting batches, in fair order, for as long as it can."""
+        granted = True
+        while granted:
+            granted = False
+            waiting = [
+                flow for flow in self._flows
+                if flow.bid is not None and flow.grant is None
+                and (not flow.max_in_flight or flow.in_flight < flow.max_in_flight)
+            ]
+            waiting.sort(key=lambda flow: max(self._virtual_time, flow.finish_tag))
+            for flow in waiting:
+                reservation = _reserve(flow.model, frozenset(flow.bid.failed_nodes))
+                if reservation is None:
+                    continue
+                start = max(self._virtual_time, flow.finish_tag)
+                self._virtual_time = start
+                flow.finish_tag = start + max(flow.bid.cost, 1.0) / flow.weight
+                flow.in_flight += 1
+                flow.grant = reservation
+                flow.wake()
+                granted = True
+                break
+
+
+# The queue shared by all batches; it is woken whenever a slot is released or a node changes.
+batch_queue = FairQueue()
+scheduler_index.add_capacity_listener(batch_queue.wake_waiting)
+
+
+async def _run_on_node(node: Dict[str, Any], item: Any) -> str:
+    """Sends one item to a node and returns the generated text."""
+    payload = {"messages": item_to_messages(item), "stream": False}
+    max_tokens = item_max_tokens(item)
+    if max_tokens is not None:
+        payload["options"] = {"num_predict": max_tokens}
+    response = await node_clients.llm(node).post(node["llm_url"], json=payload)
+    response.raise_for_status()
+    body = response.json()
+    scheduler_index.observe_latency(node["id"], tokens_per_sec=tokens_per_sec_from_final_chunk(body))
+    return (body.get("message") or {}).get("content") or ""
+
+
+async def _keep_lease(lease: Lease):
+    """
+    Renews a batch lease for as long as its item runs. The node's answer comes in one piece, and
+    `REQUEST_TIMEOUT` bounds each read rather than the whole request, so it may outlast one TTL.
+    Returns once the lease is lost (refused by the node, or expired); the item must stop then.
+    """
+    while True:
+        await asyncio.sleep(min(settings.REQUEST_TIMEOUT / 2, settings.LEASE_RENEW_INTERVAL))
+        if not renew_lease(lease, ttl=settings.REQUEST_TIMEOUT):
+            return
+
+
+async def _aiter(items: Iterable[Any]) -> AsyncIterator[Any]:
+    for item in items:
+        yield item
+
+
+async def run_batch(
+    items: Union[Iterable[Any], AsyncIterable[Any]],
+    on_outcome: Callable[[ItemOutcome], None],
+    model: Optional[str] = None,
+    indexed: bool = False,
+    dedupe: bool = False,
+    memo: Optional[Callable[[str], Optional[str]]] = None,
+    stats: Optional[BatchStats] = None,
+    weight: float = 1.0,
+    max_in_flight: Optional[int] = None,
+):
+    """
+    Processes `items` concurrently on all nodes and reports each finished item to `on_outcome`
+    (in completion order). Returns once every item has succeeded or failed for good; an error
+    raised by an async `items` is raised from here, after the running items were cancelled.
+
+    Items are numbered in the order they come, unless `indexed` is set: `items` then yields
+    `(index, item)` pairs (e.g. to run the rest of a dataset under the items' original indices).
+
+    With `dedupe`, an item identical to one that is still running waits for it and is reported
+    with its outcome. `memo` looks up an item key and returns the item's output if it is known.
+    `stats`, if given, is kept up to date with the batch's progress.
+
+    The batch shares the nodes with the other running batches in proportion to its `weight`,
+    with at most `max_in_flight` of its items running at once (if given); see `FairQueue`.
+    """
+    source = items.__aiter__() if isinstance(items, AsyncIterable) else _aiter(items)
+    next_index = 0
+    # The next item being fetched from the source; waited for along with the running items.
+    pull: Optional[asyncio.Future] = None
+    retries: Deque[_Pending] = deque()
+    # The items read ahead, as (sort key, sequence, item): longest first, or in order for `fifo`.
+    window: List[Tuple[Any, int, _Pending]] = []
+    sequence = itertools.count()
+    longest_first = settings.BATCH_DISPATCH_ORDER == "longest_first"
+    stats = stats if stats is not None else BatchStats()
+    exhausted = False
+    in_flight: Set[asyncio.Task] = set()
+    # The copies waiting for an identical item that is running (or waiting to run), by item key.
+    followers: Dict[str, List[_Pending]] = {}
+
+    # Woken when the batch is granted a slot, or when slots may have become free.
+    capacity = asyncio.Event()
+    flow = batch_queue.open(model, weight, max_in_flight, capacity.set)
+
+    def deliver(outcome: ItemOutcome):
+        """Passes an outcome to `on_outcome`; if that raises, the item is reported as failed instead."""
+        try:
+            on_outcome(outcome)
+            return
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            print(f"❌ Handling the outcome of item {outcome.index} failed: {error}")
+        if outcome.error is None:
+            try:
+                on_outcome(replace(outcome, output=None, error=f"Handling the output failed: {error}"))
+            except Exception as e:
+                print(f"❌ Recording item {outcome.index} as failed did not work either: {type(e).__name__}: {e}")
+
+    def report(pending: _Pending, outcome: ItemOutcome):
+        stats.done_items += 1
+        stats.done_cost += pending.cost
+        deliver(outcome)
+        for follower in followers.pop(pending.key, ()):
+            BATCH_ITEMS.inc(outcome="deduplicated")
+            deliver(replace(outcome, index=follower.index, item=follower.item, attempts=0, reused=True))
+
+    async def run(pending: _Pending, node: Dict[str, Any], lease: Lease):
+        pending.attempts += 1
+        BATCH_IN_FLIGHT.inc()
+        keeper = asyncio.ensure_future(_keep_lease(lease))
+        work = asyncio.ensure_future(_run_on_node(node, pending.item))
+        try:
+            await asyncio.wait({work, keeper}, return_when=asyncio.FIRST_COMPLETED)
+            if not work.done():
+                raise LeaseLost(f"The lease on node {node['id']} was refused or expired.")
+            output = work.result()
+        except Exception as e:
+            # Transport and HTTP errors, bodies that are not the expected JSON document, and a
+            # lease the node refused (the item goes to another node like after a failure).
+            if isinstance(e, httpx.RequestError):
+                # The node is unreachable; keep it out of the pool for a while.
+                quarantine_node(node, f"🚨 Node {node['id']} is unreachable. Quarantining it.")
+            pending.failed_nodes.add(node["id"])
+            if pending.attempts < settings.BATCH_MAX_ATTEMPTS:
+                BATCH_RETRIES.inc()
+                retries.append(pending)
+                return
+            BATCH_ITEMS.inc(outcome="failed")
+            report(pending, ItemOutcome(pending.index, pending.item, node_name=node["name"],
+                                        error=f"{type(e).__name__}: {e}", attempts=pending.attempts, key=pending.key))
+            return
+        finally:
+            keeper.cancel()
+            if not work.done():
+                work.cancel()  # Closing the request stops the node's generation.
+                await asyncio.gather(work, return_exceptions=True)
+            BATCH_IN_FLIGHT.dec()
+            release_lease(lease)
+            batch_queue.finished(flow)
+        BATCH_ITEMS.inc(outcome="succeeded")
+        report(pending, ItemOutcome(pending.index, pending.item, output=output, node_name=node["name"],
+                                    attempts=pending.attempts, key=pending.key,
+                                    model=scheduler_index.node_model(node["id"])))
+
+    def add_to_window(pending: _Pending):
+        bisect.insort(window, (-pending.cost if longest_first else 0, next(sequence), pending))
+
+    def next_pending() -> Optional[_Pending]:
+        """The next item to run: a retry, or the first item of the window."""
+        if retries:
+            return retries.popleft()
+        fill_window()
+        return window.pop(0)[2] if window else None
+
+    def fill_window():
+        """Takes the items the source has ready, up to the lookahead."""
+        nonlocal exhausted, next_index, pull
+        while not exhausted and len(window) < max(settings.BATCH_LOOKAHEAD, 1):
+            if pull is None:
+                pull = asyncio.ensure_future(source.__anext__())
+            if not pull.done():
+                return
+            fetched, pull = pull, None
+            try:
+                item = fetched.result()
+            except StopAsyncIteration:
+                exhausted = True
+                return
+            if indexed:
+                pending = _Pending(*item)
+            else:
+                pending = _Pending(next_index, item)
+                next_index += 1
+
+            # --- Deduplication: items that need not run take no slot ---
+            if dedupe or memo is not None:
+                pending.key = item_key(pending.item, model)
+                if pending.key in followers:
+                    followers[pending.key].append(pending)
+                    continue
+                output = memo(pending.key) if memo else None
+                if output is not None:
+                    BATCH_ITEMS.inc(outcome="memoized")
+                    deliver(ItemOutcome(pending.index, pending.item, output=output, key=pending.key, reused=True))
+                    continue
+                if dedupe:
+                    followers[pending.key] = []
+
+            pending.cost = estimate_cost(pending.item)
+            stats.seen_items += 1
+            stats.seen_cost += pending.cost
+            add_to_window(pending)
+
+    def choose_for(node: Dict[str, Any], pending: _Pending) -> _Pending:
+        """
+        Swaps a new item for the one in the window that suits the node: the faster the node
+        is relative to the others, the longer the item (the fastest gets the longest).
+        """
+        if not longest_first or pending.attempts or not window:
+            return pending
+        speeds = scheduler_index.node_speeds(model)
+        if node["id"] not in speeds:
+            return pending
+        add_to_window(pending)
+        position = round((1 - speeds[node["id"]] / max(speeds.values())) * (len(window) - 1))
+        return window.pop(position)[2]
+
+    try:
+        held: Optional[_Pending] = None
+        # When the job last found no node online to run on, with nothing in flight.
+        idle_since: Optional[float] = None
+        while True:
+            # --- Dispatch: start items for as long as there are free slots ---
+            while True:
+                if held is not None and not held.attempts:
+                    add_to_window(held)  # Longer items may have come in while it waited.
+                    held = None
+                pending = held or next_pending()
+                held = None
+                if pending is None:
+                    break
+                reservation = batch_queue.request(flow, pending)
+                if reservation is None:
+                    held = pending
+                    break
+                node, lease = reservation
+                chosen = choose_for(node, pending)
+                if chosen is not pending:
+                    batch_queue.recharge(flow, pending, chosen)
+                task = asyncio.ensure_future(run(chosen, node, lease))
+                in_flight.add(task)
+
+            if held is None and not in_flight and not retries and not window and exhausted:
+                return
+
+            timeout = None
+            if in_flight or held is None or scheduler_index.online_nodes(model):
+                # Items are running, the job is waiting for its input rather than for a node, or
+                # the nodes are only busy (or their slots are reserved for interactive traffic).
+                idle_since = None
+            else:
+                now = time.monotonic()
+                idle_since = idle_since or now
+                timeout = settings.BATCH_IDLE_TIMEOUT - (now - idle_since)
+                if timeout <= 0:
+                    # No node has been online for a while: give up on the remaining items.
+                    print(f"⚠️ No node came online for {settings.BATCH_IDLE_TIMEOUT}s; failing the remaining items.")
+                    while held is not None:
+                        BATCH_ITEMS.inc(outcome="failed")
+                        report(held, ItemOutcome(held.index, held.item, error="No node available.",
+                                                 attempts=held.attempts, key=held.key))
+                        held = next_pending()
+                        if held is None and pull is not None:
+                            await asyncio.wait({pull})
+                            held = next_pending()
+                    return
+
+            # --- Wait for an item to finish or for capacity to appear ---
+            capacity.clear()
+            waiter = asyncio.ensure_future(capacity.wait())
+            waiting_for = in_flight | {waiter}
+            if pull is not None:
+                waiting_for.add(pull)
+            done, _ = await asyncio.wait(waiting_for, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            waiter.cancel()
+            in_flight -= done
+    finally:
+        batch_queue.close(flow)
+        if pull is not None:
+            in_flight.add(pull)
+        for task in in_flight:
+            task.cancel()
+        await asyncio.gather(*in_flight, return_exceptions=True)
+        if hasattr(source, "aclose"):
+            await source.aclose()
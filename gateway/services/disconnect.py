@@ -0,0 +1,126 @@
+"""
+InferOps - Client Disconnect Handling
+
+When a client goes away (e.g., a browser tab is closed) its chat stream must stop at once:
+the upstream HTTP stream is closed, which is how Ollama is told to stop generating, and the
+node's slot is released. Without this, the generation keeps the GPU busy until it finishes.
+
+`until_disconnect` watches the ASGI connection and cancels the response body the moment the
+disconnect arrives. Each abandoned generation is counted, together with an estimate of the
+GPU time it would still have used (from the node's decode-rate EWMA).
+"""
+
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Optional
+
+from fastapi import HTTPException, Request
+
+from gateway.config import settings
+from gateway.core.latency import expected_completion_seconds
+from gateway.core.scheduler import scheduler_index
+from gateway.utils.metrics import Counter
+
+DISCONNECTS = Counter(
+    "inferops_chat_disconnects_total",
+    "Chat streams abandoned by their client, by stage (queued, prefill or decode).",
+    ["stage"],
+)
+GPU_SECONDS_SAVED = Counter(
+    "inferops_gpu_seconds_saved_total",
+    "Estimated GPU time not spent on generations whose client had disconnected.",
+)
+
+
+def record_abandoned_generation(node_id: Optional[int], tokens_generated: int) -> float:
+    """
+    Counts a generation that was stopped because its client disconnected and returns the
+    estimated GPU-seconds saved: the time the node would have needed for the rest of a
+    typical answer (`EXPECTED_OUTPUT_TOKENS`), including prefill if it had not finished yet.
+    """
+    if node_id is None:
+        DISCONNECTS.inc(stage="queued")
+        return 0.0
+    DISCONNECTS.inc(stage="decode" if tokens_generated else "prefill")
+    estimate = scheduler_index.latency_estimate(node_id)
+    if estimate is None:
+        return 0.0
+    remaining = max(settings.EXPECTED_OUTPUT_TOKENS - tokens_generated, 0)
+    if tokens_generated:
+        saved = remaining / estimate["tokens_per_sec"]
+    else:
+        saved = expected_completion_seconds(estimate, remaining)
+    GPU_SECONDS_SAVED.inc(saved)
+    return saved
+
+
+async def wait_for_disconnect(http_request: Request):
+    """Returns once the client of an (already fully read) request has disconnected."""
+    while True:
+        message = await http_request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def cancel_on_disconnect(http_request: Request, work: Awaitable[Any], queued: bool = True) -> Any:
+    """
+    Awaits `work` (e.g., a wait in the admission queue) unless the client disconnects first,
+    in which case `work` is cancelled and HTTP 499 (client closed request) is raised.
+
+    A cancelled wait for admission is counted as an abandoned queued request. Pass
+    `queued=False` for work that counts its own abandoned generation, such as collecting a
+    stream whose generator records how far it got.
+    """
+    task = asyncio.ensure_future(work)
+    watcher = asyncio.ensure_future(wait_for_disconnect(http_request))
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watcher.cancel()
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+    if task.cancelled():
+        if queued:
+            record_abandoned_generation(None, 0)
+        raise HTTPException(status_code=499, detail="Client closed request.")
+    return task.result()
+
+
+async def until_disconnect(http_request: Request, body: AsyncIterator[Any]) -> AsyncIterator[Any]:
+    """
+    Yields the chunks of `body` until it ends or the client disconnects.
+
+    While `body` is waiting for its next chunk (e.g., for the next token), a disconnect cancels
+    it on the spot, so its cleanup runs immediately rather than when it is garbage-collected.
+    """
+    task = asyncio.current_task()
+    in_body = False
+    disconnected = False
+
+    async def watch():
+        nonlocal disconnected
+        await wait_for_disconnect(http_request)
+        disconnected = True
+        if in_body:
+            task.cancel()
+
+    watcher = asyncio.ensure_future(watch())
+    try:
+        while not disconnected:
+            in_body = True
+            try:
+                chunk = await body.__anext__()
+            except StopAsyncIteration:
+                return
+            finally:
+                in_body = False
+            yield chunk
+    except asyncio.CancelledError:
+        if not disconnected:
+            raise
+        # The cancellation was ours; there is nobody left to send a response to.
+        if hasattr(task, "uncancel"):
+            task.uncancel()
+    finally:
+        watcher.cancel()
+        await body.aclose()
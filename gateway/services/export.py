@@ -0,0 +1,114 @@
+"""
+InferOps - Result Export
+
+Turns the results of a dataset job into a downloadable file, one page of results at a time,
+so that an export never holds more than a page in memory whatever the size of the job:
+
+- `jsonl`: one JSON result per line (the job store's own format).
+- `csv`: one row per result, with the `index`, `node`, `output`, `error` and `original`
+  columns (a non-string `original` is written as its JSON text).
+- `parquet`: a zstd-compressed Parquet file with the same columns, one row group per page.
+  It needs the optional `pyarrow` package.
+"""
+
+import csv
+import importlib.util
+import io
+import json
+from typing import Any, Dict, Iterable, Iterator, List
+
+EXPORT_FORMATS = ("jsonl", "csv", "parquet")
+
+MEDIA_TYPES = {
+    "jsonl": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+COLUMNS = ("index", "node", "output", "error", "original")
+
+
+def format_available(fmt: str) -> bool:
+    """Whether the packages an export format needs are installed."""
+    if fmt == "parquet":
+        return importlib.util.find_spec("pyarrow") is not None
+    return fmt in EXPORT_FORMATS
+
+
+def _row(result: Dict[str, Any]) -> Dict[str, Any]:
+    original = result.get("original")
+    return {
+        "index": result.get("index"),
+        "node": result.get("node"),
+        "output": result.get("output"),
+        "error": result.get("error"),
+        "original": original if original is None or isinstance(original, str) else json.dumps(original, ensure_ascii=False),
+    }
+
+
+def export_jsonl(pages: Iterable[List[Dict[str, Any]]]) -> Iterator[bytes]:
+    for page in pages:
+        yield "".join(json.dumps(result, ensure_ascii=False) + "\n" for result in page).encode("utf-8")
+
+
+def export_csv(pages: Iterable[List[Dict[str, Any]]], header: bool = True) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=COLUMNS)
+    if header:
+        writer.writeheader()
+    for page in pages:
+        writer.writerows(_row(result) for result in page)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")  # A header without rows.
+
+
+class _ChunkSink(io.RawIOBase):
+    """A write-only file that hands out what was written to it since it was last drained."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def export_parquet(pages: Iterable[List[Dict[str, Any]]]) -> Iterator[bytes]:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([("index", pa.int64())] + [(column, pa.string()) for column in COLUMNS[1:]])
+    sink = _ChunkSink()
+    with pq.ParquetWriter(sink, schema, compression="zstd") as writer:
+        for page in pages:
+            rows = [_row(result) for result in page]
+            writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+            yield sink.drain()
+    yield sink.drain()  # The footer.
+
+
+def export_results(fmt: str, pages: Iterable[List[Dict[str, Any]]], header: bool = True) -> Iterator[bytes]:
+    """The bytes of an export of `pages` of results in the format `fmt`, chunk by chunk."""
+    if fmt == "jsonl":
+        return export_jsonl(pages)
+    if fmt == "csv":
+        return export_csv(pages, header=header)
+    if fmt == "parquet":
+        return export_parquet(pages)
+    raise ValueError(f"Unknown export format '{fmt}'. Available: {', '.join(EXPORT_FORMATS)}.")
@@ -0,0 +1,118 @@
+"""
+InferOps - Hedged Requests
+
+A hedged request is sent to a second node when the first has not produced its first token
+within the recent p95 TTFT (`HEDGE_QUANTILE`). Whichever node starts streaming first wins;
+the other is cancelled at once so its slot returns to the pool.
+
+Hedges cost cluster capacity, so they are paid for out of a budget: every chat request adds
+`HEDGE_BUDGET_PERCENT`/100 of a token and every hedge spends a whole one. Over time hedges
+can therefore never exceed that percentage of the traffic.
+"""
+
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+from gateway.config import settings
+from gateway.core.latency import latency_tracker
+from gateway.utils.metrics import Counter
+
+HEDGES = Counter(
+    "inferops_hedged_requests_total",
+    "Hedge decisions: launched, won/lost by the hedge, or skipped for lack of budget or node.",
+    ["outcome"],
+)
+
+
+class HedgeBudget:
+    """A token bucket that refills with a fixed fraction of a token per request."""
+
+    def __init__(self, percent: float, burst: float = 10.0):
+        self.ratio = percent / 100.0
+        self.burst = burst
+        self._tokens = 0.0
+        self._lock = threading.Lock()
+
+    def record_request(self):
+        """Credits the budget for one request of regular traffic."""
+        with self._lock:
+            self._tokens = min(self._tokens + self.ratio, self.burst)
+
+    def try_spend(self) -> bool:
+        """Takes one token for a hedge; returns False if the budget is exhausted."""
+        with self._lock:
+            if self._tokens < 1.0:
+                return False
+            self._tokens -= 1.0
+            return True
+
+    def refund(self):
+        """Returns a token that was taken for a hedge that could not be launched."""
+        with self._lock:
+            self._tokens = min(self._tokens + 1.0, self.burst)
+
+
+# The process-wide hedge budget, credited by every chat request.
+hedge_budget = HedgeBudget(percent=settings.HEDGE_BUDGET_PERCENT)
+
+
+def hedge_delay(model_id: Optional[str] = None) -> float:
+    """Seconds to wait for the first token before hedging, from the recent TTFT distribution."""
+    quantile = latency_tracker.ttft_quantile(settings.HEDGE_QUANTILE, model_id)
+    if quantile is None:
+        return settings.HEDGE_FALLBACK_DELAY
+    return max(quantile, settings.HEDGE_MIN_DELAY)
+
+
+async def race_with_hedge(
+    primary: Awaitable[Any],
+    delay: float,
+    launch_hedge: Callable[[], Optional[Awaitable[Any]]],
+    discard: Callable[[int, Any], Awaitable[None]],
+    budget: HedgeBudget = hedge_budget,
+) -> Tuple[int, Any]:
+    """
+    Runs `primary` and, if it has not finished after `delay` seconds and the budget allows,
+    the awaitable returned by `launch_hedge` (which may return None if no node is free).
+
+    Returns (index, result) of the first to succeed: 0 for the primary, 1 for the hedge.
+    The other one is cancelled, or, if it succeeded too, handed to `discard`.
+    Raises the primary's exception (or the hedge's) if both fail.
+    """
+    tasks: List[asyncio.Future] = [asyncio.ensure_future(primary)]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            if not budget.try_spend():
+                HEDGES.inc(outcome="no_budget")
+            else:
+                hedge = launch_hedge()
+                if hedge is None:
+                    budget.refund()
+                    HEDGES.inc(outcome="no_node")
+                else:
+                    tasks.append(asyncio.ensure_future(hedge))
+                    HEDGES.inc(outcome="launched")
+
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            winners = [task for task in tasks if task in done and task.exception() is None]
+            if winners:
+                winner = tasks.index(winners[0])
+                if len(tasks) > 1:
+                    HEDGES.inc(outcome="won" if winner == 1 else "lost")
+                for index, task in enumerate(tasks):
+                    if index != winner and task.done() and not task.cancelled() and task.exception() is None:
+                        await discard(index, task.result())
+                return winner, winners[0].result()
+
+        errors = [task.exception() for task in tasks]
+        raise errors[0]
+    finally:
+        losers = [task for task in tasks if not task.done()]
+        for task in losers:
+            task.cancel()
+        # Wait for the losers to unwind so their connections are closed before the slot is reused.
+        await asyncio.gather(*losers, return_exceptions=True)
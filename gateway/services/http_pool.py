@@ -0,0 +1,178 @@
+"""
+InferOps - Per-Node HTTP Connection Pools
+
+Every node gets its own pair of `httpx.AsyncClient`s: one for the LLM endpoint and one for
+the monitor agent. With explicit pool limits and keep-alive per node, a slow node can only
+exhaust its own connections, never those used to reach the others.
+
+When a node comes online, its LLM pool is pre-warmed with one connection per concurrency
+slot, so TCP (and TLS) setup does not land on the first user requests.
+
+Per-node pool usage, limits and saturation (requests that found every connection busy) are
+exported on `/api/v1/metrics`.
+"""
+
+import asyncio
+import threading
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+
+from gateway.config import settings
+from gateway.utils.metrics import Counter, Gauge
+
+POOL_IN_USE = Gauge("inferops_http_pool_in_use", "Requests in flight (on a connection or waiting for one), per node pool.", ["node", "pool"])
+POOL_LIMIT = Gauge("inferops_http_pool_limit", "Maximum number of connections, per node pool.", ["node", "pool"])
+POOL_SATURATED = Counter(
+    "inferops_http_pool_saturated_total",
+    "Requests that found every connection of the node pool busy and had to wait.",
+    ["node", "pool"],
+)
+POOL_WARMED = Counter("inferops_http_pool_warmed_total", "Connections opened ahead of time by pool warm-up.", ["node"])
+
+LLM_POOL = "llm"
+MONITOR_POOL = "monitor"
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """Wraps a response stream and reports when the response has been closed."""
+
+    def __init__(self, stream: httpx.AsyncByteStream, on_close):
+        self._stream = stream
+        self._on_close = on_close
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            if self._on_close is not None:
+                self._on_close()
+                self._on_close = None
+
+
+class _MeteredTransport(httpx.AsyncBaseTransport):
+    """Counts the requests in flight on a pool, from the moment they are sent until their response is closed."""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, limit: int, labels: Dict[str, str]):
+        self._transport = transport
+        self.limit = limit
+        self.in_use = 0
+        self._labels = labels
+        POOL_LIMIT.set(limit, **labels)
+        POOL_IN_USE.set(0, **labels)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if self.in_use >= self.limit:
+            POOL_SATURATED.inc(**self._labels)
+        self.in_use += 1
+        POOL_IN_USE.set(self.in_use, **self._labels)
+        try:
+            response = await self._transport.handle_async_request(request)
+        except BaseException:
+            self._release()
+            raise
+        if response.is_closed:
+            # The body was already read in full by the transport.
+            self._release()
+        else:
+            response.stream = _ReleasingStream(response.stream, self._release)
+        return response
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+    def _release(self):
+        self.in_use -= 1
+        POOL_IN_USE.set(self.in_use, **self._labels)
+
+
+class NodeClientRegistry:
+    """
+    Hands out the per-node clients, creating them on first use.
+
+    `transport`, if set, is used instead of a real network transport (e.g., for tests).
+    """
+
+    def __init__(self, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.transport = transport
+        self._clients: Dict[Tuple[int, str], httpx.AsyncClient] = {}
+        # The metered transport of each client, which counts its requests in flight.
+        self._meters: Dict[Tuple[int, str], _MeteredTransport] = {}
+        self._lock = threading.Lock()
+
+    def llm(self, node_config: Dict[str, Any]) -> httpx.AsyncClient:
+        """The client for the node's LLM endpoint, sized to its concurrency slots plus headroom."""
+        limit = node_config.get("max_concurrency", 1) + settings.HTTP_POOL_EXTRA_CONNECTIONS
+        timeout = httpx.Timeout(settings.REQUEST_TIMEOUT, connect=settings.HTTP_CONNECT_TIMEOUT)
+        return self._client(node_config, LLM_POOL, limit, timeout)
+
+    def monitor(self, node_config: Dict[str, Any]) -> httpx.AsyncClient:
+        """The client for the node's monitor agent (health checks, leases)."""
+        timeout = httpx.Timeout(settings.HEALTH_CHECK_INTERVAL - 1, connect=settings.HTTP_CONNECT_TIMEOUT)
+        return self._client(node_config, MONITOR_POOL, settings.HTTP_MONITOR_CONNECTIONS, timeout)
+
+    def pool_usage(self, node_id: int, pool: str = LLM_POOL) -> Optional[Tuple[int, int]]:
+        """Returns (requests in flight, connection limit) of a node pool, or None if it was never used."""
+        meter = self._meters.get((node_id, pool))
+        if meter is None:
+            return None
+        return meter.in_use, meter.limit
+
+    async def warm_up(self, node_config: Dict[str, Any]):
+        """
+        Opens one keep-alive connection per concurrency slot to the node's LLM server, using
+        Ollama's cheap `/api/version` endpoint. Failures are ignored; the pool simply stays cold.
+        """
+        client = self.llm(node_config)
+        parts = urlsplit(node_config["llm_url"])
+        url = f"{parts.scheme}://{parts.netloc}/api/version"
+
+        async def touch():
+            try:
+                response = await client.get(url, timeout=settings.HTTP_CONNECT_TIMEOUT)
+                await response.aclose()
+                return True
+            except httpx.HTTPError:
+                return False
+
+        opened = await asyncio.gather(*(touch() for _ in range(node_config.get("max_concurrency", 1))))
+        POOL_WARMED.inc(sum(opened), node=str(node_config["id"]))
+        if any(opened):
+            print(f"🔥 Warmed {sum(opened)} connection(s) to node {node_config['id']}.")
+
+    async def aclose(self):
+        """Closes every client, e.g. on shutdown."""
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+            self._meters.clear()
+        await asyncio.gather(*(client.aclose() for client in clients), return_exceptions=True)
+
+    def _client(self, node_config: Dict[str, Any], pool: str, limit: int, timeout: httpx.Timeout) -> httpx.AsyncClient:
+        key = (node_config["id"], pool)
+        client = self._clients.get(key)
+        if client is not None:
+            return client
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                limits = httpx.Limits(
+                    max_connections=limit,
+                    max_keepalive_connections=limit,
+                    keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY,
+                )
+                transport = self.transport or httpx.AsyncHTTPTransport(limits=limits)
+                meter = _MeteredTransport(transport, limit, {"node": str(node_config["id"]), "pool": pool})
+                client = httpx.AsyncClient(transport=meter, timeout=timeout)
+                self._clients[key] = client
+                self._meters[key] = meter
+            return client
+
+
+# The process-wide registry, shared by the chat proxy, the health checks and the lease service.
+node_clients = NodeClientRegistry()
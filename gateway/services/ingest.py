@@ -0,0 +1,192 @@
+"""
+InferOps - Streaming Dataset Ingestion
+
+A dataset upload is parsed while it arrives, and its items are fed to the job while the
+rest of the upload is still on the wire. Gateway memory stays bounded whatever the dataset
+size:
+
+- `upload_parts` reads the request body chunk by chunk (a multipart form, or the dataset
+  as the raw body), instead of letting the framework buffer the whole file first. The
+  other form fields are small options, which are capped in size.
+- Parsed items are appended to a `DatasetSpool`, a JSONL file (in the job's directory) that
+  the job reads back as it goes. A slow job never holds up the upload, and a fast one waits
+  for more items. The file outlives a gateway restart, so an interrupted job can resume.
+"""
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from fastapi import Request
+from python_multipart.exceptions import MultipartParseError
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+from gateway.utils.json_stream import DatasetFormatError
+from gateway.utils.streaming import NDJSONFramer
+
+# Size of the reads from the spool file.
+SPOOL_READ_BYTES = 64 * 1024
+# The most data a form field other than the dataset `file` may carry, on its own and in all.
+MAX_FIELD_BYTES = 4 * 1024
+MAX_FIELDS_BYTES = 16 * 1024
+
+
+class DatasetSpool:
+    """
+    The items of one upload, in a JSONL file: written by the upload handler as the items are
+    parsed, and read back by the job while it runs. The file is at `path`, or a temporary one.
+
+    `limit` (from `data_count`) caps the number of items; it may be set after the first items
+    were written, in which case the reader stops early.
+    """
+
+    def __init__(self, limit: Optional[int] = None, path: Optional[str] = None):
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix="inferops-dataset-", suffix=".jsonl")
+            self._writer = os.fdopen(fd, "wb")
+        else:
+            self._writer = open(path, "wb")
+        self.path = path
+        self.limit = limit
+        self.count = 0
+        self.finished = False
+        self.error: Optional[Exception] = None
+        self._grown = asyncio.Event()
+
+    @classmethod
+    def restore(cls, path: str, count: int) -> "DatasetSpool":
+        """The spool of a completed upload of `count` items, from the file it left at `path`."""
+        spool = cls.__new__(cls)
+        spool.path = path
+        spool._writer = None
+        spool.limit = spool.count = count
+        spool.finished = True
+        spool.error = None
+        spool._grown = asyncio.Event()
+        return spool
+
+    @property
+    def full(self) -> bool:
+        return self.limit is not None and self.count >= self.limit
+
+    def append(self, items: List[Any]):
+        """Writes parsed items (beyond `limit`, they are dropped)."""
+        if self._writer is None:
+            return
+        for item in items:
+            if self.full:
+                break
+            self._writer.write(json.dumps(item, ensure_ascii=False).encode("utf-8") + b"\n")
+            self.count += 1
+        self._writer.flush()
+        self._grown.set()
+
+    def finish(self, error: Optional[Exception] = None):
+        """Marks the upload as complete, or as failed with `error` (which the reader then raises)."""
+        self.finished = True
+        self.error = error
+        if self.limit is not None:
+            self.count = min(self.count, self.limit)
+        self._grown.set()
+
+    async def items(self) -> AsyncIterator[Any]:
+        """Yields the items in order, waiting for more while the upload is still arriving."""
+        taken = 0
+        # Items were already size-checked by the parser.
+        framer = NDJSONFramer(max_line_bytes=sys.maxsize)
+        with open(self.path, "rb") as reader:
+            while True:
+                chunk = reader.read(SPOOL_READ_BYTES)
+                if chunk:
+                    for line in framer.feed(chunk):
+                        if self.limit is not None and taken >= self.limit:
+                            return
+                        taken += 1
+                        yield json.loads(line)
+                    continue
+                if self.error is not None:
+                    raise self.error
+                if self.finished:
+                    return
+                self._grown.clear()
+                await self._grown.wait()
+
+    def close(self, keep: bool = False):
+        """Deletes the spool file once the job no longer needs it (or, with `keep`, only closes it)."""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if keep:
+            return
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class _MultipartReader:
+    """Collects the (field name, data) pieces that a streaming multipart parser emits."""
+
+    def __init__(self, boundary: bytes):
+        self.pieces: List[Tuple[Optional[str], bytes]] = []
+        self._name: Optional[str] = None
+        self._header_field = bytearray()
+        self._header_value = bytearray()
+        self.parser = MultipartParser(boundary, {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": lambda data, start, end: self._header_field.extend(data[start:end]),
+            "on_header_value": lambda data, start, end: self._header_value.extend(data[start:end]),
+            "on_header_end": self._on_header_end,
+            "on_part_data": lambda data, start, end: self.pieces.append((self._name, bytes(data[start:end]))),
+        })
+
+    def _on_part_begin(self):
+        self._name = None
+
+    def _on_header_end(self):
+        if self._header_field.lower() == b"content-disposition":
+            _, params = parse_options_header(bytes(self._header_value))
+            name = params.get(b"name")
+            self._name = name.decode("utf-8", "replace") if name is not None else None
+        self._header_field.clear()
+        self._header_value.clear()
+
+
+async def upload_parts(http_request: Request) -> AsyncIterator[Tuple[Optional[str], bytes]]:
+    """
+    Yields the (form field name, data) pieces of an upload as they arrive. A multipart form
+    is split into its fields; any other body is the dataset itself and comes as field `file`.
+
+    Raises:
+        DatasetFormatError: If the form is malformed, or a field other than `file` exceeds
+            `MAX_FIELD_BYTES` (or all of them together `MAX_FIELDS_BYTES`).
+    """
+    content_type, params = parse_options_header(http_request.headers.get("content-type"))
+    if content_type != b"multipart/form-data":
+        async for chunk in http_request.stream():
+            yield "file", chunk
+        return
+
+    boundary = params.get(b"boundary")
+    if not boundary:
+        raise DatasetFormatError("The multipart upload has no boundary.")
+    reader = _MultipartReader(boundary)
+    field_sizes: Dict[Optional[str], int] = {}
+    try:
+        async for chunk in http_request.stream():
+            reader.parser.write(chunk)
+            for name, data in reader.pieces:
+                if name != "file":
+                    field_sizes[name] = field_sizes.get(name, 0) + len(data)
+                    if field_sizes[name] > MAX_FIELD_BYTES:
+                        raise DatasetFormatError(f"Form field '{name}' exceeds {MAX_FIELD_BYTES} bytes.")
+                    if sum(field_sizes.values()) > MAX_FIELDS_BYTES:
+                        raise DatasetFormatError(f"The form fields exceed {MAX_FIELDS_BYTES} bytes.")
+                yield name, data
+            reader.pieces.clear()
+        reader.parser.finalize()
+    except MultipartParseError as e:
+        raise DatasetFormatError(f"Malformed multipart upload: {e}")
@@ -0,0 +1,406 @@
+"""
+InferOps - Job Store
+
+Keeps the dataset jobs and their results without letting the gateway grow with them.
+
+- Each job has a directory under `JOB_STORE_DIR` with its metadata (`meta.json`), its
+  uploaded items (`items.jsonl`, while it runs) and its results in two append-only files:
+  `results.jsonl` (one JSON result per line) and `results.idx` (the byte offset of every
+  result, as little-endian uint64s). The results double as the job's checkpoint: after a
+  restart, the items without a result are all that is left to run. A completed job also
+  keeps its final aggregate (`aggregate.json`), which outlives the in-memory hub.
+- Reads go through memory maps of those files, so a page of results at any cursor costs
+  two slices and no scan. Only the job metadata and the newest `JOB_STORE_HOT_RESULTS`
+  results of each running job (what progress streams read) stay in RAM.
+- Finished jobs are evicted `JOB_STORE_TTL` seconds after they end, and oldest first when
+  the finished jobs take more than `JOB_STORE_MAX_BYTES` on disk. Running jobs are never evicted.
+"""
+
+import asyncio
+import json
+import mmap
+import os
+import shutil
+import struct
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from gateway.config import settings
+from gateway.utils.metrics import Counter, Gauge
+
+JOB_STORE_JOBS = Gauge("inferops_job_store_jobs", "Dataset jobs held by the job store.")
+JOB_STORE_BYTES = Gauge("inferops_job_store_bytes", "Disk space used by the results of the stored jobs.")
+JOB_STORE_EVICTIONS = Counter("inferops_job_store_evictions_total", "Jobs evicted from the job store, by reason.", ["reason"])
+
+FINISHED_STATUSES = ("completed", "failed")
+# Fields that change with every item; they are rebuilt from the results rather than saved.
+_COUNTERS = {"total_items", "processed_items", "failed_items"}
+
+_OFFSET = struct.Struct("<Q")
+
+
+class ResultLog:
+    """The append-only result files of one job, read through memory maps."""
+
+    def __init__(self, directory: str, hot_results: int):
+        self.data_path = os.path.join(directory, "results.jsonl")
+        self.index_path = os.path.join(directory, "results.idx")
+        self._data = open(self.data_path, "ab")
+        self._index = open(self.index_path, "ab")
+        self._recover()
+        self.size = os.path.getsize(self.data_path)
+        self.count = os.path.getsize(self.index_path) // _OFFSET.size
+        # The newest results, kept decoded: [hot_start, count).
+        self._hot: deque = deque(maxlen=hot_results)
+        self._hot_start = self.count
+        self._data_map: Optional[mmap.mmap] = None
+        self._index_map: Optional[mmap.mmap] = None
+        self._mapped_count = 0
+        self._mapped_size = 0
+
+    def _recover(self):
+        """
+        Drops what the gateway was writing when it stopped: a result is only complete once its
+        offset is in the index, which is written after the result itself.
+        """
+        count = os.path.getsize(self.index_path) // _OFFSET.size
+        end = 0
+        if count:
+            with open(self.index_path, "rb") as index:
+                index.seek((count - 1) * _OFFSET.size)
+                last = _OFFSET.unpack(index.read(_OFFSET.size))[0]
+            with open(self.data_path, "rb") as data:
+                data.seek(last)
+                end = last + len(data.readline())
+        os.truncate(self.index_path, count * _OFFSET.size)
+        os.truncate(self.data_path, end)
+
+    def append(self, result: Dict[str, Any]) -> int:
+        """Writes a result and returns its position."""
+        line = json.dumps(result, ensure_ascii=False).encode("utf-8") + b"\n"
+        self._data.write(line)
+        self._data.flush()
+        self._index.write(_OFFSET.pack(self.size))
+        self._index.flush()
+        self.size += len(line)
+        position = self.count
+        self.count += 1
+        if self._hot.maxlen:
+            if len(self._hot) == self._hot.maxlen:
+                self._hot_start += 1
+            self._hot.append(result)
+        else:
+            self._hot_start = self.count
+        return position
+
+    def read(self, start: int, limit: int) -> List[Dict[str, Any]]:
+        """Returns up to `limit` results from position `start`."""
+        end = min(start + limit, self.count)
+        if start >= end:
+            return []
+        if start >= self._hot_start:
+            offset = start - self._hot_start
+            return [self._hot[i] for i in range(offset, offset + end - start)]
+        self._map(end)
+        offsets = struct.unpack_from(f"<{end - start}Q", self._index_map, start * _OFFSET.size)
+        stop = _OFFSET.unpack_from(self._index_map, end * _OFFSET.size)[0] if end < self._mapped_count else self._mapped_size
+        chunk = self._data_map[offsets[0]:stop]
+        return [json.loads(line) for line in chunk.splitlines()]
+
+    def _map(self, end: int):
+        """(Re)maps the files if results up to `end` were appended after the last mapping."""
+        if self._mapped_count >= end:
+            return
+        self._unmap()
+        with open(self.data_path, "rb") as data, open(self.index_path, "rb") as index:
+            self._data_map = mmap.mmap(data.fileno(), 0, access=mmap.ACCESS_READ)
+            self._index_map = mmap.mmap(index.fileno(), 0, access=mmap.ACCESS_READ)
+        self._mapped_count = len(self._index_map) // _OFFSET.size
+        self._mapped_size = len(self._data_map)
+
+    def _unmap(self):
+        for mapped in (self._data_map, self._index_map):
+            if mapped is not None:
+                mapped.close()
+        self._data_map = self._index_map = None
+        self._mapped_count = self._mapped_size = 0
+
+    def seal(self):
+        """Closes the files for writing and drops the hot results, once the job has finished."""
+        for handle in (self._data, self._index):
+            if not handle.closed:
+                handle.close()
+        self._hot.clear()
+        self._hot_start = self.count
+
+    def close(self):
+        self.seal()
+        self._unmap()
+
+
+class JobStore:
+    """The dataset jobs: metadata in memory, results on disk."""
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory or settings.JOB_STORE_DIR
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._logs: Dict[str, ResultLog] = {}
+        self._lock = threading.Lock()
+        self._evict_listeners: List[Callable[[str], None]] = []
+
+    # --- Jobs ---
+
+    def create(self, job_id: str, **fields) -> Dict[str, Any]:
+        """Creates a job with the given metadata fields and returns its metadata."""
+        directory = os.path.join(self.directory, job_id)
+        os.makedirs(directory, exist_ok=True)
+        job = {
+            "job_id": job_id,
+            "status": "queued",
+            "total_items": 0,
+            "processed_items": 0,
+            "failed_items": 0,
+            "start_time": time.time(),
+            "end_time": None,
+            "error": None,
+            "ingesting": False,
+        }
+        job.update(fields)
+        with self._lock:
+            self._jobs[job_id] = job
+            self._logs[job_id] = ResultLog(directory, settings.JOB_STORE_HOT_RESULTS)
+            self._save(job_id)
+            JOB_STORE_JOBS.set(len(self._jobs))
+        self.evict()
+        return dict(job)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """A copy of a job's metadata, with `results_available`; None if there is no such job."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            return dict(job, results_available=self._logs[job_id].count)
+
+    def update(self, job_id: str, **fields):
+        """Changes metadata fields. Changes are written to disk, except those of the counters alone."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            status_changed = "status" in fields and fields["status"] != job["status"]
+            job.update(fields)
+            if job["status"] in FINISHED_STATUSES and status_changed:
+                job["end_time"] = job["end_time"] or time.time()
+                self._logs[job_id].seal()
+            if set(fields) - _COUNTERS:
+                self._save(job_id)
+        if fields.get("status") in FINISHED_STATUSES:
+            self.evict()
+
+    def job_ids(self) -> List[str]:
+        with self._lock:
+            return list(self._jobs)
+
+    def unfinished_job_ids(self) -> List[str]:
+        """The jobs that have not completed or failed, oldest first."""
+        with self._lock:
+            jobs = sorted(self._jobs.values(), key=lambda job: job["start_time"])
+            return [job["job_id"] for job in jobs if job["status"] not in FINISHED_STATUSES]
+
+    def items_path(self, job_id: str) -> str:
+        """Where a job keeps its uploaded items while it runs."""
+        return os.path.join(self.directory, job_id, "items.jsonl")
+
+    # --- Results ---
+
+    def append_result(self, job_id: str, result: Dict[str, Any], failed: bool = False) -> int:
+        """Stores a result, counts it as a processed (and possibly failed) item and returns its position."""
+        with self._lock:
+            job = self._jobs[job_id]
+            job["processed_items"] += 1
+            if failed:
+                job["failed_items"] += 1
+            log = self._logs[job_id]
+            size_before = log.size
+            position = log.append(result)
+            JOB_STORE_BYTES.inc(log.size - size_before)
+            return position
+
+    def read_results(self, job_id: str, start: int, limit: int) -> List[Dict[str, Any]]:
+        """Up to `limit` results of a job from position `start` (in completion order)."""
+        with self._lock:
+            log = self._logs.get(job_id)
+            return log.read(start, limit) if log else []
+
+    def iter_result_pages(self, job_id: str, start: int = 0, stop: Optional[int] = None,
+                          page_size: int = 1000) -> Iterator[List[Dict[str, Any]]]:
+        """Yields a job's results from `start` (up to `stop`, if given) in pages of `page_size`."""
+        while stop is None or start < stop:
+            limit = page_size if stop is None else min(page_size, stop - start)
+            page = self.read_results(job_id, start, limit)
+            if not page:
+                return
+            yield page
+            start += len(page)
+
+    def iter_results(self, job_id: str, start: int = 0, page_size: int = 1000) -> Iterator[Dict[str, Any]]:
+        """Yields a job's results from `start` on, a page at a time."""
+        for page in self.iter_result_pages(job_id, start, page_size=page_size):
+            yield from page
+
+    def results_file(self, job_id: str) -> Optional[str]:
+        """The path of a finished job's results file (one JSON result per line); None otherwise."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job["status"] not in FINISHED_STATUSES:
+                return None
+            return self._logs[job_id].data_path
+
+    def result_count(self, job_id: str) -> int:
+        with self._lock:
+            log = self._logs.get(job_id)
+            return log.count if log else 0
+
+    # --- Aggregates ---
+
+    def save_aggregate(self, job_id: str, aggregate: Dict[str, Any]):
+        """Stores the final aggregate of a job."""
+        path = os.path.join(self.directory, job_id, "aggregate.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(aggregate, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+
+    def read_aggregate(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """The final aggregate stored for a job; None if it has none (yet)."""
+        with self._lock:
+            if job_id not in self._jobs:
+                return None
+        try:
+            with open(os.path.join(self.directory, job_id, "aggregate.json"), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    # --- Persistence & Eviction ---
+
+    def _save(self, job_id: str):
+        """Writes a job's metadata file (call with the lock held)."""
+        path = os.path.join(self.directory, job_id, "meta.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self._jobs[job_id], f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+
+    def load(self):
+        """
+        Loads the jobs left on disk by a previous run of the gateway. The counters of the jobs
+        that were still running are rebuilt from their results, and they are queued again to
+        be resumed, except those whose upload was cut off by the restart: these are failed.
+        """
+        if not os.path.isdir(self.directory):
+            return
+        for job_id in os.listdir(self.directory):
+            directory = os.path.join(self.directory, job_id)
+            try:
+                with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+                    job = json.load(f)
+            except (OSError, ValueError):
+                continue
+            log = ResultLog(directory, settings.JOB_STORE_HOT_RESULTS)
+            with self._lock:
+                self._jobs[job_id] = job
+                self._logs[job_id] = log
+                JOB_STORE_BYTES.inc(log.size)
+                if job["status"] in FINISHED_STATUSES:
+                    log.seal()
+                    continue
+                # The counters of a running job were not saved; the results tell them.
+                failed = sum(1 for result in _iter_log(log) if result.get("error") is not None)
+                job.update(processed_items=log.count, failed_items=failed, status="queued")
+                if job["ingesting"]:
+                    job.update(ingesting=False, status="failed", end_time=time.time(),
+                               error="The gateway restarted while the dataset was being uploaded.")
+                    log.seal()
+                self._save(job_id)
+        with self._lock:
+            JOB_STORE_JOBS.set(len(self._jobs))
+        if self._jobs:
+            print(f"📦 Loaded {len(self._jobs)} dataset job(s) from {self.directory}.")
+        self.evict()
+
+    def delete(self, job_id: str):
+        """Deletes a job and its files at once, whatever its status (e.g. one whose upload was rejected)."""
+        with self._lock:
+            if job_id not in self._jobs:
+                return
+            self._remove(job_id)
+            JOB_STORE_JOBS.set(len(self._jobs))
+        for listener in self._evict_listeners:
+            listener(job_id)
+
+    def add_evict_listener(self, listener: Callable[[str], None]):
+        """Registers a callback that is told the ID of every evicted job."""
+        self._evict_listeners.append(listener)
+
+    def evict(self, now: Optional[float] = None) -> List[str]:
+        """
+        Deletes the finished jobs that are past their TTL, or over the size budget and past
+        their minimum retention.
+        """
+        now = time.time() if now is None else now
+        evicted = []
+        with self._lock:
+            finished = sorted(
+                (job for job in self._jobs.values() if job["status"] in FINISHED_STATUSES),
+                key=lambda job: job["end_time"] or 0,
+            )
+            total = sum(self._logs[job["job_id"]].size for job in finished)
+            for job in finished:
+                if (job["end_time"] or 0) + settings.JOB_STORE_TTL <= now:
+                    reason = "ttl"
+                elif total > settings.JOB_STORE_MAX_BYTES and (job["end_time"] or 0) + settings.JOB_STORE_MIN_RETENTION <= now:
+                    reason = "size"
+                else:
+                    continue
+                total -= self._logs[job["job_id"]].size
+                self._remove(job["job_id"])
+                JOB_STORE_EVICTIONS.inc(reason=reason)
+                evicted.append(job["job_id"])
+            JOB_STORE_JOBS.set(len(self._jobs))
+        for job_id in evicted:
+            for listener in self._evict_listeners:
+                listener(job_id)
+        return evicted
+
+    def _remove(self, job_id: str):
+        """Drops a job and deletes its files (call with the lock held)."""
+        self._jobs.pop(job_id, None)
+        log = self._logs.pop(job_id, None)
+        if log is not None:
+            log.close()
+            JOB_STORE_BYTES.dec(log.size)
+        shutil.rmtree(os.path.join(self.directory, job_id), ignore_errors=True)
+
+
+def _iter_log(log: ResultLog, page_size: int = 1000) -> Iterator[Dict[str, Any]]:
+    start = 0
+    while start < log.count:
+        page = log.read(start, page_size)
+        yield from page
+        start += len(page)
+
+
+async def job_store_maintenance_periodically():
+    """A background task that evicts expired jobs from the job store."""
+    print("📦 Job store maintenance started.")
+    while True:
+        await asyncio.sleep(settings.JOB_STORE_EVICT_INTERVAL)
+        try:
+            job_store.evict()
+        except Exception as e:
+            print(f"Error during job store maintenance: {e}")
+
+
+job_store = JobStore()
@@ -1,37 +1,269 @@
 """
 InferOps - Node Locking Service
 
-This service provides a simple mechanism for reserving a compute node for a specific task.
-Locking a node prevents the scheduler from assigning new tasks to it while it is busy
-processing a request. This is a fundamental part of resource management in the cluster.
+This service provides the mechanism for reserving a compute node for a specific task.
+Each node offers a configurable number of concurrency slots. A task takes one of them by
+acquiring a *lease* and gives it back by releasing the lease. A node whose slots are all
+leased is not assigned new tasks until one is released.
+
+Leases are tracked in the gateway itself, so reserving a slot costs no network round-trip.
+Every lease carries:
+- a TTL: a lease that is not renewed by its holder in time expires on its own and its slot
+  is returned to the pool, so a crashed task can never keep a node stuck;
+- a fencing token: a per-node, monotonically increasing number. Renewing or releasing an
+  expired lease is rejected, so a late holder can never free a slot that now belongs to
+  another task.
+
+The agents only see one batched renewal per node every `LEASE_RENEW_INTERVAL` seconds,
+carrying the full set of leases the gateway holds on that node. If the gateway dies the
+renewals stop and the agent drops the leases after `LEASE_TTL` seconds. An agent refuses
+the leases it has no free slot for (the gateway's view of the node was stale). A refused
+lease can no longer be renewed, so its holder stops its work on the node (`LeaseLost`), but
+its slot stays taken until the holder releases it or it expires.
 """
 
+import asyncio
+import threading
+import time
+import uuid
 import httpx
-from typing import Dict, Any
+from dataclasses import dataclass
+from typing import Dict, Any, List, Optional, Set
+
+from gateway.config import settings
+from gateway.core.scheduler import scheduler_index, QOS_INTERACTIVE, QOS_HOLD
+from gateway.services.http_pool import node_clients
+
+# Timeout of the calls to the agents' lease endpoints
+LOCK_REQUEST_TIMEOUT = 5.0
+
+# Identifies this gateway process. Epochs sort by start time (the nonce separates gateways
+# started in the same nanosecond), so agents can reject renewals from an older process.
+GATEWAY_EPOCH = f"{time.time_ns():020d}-{uuid.uuid4().hex}"
+
+
+class LeaseLost(RuntimeError):
+    """Raised by a task whose lease could not be renewed: it was refused by the node or expired."""
 
-# Use a dedicated client for locking operations
-lock_client = httpx.AsyncClient(timeout=5.0)
 
-async def lock_node(node_config: Dict[str, Any]) -> bool:
+@dataclass
+class Lease:
+    """A gateway-local reservation of one concurrency slot on a node."""
+    lease_id: str
+    node_id: int
+    token: int
+    expires_at: float
+    qos: str = QOS_INTERACTIVE  # The traffic class of the task holding it.
+    acquired_at: float = 0.0
+    refused: bool = False  # Set when the node refused it for lack of slots.
+
+
+# --- Lease Table ---
+# Key: lease_id (str)
+# Value: The active Lease.
+_leases: Dict[str, Lease] = {}
+_leases_lock = threading.Lock()
+# Last fencing token handed out per node.
+_fencing_tokens: Dict[int, int] = {}
+# Sequence number of the last renewal batch sent to each node.
+_renewal_seq: Dict[int, int] = {}
+# Nodes whose lease set changed since the last renewal batch.
+_dirty_nodes: Set[int] = set()
+
+
+def acquire_lease(node_config: Dict[str, Any], ttl: Optional[float] = None, qos: str = QOS_INTERACTIVE) -> Optional[Lease]:
     """
-    Sends a lock request to the specified node's monitor agent.
+    Takes one concurrency slot on a node by creating a gateway-local lease.
 
     Args:
-        node_config (Dict[str, Any]): The configuration of the node to lock.
+        node_config (Dict[str, Any]): The configuration of the node to reserve.
+        ttl (Optional[float]): Seconds until the lease expires unless renewed.
+                               Defaults to `settings.LEASE_TTL`.
+        qos (str): The traffic class of the task (`interactive` or `batch`).
+
+    Returns:
+        Optional[Lease]: The new lease, or None if the node has no free slot.
+    """
+    node_id = node_config["id"]
+    with _leases_lock:
+        if scheduler_index.free_slots(node_id) <= 0:
+            return None
+        token = _fencing_tokens.get(node_id, 0) + 1
+        _fencing_tokens[node_id] = token
+        now = time.monotonic()
+        lease = Lease(
+            lease_id=uuid.uuid4().hex,
+            node_id=node_id,
+            token=token,
+            expires_at=now + (ttl if ttl is not None else settings.LEASE_TTL),
+            qos=qos,
+            acquired_at=now,
+        )
+        _leases[lease.lease_id] = lease
+        _dirty_nodes.add(node_id)
+        scheduler_index.reserve(node_id, qos)
+    return lease
+
+
+def renew_lease(lease: Lease, ttl: Optional[float] = None) -> bool:
+    """
+    Extends a lease held by a running task.
+
+    Returns:
+        bool: False if the lease has already expired or been released (fenced off), or was
+              refused by the node; its holder must stop using the node then.
+    """
+    with _leases_lock:
+        current = _leases.get(lease.lease_id)
+        if current is None or current.token != lease.token or current.refused:
+            return False
+        current.expires_at = time.monotonic() + (ttl if ttl is not None else settings.LEASE_TTL)
+        return True
+
+
+def release_lease(lease: Lease) -> bool:
+    """
+    Releases a lease and returns its slot to the scheduling pool.
 
     Returns:
-        bool: True if the node was successfully locked, False otherwise.
+        bool: True if the lease was active, False if it was stale (already expired or released).
     """
+    with _leases_lock:
+        current = _leases.get(lease.lease_id)
+        if current is None or current.token != lease.token:
+            return False
+        del _leases[lease.lease_id]
+        _dirty_nodes.add(lease.node_id)
+        scheduler_index.release(lease.node_id, current.qos)
+    QOS_HOLD.observe(time.monotonic() - current.acquired_at, qos=current.qos)
+    return True
+
+
+def release_all_leases(node_id: Optional[int] = None) -> int:
+    """
+    Releases every lease (optionally only those of one node). Used by the admin endpoints.
+
+    Returns:
+        int: The number of leases released.
+    """
+    with _leases_lock:
+        doomed = [lease for lease in _leases.values() if node_id is None or lease.node_id == node_id]
+        for lease in doomed:
+            del _leases[lease.lease_id]
+            _dirty_nodes.add(lease.node_id)
+            scheduler_index.release(lease.node_id, lease.qos)
+    return len(doomed)
+
+
+def refuse_leases(node_id: int, lease_ids: List[str]) -> List[Lease]:
+    """
+    Marks the leases an agent refused for lack of slots. They are left out of later renewal
+    batches and can no longer be renewed, so their holders stop; their slots stay taken
+    until the holders release them, as the node is still busy with their work until then.
+
+    Returns:
+        List[Lease]: The leases that were newly refused.
+    """
+    with _leases_lock:
+        refused = [_leases[lease_id] for lease_id in lease_ids
+                   if lease_id in _leases and _leases[lease_id].node_id == node_id and not _leases[lease_id].refused]
+        for lease in refused:
+            lease.refused = True
+        if refused:
+            _dirty_nodes.add(node_id)  # The agent is sent the corrected lease set next round.
+    for lease in refused:
+        print(f"🚫 Lease {lease.lease_id[:8]} (token {lease.token}) refused by node {node_id}: no free slot.")
+    return refused
+
+
+def expire_stale_leases() -> List[Lease]:
+    """
+    Drops every lease whose TTL has passed and frees its slot.
+
+    Returns:
+        List[Lease]: The leases that expired.
+    """
+    now = time.monotonic()
+    with _leases_lock:
+        expired = [lease for lease in _leases.values() if lease.expires_at <= now]
+        for lease in expired:
+            del _leases[lease.lease_id]
+            _dirty_nodes.add(lease.node_id)
+            scheduler_index.release(lease.node_id, lease.qos)
+    for lease in expired:
+        print(f"⌛ Lease {lease.lease_id[:8]} (token {lease.token}) on node {lease.node_id} expired. Slot reclaimed.")
+    return expired
+
+
+async def renew_leases_on_agents():
+    """
+    Sends one batched renewal per node, carrying the full set of leases held on it.
+
+    Nodes without leases are only contacted once after their last lease goes away,
+    so the agent can drop it immediately instead of waiting for the TTL.
+    """
+    with _leases_lock:
+        batches: Dict[int, List[Dict[str, Any]]] = {node_id: [] for node_id in _dirty_nodes}
+        _dirty_nodes.clear()
+        for lease in _leases.values():
+            if lease.refused:
+                continue
+            batches.setdefault(lease.node_id, []).append({"lease_id": lease.lease_id, "token": lease.token})
+        for node_id in batches:
+            _renewal_seq[node_id] = _renewal_seq.get(node_id, 0) + 1
+        seqs = dict(_renewal_seq)
+
+    nodes_by_id = {node["id"]: node for node in settings.NODES}
+    await asyncio.gather(*(
+        _send_renewal(nodes_by_id[node_id], leases, seqs[node_id])
+        for node_id, leases in batches.items() if node_id in nodes_by_id
+    ))
+
+
+async def _send_renewal(node_config: Dict[str, Any], leases: List[Dict[str, Any]], seq: int):
+    payload = {
+        "epoch": GATEWAY_EPOCH,
+        "fencing_token": seq,
+        "ttl": settings.LEASE_TTL,
+        "leases": leases,
+    }
     try:
-        response = await lock_client.post(f"{node_config['monitor_base_url']}/lock")
-        return response.status_code == 200
+        response = await node_clients.monitor(node_config).post(
+            f"{node_config['monitor_base_url']}/leases", json=payload, timeout=LOCK_REQUEST_TIMEOUT,
+        )
+        if response.status_code != 200:
+            print(f"Lease renewal rejected by node {node_config['id']}: Status {response.status_code}")
+            return
+        refused = response.json().get("refused")
+        if refused:
+            refuse_leases(node_config["id"], refused)
+    except ValueError as e:
+        print(f"Invalid lease renewal response from node {node_config['id']}: {e}")
     except httpx.RequestError as e:
-        print(f"Error locking node {node_config['id']}: {e}")
-        return False
+        # The node keeps our previous batch until its TTL runs out; retry on the next round.
+        with _leases_lock:
+            _dirty_nodes.add(node_config["id"])
+        print(f"Error renewing leases on node {node_config['id']}: {e}")
+
+
+async def lease_maintenance_periodically():
+    """
+    A background task that expires stale leases and pushes batched renewals to the agents.
+    """
+    print("🔐 Lease service started.")
+    while True:
+        await asyncio.sleep(settings.LEASE_RENEW_INTERVAL)
+        try:
+            expire_stale_leases()
+            await renew_leases_on_agents()
+        except Exception as e:
+            print(f"Error during lease maintenance: {e}")
+
 
 async def unlock_node(node_config: Dict[str, Any]) -> bool:
     """
-    Sends an unlock request to the specified node's monitor agent.
+    Force-unlocks a node: drops the gateway's leases on it and asks the agent to free
+    every slot, including ones taken manually through the agent's `/lock` endpoint.
 
     Args:
         node_config (Dict[str, Any]): The configuration of the node to unlock.
@@ -39,8 +271,11 @@ async def unlock_node(node_config: Dict[str, Any]) -> bool:
     Returns:
         bool: True if the node was successfully unlocked, False otherwise.
     """
+    release_all_leases(node_config["id"])
     try:
-        response = await lock_client.post(f"{node_config['monitor_base_url']}/unlock")
+        response = await node_clients.monitor(node_config).post(
+            f"{node_config['monitor_base_url']}/unlock", params={"all": "true"}, timeout=LOCK_REQUEST_TIMEOUT,
+        )
         if response.status_code == 200:
             return True
         print(f"Failed to unlock node {node_config['id']}: Status {response.status_code}")
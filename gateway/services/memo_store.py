@@ -0,0 +1,83 @@
+"""
+InferOps - Memo Store
+
+Keeps the outputs of dataset items across jobs, so that a reprocessing run of a dataset (or
+of an overlapping one) only sends the items it has never seen to the nodes. Outputs are kept
+by item key (see `batch_engine.item_key`) in a SQLite file, `MEMO_STORE_PATH`; once they take
+more than `MEMO_STORE_MAX_BYTES`, the least recently used ones are deleted.
+
+The store is off unless `MEMO_STORE_PATH` is set: it assumes that the nodes answer identical
+items interchangeably (e.g. greedy decoding).
+"""
+
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from gateway.config import settings
+from gateway.utils.metrics import Counter, Gauge
+
+MEMO_LOOKUPS = Counter("inferops_memo_store_lookups_total", "Memo store lookups of dataset items, by outcome.", ["outcome"])
+MEMO_BYTES = Gauge("inferops_memo_store_bytes", "Size of the outputs held by the memo store.")
+MEMO_EVICTIONS = Counter("inferops_memo_store_evictions_total", "Outputs deleted from the memo store to stay within its size.")
+
+# Rows deleted per statement while evicting.
+_EVICT_BATCH = 256
+
+
+class MemoStore:
+    """Item outputs by item key, in a size-bounded SQLite table."""
+
+    def __init__(self, path: str, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS memo (key TEXT PRIMARY KEY, output TEXT NOT NULL, "
+                         "size INTEGER NOT NULL, used REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS memo_used ON memo (used)")
+        self._bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM memo").fetchone()[0]
+        MEMO_BYTES.set(self._bytes)
+
+    def get(self, key: str) -> Optional[str]:
+        """The stored output of an item, or None."""
+        with self._lock:
+            row = self._db.execute("SELECT output FROM memo WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._db.execute("UPDATE memo SET used = ? WHERE key = ?", (time.time(), key))
+        MEMO_LOOKUPS.inc(outcome="miss" if row is None else "hit")
+        return row[0] if row is not None else None
+
+    def put(self, key: str, output: str):
+        """Stores an item's output, deleting the least recently used ones to stay within the size."""
+        size = len(output.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._db.execute("SELECT size FROM memo WHERE key = ?", (key,)).fetchone()
+            self._db.execute("INSERT OR REPLACE INTO memo (key, output, size, used) VALUES (?, ?, ?, ?)",
+                             (key, output, size, time.time()))
+            self._bytes += size - (old[0] if old else 0)
+            while self._bytes > self.max_bytes:
+                rows = self._db.execute("SELECT key, size FROM memo ORDER BY used LIMIT ?", (_EVICT_BATCH,)).fetchall()
+                if not rows:
+                    break
+                for old_key, old_size in rows:
+                    if self._bytes <= self.max_bytes:
+                        break
+                    self._db.execute("DELETE FROM memo WHERE key = ?", (old_key,))
+                    self._bytes -= old_size
+                    MEMO_EVICTIONS.inc()
+            MEMO_BYTES.set(self._bytes)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+# The memo store shared by all jobs; None when `MEMO_STORE_PATH` is not set.
+memo_store: Optional[MemoStore] = (
+    MemoStore(settings.MEMO_STORE_PATH, settings.MEMO_STORE_MAX_BYTES) if settings.MEMO_STORE_PATH else None
+)
@@ -0,0 +1,262 @@
+"""
+InferOps - Response Cache & Request Coalescing
+
+Eval harnesses and dashboards often send byte-identical chat requests at temperature 0.
+Their answers are deterministic, so there is no need to run them more than once:
+- a finished response is kept in an LRU cache (bounded by entry count, total size and TTL)
+  and replayed to later identical requests without touching a node;
+- identical requests that arrive while the first one is still running are coalesced into a
+  single *flight*: only one request goes upstream and its stream is fanned out to all of them.
+
+Requests are identified by the model plus a hash of their normalised messages and options.
+Only requests with an explicit `temperature` of 0 are considered deterministic.
+"""
+
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Sequence, Tuple
+
+from gateway.config import settings
+from gateway.utils.metrics import Counter, Gauge
+
+CACHE_LOOKUPS = Counter(
+    "inferops_response_cache_lookups_total",
+    "Deterministic chat requests by outcome: hit, coalesced (joined a running flight) or miss.",
+    ["outcome"],
+)
+CACHE_BYTES = Gauge("inferops_response_cache_bytes", "Size of the cached responses.")
+CACHE_ENTRIES = Gauge("inferops_response_cache_entries", "Number of cached responses.")
+
+
+def request_cache_key(request) -> Optional[str]:
+    """
+    Returns the cache key of a deterministic `ChatRequest`, or None if its answer may vary.
+
+    Messages are normalised (role case, line endings, surrounding whitespace) so requests that
+    differ only in formatting share an entry.
+    """
+    options = request.options or {}
+    if options.get("temperature") != 0:
+        return None
+    document = {
+        "model": request.model,
+        "stream": request.stream,
+        "stream_format": request.stream_format,
+        "options": options,
+        "messages": [
+            [m.role.strip().lower(), m.content.replace("\r\n", "\n").strip()]
+            for m in request.messages
+        ],
+    }
+    digest = hashlib.blake2b(json.dumps(document, sort_keys=True).encode(), digest_size=16).hexdigest()
+    return f"{request.model or '*'}:{digest}"
+
+
+class ResponseCache:
+    """An LRU cache of complete responses (as the list of chunks sent to the client)."""
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # Key: cache key; Value: (expires_at, chunks, size)
+        self._entries: "OrderedDict[str, Tuple[float, Tuple[str, ...], int]]" = OrderedDict()
+        self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[Tuple[str, ...]]:
+        """Returns the cached chunks of a response, or None if absent or expired."""
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            if item[0] <= time.monotonic():
+                self._evict(key)
+                return None
+            self._entries.move_to_end(key)
+            return item[1]
+
+    def put(self, key: str, chunks: Sequence[str]):
+        """Stores a response, evicting the least recently used ones to stay within the caps."""
+        size = sum(len(chunk) for chunk in chunks)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._evict(key)
+            self._entries[key] = (time.monotonic() + self.ttl, tuple(chunks), size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._evict(next(iter(self._entries)))
+            self._report()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._report()
+
+    def _evict(self, key: str):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+        self._report()
+
+    def _report(self):
+        CACHE_BYTES.set(self._bytes)
+        CACHE_ENTRIES.set(len(self._entries))
+
+
+class Flight:
+    """
+    One upstream request shared by every identical request that arrived while it runs.
+
+    The producer publishes chunks; each subscriber replays them from the start and then
+    follows along. A subscriber counts from the moment it joins, before it reads anything; if
+    every subscriber goes away before the end, the producer is cancelled and the flight is
+    abandoned, so that no later request joins it.
+    """
+
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.done = False
+        # Set once the leader has been admitted (or has given up, see `aborted`).
+        self.admitted = asyncio.Event()
+        # True if the leader never got a slot; its followers must queue for one themselves.
+        self.aborted = False
+        # The status to answer with if the request failed (see `chat_proxy`), for every subscriber.
+        self.failure: Dict[str, int] = {}
+        self._changed = asyncio.Event()
+        # Set once every subscriber left before the end and the producer was cancelled.
+        self.abandoned = False
+        self._subscribers = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def publish(self, chunk: str):
+        self.chunks.append(chunk)
+        self._wake()
+
+    def finish(self):
+        self.done = True
+        self._wake()
+
+    def subscribe(self) -> "Subscription":
+        """Joins the flight; the subscription yields every chunk, from the first one to the end."""
+        self._subscribers += 1
+        return Subscription(self)
+
+    def _leave(self):
+        self._subscribers -= 1
+        if self._subscribers == 0 and not self.done and self._task is not None:
+            self.abandoned = True
+            self._task.cancel()
+
+    def _wake(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+
+class Subscription:
+    """
+    One subscriber's stream of a flight. It holds its place in the flight until it reaches
+    the end, fails (e.g. is cancelled) or is closed, even if it is never read.
+    """
+
+    def __init__(self, flight: Flight):
+        self._flight = flight
+        self._position = 0
+        self._joined = True
+
+    def __aiter__(self) -> "Subscription":
+        return self
+
+    async def __anext__(self) -> str:
+        flight = self._flight
+        try:
+            while True:
+                if self._position < len(flight.chunks):
+                    self._position += 1
+                    return flight.chunks[self._position - 1]
+                if flight.done:
+                    raise StopAsyncIteration
+                await flight._changed.wait()
+        except BaseException:
+            self._leave()
+            raise
+
+    async def aclose(self):
+        self._leave()
+
+    def _leave(self):
+        if self._joined:
+            self._joined = False
+            self._flight._leave()
+
+
+class SingleFlight:
+    """The registry of running flights, by cache key."""
+
+    def __init__(self):
+        self._flights: Dict[str, Flight] = {}
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    def get(self, key: str) -> Optional[Flight]:
+        flight = self._flights.get(key)
+        return None if flight is None or flight.abandoned else flight
+
+    def start(self, key: str) -> Flight:
+        """Registers a new flight; identical requests will join it from now on."""
+        flight = Flight()
+        self._flights[key] = flight
+        return flight
+
+    def abort(self, key: str):
+        """
+        Drops a flight whose leader could not be admitted. Why it gave up (its client left,
+        its deadline passed) concerns that client alone, so followers are only told to retry.
+        """
+        flight = self._flights.pop(key, None)
+        if flight is not None:
+            flight.aborted = True
+            flight.finish()
+            flight.admitted.set()
+
+    def run(self, key: str, source: AsyncIterator[str], on_complete: Callable[[List[str]], Any]) -> Subscription:
+        """
+        Drives `source` in the background, publishing its chunks to the flight's subscribers.
+        `on_complete` receives all chunks if the source ran to its end without being cancelled.
+        Returns the leader's subscription, which counts before the producer starts.
+        """
+        flight = self._flights[key]
+        leader = flight.subscribe()
+
+        async def produce():
+            try:
+                async for chunk in source:
+                    flight.publish(chunk)
+                on_complete(flight.chunks)
+            finally:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                flight.finish()
+
+        flight._task = asyncio.ensure_future(produce())
+        flight.admitted.set()
+        return leader
+
+
+# The process-wide cache and flight registry for deterministic chat requests.
+response_cache = ResponseCache(
+    max_entries=settings.RESPONSE_CACHE_MAX_ENTRIES,
+    max_bytes=settings.RESPONSE_CACHE_MAX_BYTES,
+    ttl=settings.RESPONSE_CACHE_TTL,
+)
+chat_flights = SingleFlight()
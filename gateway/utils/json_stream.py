@@ -0,0 +1,190 @@
+"""
+InferOps - Incremental Dataset Parsing
+
+`JSONItemParser` turns the bytes of an uploaded dataset into its items while they arrive,
+holding no more than the item that is currently being read. An item that spans many chunks
+is scanned for its end one chunk at a time and decoded once, when all of it is there. Two
+formats are accepted and told apart by the first non-blank character:
+
+- a JSON array of items (`[...]`), or
+- JSON Lines: a sequence of whitespace-separated JSON values, one item each (a single JSON
+  object is a one-item dataset). Lines that are themselves arrays are not supported, as the
+  upload would look like a JSON array.
+"""
+
+import codecs
+import json
+import re
+from typing import Any, List, Optional, Tuple
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+# What the end-of-item scan skips inside a string, stops at outside one, and ends a number or literal at.
+_STRING_BODY = re.compile(r'(?:[^"\\]|\\.)*', re.DOTALL)
+_STRUCTURE = re.compile(r'[][{}"]')
+_SCALAR_END = re.compile(r"[ \t\n\r,\]}]")
+_DECODER = json.JSONDecoder()
+
+
+class DatasetFormatError(ValueError):
+    """Raised when an upload cannot be read as a dataset (neither a JSON array nor JSON Lines)."""
+
+
+class JSONItemParser:
+    """An incremental parser of a JSON array or JSON Lines upload into its items."""
+
+    def __init__(self, max_item_bytes: int = 16 * 1024 * 1024):
+        self.max_item_bytes = max_item_bytes
+        self.format: Optional[str] = None  # "array" or "jsonl", once the first byte is seen.
+        self.count = 0
+        self._utf8 = codecs.getincrementaldecoder("utf-8-sig")()
+        # The text of the item that is still arriving, and its length.
+        self._pending: List[str] = []
+        self._pending_chars = 0
+        # Inside an array: "first" (after '['), "value" (after ','), "comma" (after an item) or "end".
+        self._state = "first"
+        # How far the scan for the end of the pending item got (see `_scan`).
+        self._scalar = False
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, chunk: bytes) -> List[Any]:
+        """Adds a chunk of the upload and returns the items it completed."""
+        return self._parse(self._decode(chunk, final=False), final=False)
+
+    def close(self) -> List[Any]:
+        """Returns the last item(s) once the upload has ended; raises if the upload is truncated."""
+        items = self._parse(self._decode(b"", final=True), final=True)
+        if self.format is None:
+            raise DatasetFormatError("The upload is empty.")
+        if self.format == "array" and self._state != "end":
+            raise DatasetFormatError("The JSON array is not terminated.")
+        return items
+
+    def _decode(self, chunk: bytes, final: bool) -> str:
+        try:
+            return self._utf8.decode(chunk, final)
+        except UnicodeDecodeError as e:
+            raise DatasetFormatError(f"The upload is not valid UTF-8: {e.reason}.")
+
+    def _parse(self, text: str, final: bool) -> List[Any]:
+        items = []
+        pos = 0
+        if self._pending:
+            # An item is still arriving: only the new text is scanned for its end.
+            offset = self._pending_chars
+            end = self._scan(text, 0)
+            self._pending.append(text)
+            self._pending_chars += len(text)
+            if end is None and not final:
+                self._check_size()
+                return items
+            text = "".join(self._pending)
+            self._pending, self._pending_chars = [], 0
+            item, pos = self._decode_item(text, 0)
+            items.append(item)
+            self.count += 1
+            self._state = "comma"
+
+        while True:
+            pos = _WHITESPACE.match(text, pos).end()
+            if pos == len(text):
+                break
+            if self.format is None:
+                self.format = "array" if text[pos] == "[" else "jsonl"
+                if self.format == "array":
+                    pos += 1
+                    continue
+
+            if self.format == "array":
+                char = text[pos]
+                if self._state == "end":
+                    raise DatasetFormatError("Unexpected data after the JSON array.")
+                if self._state == "comma":
+                    if char not in ",]":
+                        raise DatasetFormatError(f"Expected ',' or ']' after item {self.count}, found {char!r}.")
+                    self._state = "value" if char == "," else "end"
+                    pos += 1
+                    continue
+                if char == "]" and self._state == "first":
+                    self._state = "end"
+                    pos += 1
+                    continue
+
+            item, end = self._item(text, pos, final)
+            if end is None:
+                self._pending, self._pending_chars = [text[pos:]], len(text) - pos
+                self._check_size()
+                break
+            items.append(item)
+            self.count += 1
+            self._state = "comma"
+            pos = end
+        return items
+
+    def _check_size(self):
+        if self._pending_chars > self.max_item_bytes:
+            raise DatasetFormatError(
+                f"Item {self.count + 1} is not valid JSON or exceeds {self.max_item_bytes} bytes.")
+
+    def _item(self, text: str, pos: int, final: bool) -> Tuple[Any, Optional[int]]:
+        """Decodes the item at `pos`, or returns (None, None) if it may not have fully arrived."""
+        self._scalar = text[pos] not in '[{"'
+        try:
+            item, end = _DECODER.raw_decode(text, pos)
+            if end < len(text) or not self._scalar:
+                return item, end
+        except json.JSONDecodeError:
+            pass
+        # Cut off by the end of the text (or invalid): from now on, only new text is scanned.
+        self._depth, self._in_string, self._escaped = 0, False, False
+        if self._scan(text, pos) is None and not final:
+            return None, None
+        return self._decode_item(text, pos)
+
+    def _decode_item(self, text: str, pos: int) -> Tuple[Any, int]:
+        try:
+            return _DECODER.raw_decode(text, pos)
+        except json.JSONDecodeError as e:
+            raise DatasetFormatError(f"Item {self.count + 1} is not valid JSON: {e.msg}.")
+
+    def _scan(self, text: str, pos: int) -> Optional[int]:
+        """
+        Continues the scan for the end of the pending item from `pos`, returning the position
+        just past it, or None if it goes beyond `text`. Only brackets, quotes and escapes are
+        tracked; the item is validated when it is decoded.
+        """
+        if self._scalar:
+            # A number or literal at the end of the text may continue in the next chunk.
+            match = _SCALAR_END.search(text, pos)
+            return match.start() if match else None
+        while True:
+            if self._escaped:
+                if pos == len(text):
+                    return None
+                self._escaped = False
+                pos += 1
+            if self._in_string:
+                pos = _STRING_BODY.match(text, pos).end()
+                if pos == len(text):
+                    return None
+                pos += 1
+                if text[pos - 1] == "\\":
+                    self._escaped = True  # The escaped character is in the next chunk.
+                    continue
+                self._in_string = False
+                if self._depth == 0:
+                    return pos  # The item is a string.
+            else:
+                match = _STRUCTURE.search(text, pos)
+                if match is None:
+                    return None
+                pos = match.end()
+                if match.group() == '"':
+                    self._in_string = True
+                elif match.group() in "[{":
+                    self._depth += 1
+                else:
+                    self._depth -= 1
+                    if self._depth <= 0:
+                        return pos
@@ -0,0 +1,119 @@
+"""
+InferOps - Metrics Registry
+
+A minimal, dependency-free registry of counters, gauges and histograms that renders
+in the Prometheus text exposition format. The gateway exposes it at `/api/v1/metrics`
+so the Prometheus server that already scrapes the nodes can scrape the gateway too.
+"""
+
+import abc
+import bisect
+import threading
+from typing import Dict, List, Tuple, Sequence
+
+LabelValues = Tuple[str, ...]
+
+_registry: List["_Metric"] = []
+_registry_lock = threading.Lock()
+
+
+class _Metric(abc.ABC):
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _format_labels(self, key: LabelValues, extra: Dict[str, str] = None) -> str:
+        pairs = list(zip(self.labelnames, key)) + list((extra or {}).items())
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+    @abc.abstractmethod
+    def render(self) -> List[str]:
+        """The metric's sample lines in the Prometheus text format."""
+
+
+class Counter(_Metric):
+    """A monotonically increasing value."""
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            return [f"{self.name}{self._format_labels(k)} {v}" for k, v in self._values.items()]
+
+
+class Gauge(Counter):
+    """A value that can go up and down."""
+    type_name = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """Counts observations into cumulative buckets."""
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Key: label values; Value: [per-bucket counts..., +Inf count, sum]
+        self._values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.setdefault(key, [0.0] * (len(self.buckets) + 2))
+            series[bisect.bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = []
+        with self._lock:
+            for key, series in self._values.items():
+                cumulative = 0.0
+                for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{self.name}_bucket{self._format_labels(key, {'le': le})} {cumulative}")
+                lines.append(f"{self.name}_count{self._format_labels(key)} {cumulative}")
+                lines.append(f"{self.name}_sum{self._format_labels(key)} {series[-1]}")
+        return lines
+
+
+def render_metrics() -> str:
+    """Renders every registered metric in the Prometheus text exposition format."""
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.type_name}")
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
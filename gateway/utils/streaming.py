@@ -0,0 +1,216 @@
+"""
+InferOps - Stream Framing & Translation
+
+- `NDJSONFramer` cuts the byte stream of an Ollama response into complete NDJSON lines,
+  however the lines are split across network chunks. It keeps a single reusable buffer and
+  never rescans bytes it has already searched, so each byte is looked at once.
+- `OpenAIStreamTranslator` turns Ollama chat messages into OpenAI-style
+  `chat.completion.chunk` server-sent events, for clients that speak the OpenAI API.
+- `StreamRenderer` and `ChatAggregator` render what the chat proxy receives either as a
+  stream, or (for `stream=false`) as a single JSON response with usage and timing fields.
+"""
+
+import json
+import time
+import uuid
+from itertools import islice
+from typing import Any, Dict, List, Optional, Union
+
+
+class FramingError(ValueError):
+    """Raised when a stream does not look like NDJSON (e.g., a line exceeds the size limit)."""
+
+
+class NDJSONFramer:
+    """An incremental splitter of a byte stream into newline-delimited records."""
+
+    def __init__(self, max_line_bytes: int = 1024 * 1024):
+        self.max_line_bytes = max_line_bytes
+        self._buffer = bytearray()
+
+    def feed(self, chunk: bytes) -> List[bytes]:
+        """Adds a chunk and returns the complete, non-blank lines it finished (without newline)."""
+        buffer = self._buffer
+        scanned = len(buffer)  # Bytes before this point are known to contain no newline.
+        buffer += chunk
+        end = buffer.find(b"\n", scanned)
+        if end < 0:
+            if len(buffer) > self.max_line_bytes:
+                raise FramingError(f"NDJSON line exceeds {self.max_line_bytes} bytes.")
+            return []
+
+        lines = []
+        start = 0
+        # Copy each line out exactly once; the view must be released before the buffer shrinks.
+        with memoryview(buffer) as view:
+            while end >= 0:
+                line = bytes(view[start:end])
+                if line and not line.isspace():
+                    lines.append(line)
+                start = end + 1
+                end = buffer.find(b"\n", start)
+        del buffer[:start]
+        return lines
+
+    def flush(self) -> Optional[bytes]:
+        """Returns a trailing line that was not newline-terminated, if any."""
+        rest = bytes(self._buffer).strip()
+        self._buffer.clear()
+        return rest or None
+
+
+class OpenAIStreamTranslator:
+    """Renders the messages of one Ollama chat stream as OpenAI `chat.completion.chunk` events."""
+
+    def __init__(self, model: Optional[str]):
+        self.id = f"chatcmpl-{uuid.uuid4().hex}"
+        self.created = int(time.time())
+        self.model = model
+        self._role_sent = False
+
+    def translate(self, message: Dict[str, Any]) -> str:
+        """Returns the SSE event(s) for one Ollama message; the final one is followed by [DONE]."""
+        model = self.model or message.get("model")
+        delta: Dict[str, Any] = {}
+        if not self._role_sent:
+            delta["role"] = "assistant"
+            self._role_sent = True
+        content = message.get("message", {}).get("content")
+        if content:
+            delta["content"] = content
+
+        chunk: Dict[str, Any] = {
+            "id": self.id,
+            "object": "chat.completion.chunk",
+            "created": self.created,
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": None}],
+        }
+        if not message.get("done"):
+            return f"data: {json.dumps(chunk)}\n\n"
+
+        chunk["choices"][0]["finish_reason"] = finish_reason(message)
+        chunk["usage"] = usage_from_final_chunk(message)
+        return f"data: {json.dumps(chunk)}\n\ndata: [DONE]\n\n"
+
+
+def finish_reason(final: Dict[str, Any]) -> str:
+    """The OpenAI finish reason of a stream, from its final Ollama message."""
+    return "length" if final.get("done_reason") == "length" else "stop"
+
+
+def usage_from_final_chunk(final: Dict[str, Any]) -> Dict[str, int]:
+    """OpenAI-style token usage, from the counters in the final Ollama message."""
+    prompt_tokens = final.get("prompt_eval_count", 0)
+    completion_tokens = final.get("eval_count", 0)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+class StreamRenderer:
+    """Renders the chat proxy's output as a stream: Ollama NDJSON lines or OpenAI SSE chunks."""
+
+    def __init__(self, stream_format: str, model: Optional[str]):
+        self.translator = OpenAIStreamTranslator(model) if stream_format == "openai" else None
+
+    def node_assigned(self, node_name: str) -> str:
+        return f"event: node_assigned\ndata: {json.dumps({'node_name': node_name})}\n\n"
+
+    def message(self, line: bytes, message: Dict[str, Any]) -> Union[str, bytes]:
+        return self.translator.translate(message) if self.translator else line + b"\n"
+
+    def error(self, text: str) -> str:
+        event = f"data: {json.dumps({'error': text})}\n\n"
+        # An error ends the stream; OpenAI clients wait for [DONE] before they stop reading.
+        return event + "data: [DONE]\n\n" if self.translator else event
+
+
+# Ollama's statistics that are copied into an aggregated Ollama-format response.
+OLLAMA_STATS = ("total_duration", "load_duration", "prompt_eval_count", "prompt_eval_duration", "eval_count", "eval_duration")
+
+
+class ChatAggregator:
+    """
+    Folds a chat stream into a single JSON document, in Ollama's or OpenAI's non-streaming
+    shape, plus `usage` and gateway-measured `timing`. It has the same interface as
+    `StreamRenderer` but only produces output once the final message (or an error) arrives.
+
+    Content pieces go into a list pre-sized to the expected number of messages, so the buffer
+    normally never has to grow while the answer streams in.
+    """
+
+    def __init__(self, stream_format: str, model: Optional[str], size_hint: int):
+        self.stream_format = stream_format
+        self.model = model
+        self.received = time.monotonic()
+        self.dispatched: Optional[float] = None
+        self.first_token: Optional[float] = None
+        self.node_name: Optional[str] = None
+        self._parts: List[str] = [""] * max(size_hint, 1)
+        self._count = 0
+
+    def node_assigned(self, node_name: str) -> None:
+        if self.dispatched is None:
+            self.dispatched = time.monotonic()
+        self.node_name = node_name
+
+    def message(self, line: bytes, message: Dict[str, Any]) -> Optional[str]:
+        if self.first_token is None:
+            self.first_token = time.monotonic()
+        content = message.get("message", {}).get("content", "")
+        if self._count < len(self._parts):
+            self._parts[self._count] = content
+        else:
+            self._parts.append(content)
+        self._count += 1
+        if not message.get("done"):
+            return None
+        return json.dumps(self._document(message))
+
+    def error(self, text: str) -> str:
+        return json.dumps({"error": text})
+
+    def content(self) -> str:
+        return "".join(islice(self._parts, self._count))
+
+    def _timing(self, final: Dict[str, Any]) -> Dict[str, Any]:
+        now = time.monotonic()
+        dispatched = self.dispatched or self.received
+        eval_count, eval_duration = final.get("eval_count"), final.get("eval_duration")
+        return {
+            "queue_ms": round((dispatched - self.received) * 1000, 1),
+            "ttft_ms": round(((self.first_token or now) - dispatched) * 1000, 1),
+            "total_ms": round((now - self.received) * 1000, 1),
+            "tokens_per_sec": round(eval_count / (eval_duration / 1e9), 2) if eval_count and eval_duration else None,
+        }
+
+    def _document(self, final: Dict[str, Any]) -> Dict[str, Any]:
+        model = self.model or final.get("model")
+        if self.stream_format == "openai":
+            return {
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": self.content()},
+                    "finish_reason": finish_reason(final),
+                }],
+                "usage": usage_from_final_chunk(final),
+                "timing": self._timing(final),
+                "node": self.node_name,
+            }
+        document = {
+            "model": model,
+            "created_at": final.get("created_at"),
+            "message": {"role": "assistant", "content": self.content()},
+            "done": True,
+            "done_reason": final.get("done_reason", "stop"),
+        }
+        document.update((key, final[key]) for key in OLLAMA_STATS if key in final)
+        document.update(usage=usage_from_final_chunk(final), timing=self._timing(final), node=self.node_name)
+        return document
@@ -7,13 +7,24 @@
 #    acting as a lightweight node exporter as described in the paper.
 # 2. Provides a standard API endpoint (/status) for the central Gateway to query these metrics.
 # 3. Implements lock/unlock mechanisms, allowing the Task Scheduling and Failure Handling modules
-#    to control the node's availability in the cluster.
+#    to control the node's availability in the cluster. The node offers MAX_CONCURRENCY slots
+#    (matching Ollama's OLLAMA_NUM_PARALLEL); each lock takes one and each unlock frees one.
+# 4. Receives batched lease renewals from the Gateway. Leases that are not renewed within
+#    their TTL expire on their own, so a crashed gateway never leaves the node stuck.
+# 5. With GATEWAY_URL and NODE_ID set, pushes its status to the Gateway over one long-lived
+#    chunked request: a snapshot, then the changed fields every TELEMETRY_INTERVAL seconds
+#    (at once when a slot is taken or freed), with empty heartbeats when nothing changed.
+#    The Gateway falls back to polling /status while the stream is down.
 
 import psutil
 import uvicorn
 import threading
+import time
+import json
 import httpx
+from typing import List
 from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
 from pynvml import *
 from decouple import config
@@ -26,11 +37,34 @@ app = FastAPI(
 )
 
 # --- State Management ---
-# Using a thread-safe lock for state changes, particularly for the 'locked' status.
+# Using a thread-safe lock for state changes, particularly for the slot counter.
 # This ensures that the node's availability is handled atomically.
-NODE_LOCKED = False
+MAX_CONCURRENCY = config('MAX_CONCURRENCY', default=1, cast=int)
+SLOTS_IN_USE = 0
 lock = threading.Lock()
 
+# Leases held by the Gateway, as announced by its latest renewal batch.
+LEASE_EPOCH = None        # Identifies the gateway process that owns the leases.
+LEASE_FENCING_TOKEN = 0   # Highest batch token seen from that gateway.
+LEASE_EXPIRES_AT = 0.0    # When the announced leases lapse unless renewed.
+LEASES = {}               # lease_id -> fencing token
+
+# Telemetry push to the Gateway (disabled unless GATEWAY_URL is set).
+GATEWAY_URL = config('GATEWAY_URL', default='')
+NODE_ID = config('NODE_ID', default=0, cast=int)  # This node's id in the Gateway's NODES.
+TELEMETRY_INTERVAL = config('TELEMETRY_INTERVAL', default=0.5, cast=float)  # seconds
+TELEMETRY_RETRY_INTERVAL = config('TELEMETRY_RETRY_INTERVAL', default=5.0, cast=float)  # seconds
+# Set when the slot usage changes, so that the change is pushed without waiting for the interval.
+STATUS_CHANGED = threading.Event()
+
+def active_lease_count():
+    """Returns the number of unexpired gateway leases. Must be called with `lock` held."""
+    global LEASES
+    if LEASES and time.monotonic() >= LEASE_EXPIRES_AT:
+        # The gateway stopped renewing (e.g., it crashed): drop its leases.
+        LEASES = {}
+    return len(LEASES)
+
 # Enable CORS for frontend access
 app.add_middleware(
     CORSMiddleware,
@@ -78,14 +112,28 @@ def get_system_status():
     The primary endpoint for the Gateway's Resource Monitoring Module to poll.
     Returns a comprehensive snapshot of the node's current hardware status.
     """
+    return collect_status(cpu_interval=1)
+
+def collect_status(cpu_interval=None):
+    """
+    Takes a snapshot of the node's status. The CPU usage is measured over `cpu_interval`
+    seconds, or since the previous snapshot if None (which does not block).
+    """
     # CPU metrics
-    cpu_usage = psutil.cpu_percent(interval=1)
+    cpu_usage = psutil.cpu_percent(interval=cpu_interval)
 
     # Memory metrics
     memory = psutil.virtual_memory()
 
+    with lock:
+        leases_in_use = active_lease_count()
+        slots_in_use = SLOTS_IN_USE + leases_in_use
+
     status = {
-        "locked": NODE_LOCKED,
+        "locked": slots_in_use >= MAX_CONCURRENCY,
+        "slots_total": MAX_CONCURRENCY,
+        "slots_in_use": slots_in_use,
+        "leases_in_use": leases_in_use,
         "model_id": get_current_model_id(),
         "cpu_usage_percent": cpu_usage,
         "cpu_model": get_cpu_info(),
@@ -132,27 +180,113 @@ def get_system_status():
 @app.post("/lock")
 def lock_node():
     """
-    Locks the node, making it unavailable for new task assignments.
+    Takes one concurrency slot for a task. Once every slot is taken the node is locked,
+    making it unavailable for new task assignments.
     This is called by the Gateway's Task Scheduler immediately before assigning a task.
     """
-    global NODE_LOCKED
+    global SLOTS_IN_USE
     with lock:
-        if NODE_LOCKED:
-            # If already locked, return a conflict error. This helps the scheduler handle race conditions.
-            raise HTTPException(status_code=409, detail="Node is already locked.")
-        NODE_LOCKED = True
-    return {"status": "success", "message": "Node locked for InferOps task."}
+        if SLOTS_IN_USE + active_lease_count() >= MAX_CONCURRENCY:
+            # If all slots are taken, return a conflict error. This helps the scheduler handle race conditions.
+            raise HTTPException(status_code=409, detail="All slots of the node are in use.")
+        SLOTS_IN_USE += 1
+        slots_in_use = SLOTS_IN_USE + len(LEASES)
+    STATUS_CHANGED.set()
+    return {"status": "success", "message": "Slot locked for InferOps task.", "slots_in_use": slots_in_use, "slots_total": MAX_CONCURRENCY}
 
 @app.post("/unlock")
-def unlock_node():
+def unlock_node(all: bool = False):
+    """
+    Frees one slot (or every slot, including gateway leases, when `all` is set), returning it
+    to the pool of available resources. This is an administrative override; the Gateway
+    normally releases its slots through lease renewals.
+    """
+    global SLOTS_IN_USE, LEASES
+    with lock:
+        SLOTS_IN_USE = 0 if all else max(SLOTS_IN_USE - 1, 0)
+        if all:
+            LEASES = {}
+        slots_in_use = SLOTS_IN_USE + active_lease_count()
+    STATUS_CHANGED.set()
+    return {"status": "success", "message": "Node unlocked.", "slots_in_use": slots_in_use, "slots_total": MAX_CONCURRENCY}
+
+class LeaseEntry(BaseModel):
+    lease_id: str
+    token: int
+
+class LeaseRenewal(BaseModel):
+    epoch: str
+    fencing_token: int
+    ttl: float
+    leases: List[LeaseEntry]
+
+@app.post("/leases")
+def renew_leases(renewal: LeaseRenewal):
     """
-    Unlocks the node, returning it to the pool of available resources.
-    This is called by the Gateway after a task is completed or has failed.
+    Replaces the set of gateway leases with the one carried by a renewal batch.
+
+    The Gateway sends the full set of leases it holds on this node every few seconds.
+    Batches from an older gateway epoch (epochs sort by the gateway's start time), or with a
+    fencing token lower than one already applied, are rejected so a delayed batch can never
+    resurrect released leases.
+
+    The node's slots stay authoritative: leases it already holds are kept first, and new
+    ones only as long as slots are free. The IDs of the others are returned as `refused`,
+    so the Gateway can drop them.
     """
-    global NODE_LOCKED
+    global LEASE_EPOCH, LEASE_FENCING_TOKEN, LEASE_EXPIRES_AT, LEASES
     with lock:
-        NODE_LOCKED = False
-    return {"status": "success", "message": "Node unlocked."}
+        if LEASE_EPOCH is not None and (renewal.epoch < LEASE_EPOCH or (
+                renewal.epoch == LEASE_EPOCH and renewal.fencing_token < LEASE_FENCING_TOKEN)):
+            raise HTTPException(status_code=409, detail="Stale lease renewal.")
+        active_lease_count()  # Drops the leases past their TTL.
+        # Leases of another gateway process no longer count as held.
+        held = LEASES if renewal.epoch == LEASE_EPOCH else {}
+        entries = sorted(renewal.leases, key=lambda entry: entry.lease_id not in held)
+        capacity = max(MAX_CONCURRENCY - SLOTS_IN_USE, 0)
+        accepted, refused = entries[:capacity], [entry.lease_id for entry in entries[capacity:]]
+        LEASE_EPOCH = renewal.epoch
+        LEASE_FENCING_TOKEN = renewal.fencing_token
+        LEASE_EXPIRES_AT = time.monotonic() + renewal.ttl
+        LEASES = {entry.lease_id: entry.token for entry in accepted}
+        slots_in_use = SLOTS_IN_USE + len(LEASES)
+    STATUS_CHANGED.set()
+    return {"status": "success", "leases": len(LEASES), "refused": refused,
+            "slots_in_use": slots_in_use, "slots_total": MAX_CONCURRENCY}
+
+# --- Telemetry Push ---
+def telemetry_messages():
+    """
+    Yields the NDJSON messages of one telemetry stream: a full snapshot, then the top-level
+    fields that changed since the previous message, or an empty heartbeat if none did.
+    """
+    last = collect_status()
+    yield json.dumps({"full": True, "metrics": last}).encode("utf-8") + b"\n"
+    while True:
+        STATUS_CHANGED.wait(TELEMETRY_INTERVAL)
+        STATUS_CHANGED.clear()
+        status = collect_status()
+        changed = {key: value for key, value in status.items() if last.get(key) != value}
+        last = status
+        yield (json.dumps({"metrics": changed}) if changed else "{}").encode("utf-8") + b"\n"
+
+def push_telemetry_forever():
+    """Keeps a telemetry stream open to the Gateway, reconnecting after a failure."""
+    url = f"{GATEWAY_URL.rstrip('/')}/api/v1/nodes/{NODE_ID}/telemetry"
+    while True:
+        try:
+            # No read timeout: the Gateway only answers once the stream is over.
+            with httpx.Client(timeout=httpx.Timeout(10.0, read=None)) as client:
+                response = client.post(url, content=telemetry_messages())
+                print(f"Telemetry stream closed by the gateway: Status {response.status_code}")
+        except httpx.HTTPError as e:
+            print(f"Telemetry stream to the gateway failed: {e}")
+        time.sleep(TELEMETRY_RETRY_INTERVAL)
+
+@app.on_event("startup")
+def start_telemetry_push():
+    if GATEWAY_URL:
+        threading.Thread(target=push_telemetry_forever, name="telemetry-push", daemon=True).start()
 
 # --- Main Execution ---
 if __name__ == "__main__":
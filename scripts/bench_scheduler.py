@@ -0,0 +1,95 @@
+# scripts/bench_scheduler.py
+
+"""
+InferOps - 调度器基准测试
+
+这个脚本测量 `SchedulerIndex` 在不同集群规模下的选点延迟，
+并与旧版逐个遍历 `settings.NODES` 的线性扫描实现进行对比。
+
+每一轮包含一次完整的 "选点 -> 预留 -> 释放" 循环，
+这与一次聊天请求在网关中的调度开销相对应。
+"""
+
+import os
+import random
+import sys
+import time
+
+# 将项目根目录加入 sys.path，以便导入 gateway 模块
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gateway.core.scheduler import SchedulerIndex, compute_node_score
+
+# --- 配置 ---
+NODE_COUNTS = [3, 30, 300, 3000, 10000]
+ITERATIONS = 2000
+MODELS = ["llama3-8b", "qwen2-7b", "mistral-7b"]
+
+
+def make_cluster(count):
+    """生成一个模拟集群：节点配置及其最新的监控指标。"""
+    nodes, metrics = [], {}
+    for i in range(count):
+        node = {"id": i + 1, "name": f"Node {i + 1}", "static_weight": random.uniform(2.0, 10.0)}
+        nodes.append(node)
+        metrics[node["id"]] = {
+            "locked": False,
+            "model_id": MODELS[i % len(MODELS)],
+            "gpu": {"utilization_percent": random.uniform(0, 100), "temperature_celsius": random.uniform(40, 85)},
+            "memory": {"percent": random.uniform(10, 90)},
+        }
+    return nodes, metrics
+
+
+def linear_pick(nodes, metrics, locked, requested_model):
+    """旧版实现：每次请求都遍历所有节点并重新计算得分。"""
+    best_node, highest_score = None, -1
+    for node in nodes:
+        m = metrics[node["id"]]
+        if node["id"] in locked or (requested_model and m["model_id"] != requested_model):
+            continue
+        score = compute_node_score(node, m)
+        if score > highest_score:
+            highest_score, best_node = score, node
+    return best_node
+
+
+def bench_linear(nodes, metrics):
+    locked = set()
+    start = time.perf_counter()
+    for i in range(ITERATIONS):
+        node = linear_pick(nodes, metrics, locked, MODELS[i % len(MODELS)])
+        locked.add(node["id"])
+        locked.discard(node["id"])
+    return (time.perf_counter() - start) / ITERATIONS * 1e6
+
+
+def bench_index(nodes, metrics):
+    index = SchedulerIndex()
+    for node in nodes:
+        index.update_node(node, online=True, metrics=metrics[node["id"]])
+    start = time.perf_counter()
+    for i in range(ITERATIONS):
+        node = index.pick(MODELS[i % len(MODELS)])
+        index.reserve(node["id"])
+        index.release(node["id"])
+    return (time.perf_counter() - start) / ITERATIONS * 1e6
+
+
+def main():
+    print("=" * 60)
+    print("  InferOps - 调度器选点延迟基准测试")
+    print("=" * 60)
+    print(f"  {'节点数':>8} | {'线性扫描 (µs)':>14} | {'索引 (µs)':>10}")
+    print("  " + "-" * 40)
+    for count in NODE_COUNTS:
+        random.seed(count)
+        nodes, metrics = make_cluster(count)
+        linear_us = bench_linear(nodes, metrics)
+        index_us = bench_index(nodes, metrics)
+        print(f"  {count:>8} | {linear_us:>14.2f} | {index_us:>10.2f}")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# tests/test_admission.py
+
+import asyncio
+import unittest
+
+# 假设可以从 gateway 模块导入
+from services.admission import AdmissionQueue, AdmissionError
+
+
+class FakeSlots:
+    """一个极简的槽位池，用于模拟节点容量。"""
+
+    def __init__(self, free):
+        self.free = free
+
+    def try_acquire(self):
+        if self.free > 0:
+            self.free -= 1
+            return "slot"
+        return None
+
+    def release(self, _reservation=None):
+        self.free += 1
+
+
+class TestAdmissionQueue(unittest.TestCase):
+    """
+    对准入队列 `AdmissionQueue` 的单元测试。
+    """
+
+    def setUp(self):
+        print(f"\n--- Setting up for {self.id()} ---")
+
+    def tearDown(self):
+        print(f"--- Tearing down {self.id()} ---")
+
+    def test_waiter_is_woken_when_slot_frees(self):
+        """
+        测试: 没有空闲槽位时请求进入队列，槽位释放后立即被唤醒，无需轮询。
+        """
+        print("    - 验证释放槽位后唤醒等待者...")
+
+        async def scenario():
+            queue = AdmissionQueue(max_depth=4)
+            slots = FakeSlots(free=0)
+            waiter = asyncio.ensure_future(queue.admit(slots.try_acquire, slots.release, timeout=5))
+            await asyncio.sleep(0)
+            self.assertEqual(len(queue), 1)
+
+            slots.release()
+            queue.notify()
+            self.assertEqual(await waiter, "slot")
+            self.assertEqual(len(queue), 0)
+
+        asyncio.run(scenario())
+
+    def test_deadline_and_depth_limits(self):
+        """
+        测试: 超过截止时间的请求被拒绝；队列已满时新请求立即被拒绝。
+        """
+        print("    - 验证截止时间与队列深度上限...")
+
+        async def scenario():
+            queue = AdmissionQueue(max_depth=1)
+            slots = FakeSlots(free=0)
+            first = asyncio.ensure_future(queue.admit(slots.try_acquire, slots.release, timeout=0.05))
+            await asyncio.sleep(0)
+
+            with self.assertRaises(AdmissionError) as ctx:
+                await queue.admit(slots.try_acquire, slots.release, timeout=1)
+            self.assertEqual(ctx.exception.reason, "queue_full")
+
+            with self.assertRaises(AdmissionError) as ctx:
+                await first
+            self.assertEqual(ctx.exception.reason, "deadline")
+            self.assertEqual(len(queue), 0)
+
+        asyncio.run(scenario())
+
+    def test_priority_ordering(self):
+        """
+        测试: 优先级模式下，高优先级的等待者先获得槽位。
+        """
+        print("    - 验证优先级排序...")
+
+        async def scenario():
+            queue = AdmissionQueue(max_depth=4, ordering="priority")
+            slots = FakeSlots(free=0)
+            low = asyncio.ensure_future(queue.admit(slots.try_acquire, slots.release, priority=0, timeout=5))
+            high = asyncio.ensure_future(queue.admit(slots.try_acquire, slots.release, priority=10, timeout=5))
+            await asyncio.sleep(0)
+
+            slots.release()
+            queue.notify()
+            self.assertEqual(await asyncio.wait_for(high, 1), "slot")
+            self.assertFalse(low.done())
+            low.cancel()
+
+        asyncio.run(scenario())
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
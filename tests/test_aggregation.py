@@ -0,0 +1,168 @@
+# tests/test_aggregation.py
+
+import asyncio
+import unittest
+
+# 假设可以从 gateway 模块导入
+from services.aggregation import AggregatorHub, ConcatMerge, Merge, StatsMerge, SummaryMerge, VoteMerge, build_merges, normalize_answer
+
+
+def result(index, output, original=None, error=None):
+    entry = {"index": index, "original": original, "output": output, "node": "n"}
+    if error is not None:
+        entry["error"] = error
+    return entry
+
+
+class TestAggregatorHub(unittest.TestCase):
+    """
+    对增量聚合中心及其合并函数的单元测试。
+    """
+
+    def setUp(self):
+        print(f"\n--- Setting up for {self.id()} ---")
+
+    def tearDown(self):
+        print(f"--- Tearing down {self.id()} ---")
+
+    def test_hub_catches_up_then_merges_incrementally(self):
+        """
+        测试: 达到阈值时聚合中心在后台按页合并已有的结果（页之间让出事件循环），期间到达的新结果排队、追赶完成后再合并，之后逐条合并；拼接结果按数据项顺序排列。
+        """
+        print("    - 验证追赶合并与增量合并...")
+        hub = AggregatorHub(build_merges("concat, stats:topic"))
+        self.assertEqual(hub.snapshot()["state"], "waiting")
+
+        async def scenario():
+            hub.start([[result(2, "c", {"topic": "x"})], [result(0, "a", {"topic": "x"})]])
+            hub.add(result(1, None, {"topic": "y"}, error="boom"))
+            await asyncio.sleep(0)
+            catching_up = hub.snapshot()
+            self.assertEqual((catching_up["state"], catching_up["items_merged"]), ("catching_up", 1))  # 只合并了第一页
+            while hub.state == "catching_up":
+                await asyncio.sleep(0)
+            self.assertEqual(hub.snapshot()["merges"]["concat"]["text"], "a\n\nc")
+
+            hub.add(result(3, "dd", "plain item"))
+            snapshot = hub.snapshot()
+            self.assertEqual(snapshot["state"], "running")
+            self.assertEqual(snapshot["items_merged"], 4)
+            self.assertEqual(snapshot["merges"]["concat"]["text"], "a\n\nc\n\ndd")
+            categories = snapshot["merges"]["stats"]["categories"]
+            self.assertEqual(categories["x"]["count"], 2)
+            self.assertEqual(categories["y"]["failed"], 1)
+            self.assertEqual(categories["uncategorized"]["avg_output_chars"], 2.0)
+            await hub.finish()
+
+        asyncio.run(scenario())
+        self.assertEqual(hub.snapshot()["state"], "final")
+
+    def test_voting_per_input(self):
+        """
+        测试: 对相同输入的答案进行多数投票，答案比较时忽略大小写、空白和结尾标点。
+        """
+        print("    - 验证多数投票...")
+        self.assertEqual(normalize_answer("  The  Answer is 42. "), "the answer is 42")
+        hub = AggregatorHub(build_merges("vote"))
+
+        async def scenario():
+            hub.start([])
+            for i, answer in enumerate(["Paris.", "paris", "Lyon", "4", "4"]):
+                hub.add(result(i, answer, {"q": "capital"} if i < 3 else {"q": "2+2"}))
+            await hub.finish()
+
+        asyncio.run(scenario())
+        vote = hub.snapshot()["merges"]["vote"]
+        self.assertEqual(vote["groups"], 2)
+        self.assertEqual(vote["winners"][0], {"input": {"q": "capital"}, "answer": "paris", "votes": 2, "of": 3})
+        self.assertEqual(vote["agreement"], 0.8)
+
+    def test_map_reduce_summary(self):
+        """
+        测试: 摘要合并每凑满 fan-in 个输出就归约一次，并在结束时把剩余部分归约为最终摘要。
+        """
+        print("    - 验证 map-reduce 摘要...")
+
+        async def summarize(texts):
+            await asyncio.sleep(0)
+            return "(" + "+".join(texts) + ")"
+
+        async def scenario():
+            merge = SummaryMerge(summarize=summarize, fan_in=2)
+            for i, text in enumerate("abcde"):
+                merge.add(result(i, text))
+                await asyncio.sleep(0.01)
+            running = merge.value()
+            self.assertFalse(running["final"])
+            self.assertEqual(running["summary"], "((a+b)+(c+d))")  # 最高层的部分摘要
+            await merge.finish()
+            self.assertEqual(merge.value()["summary"], "(((a+b)+(c+d))+e)")
+            self.assertTrue(merge.value()["final"])
+
+        asyncio.run(scenario())
+
+    def test_merges_keep_bounded_state(self):
+        """
+        测试: 拼接超过字符上限时丢弃最靠后的数据项的输出；投票超过输入组上限后，新输入的答案只计数不保存；统计超过类别上限后，新类别计入 other。
+        """
+        print("    - 验证合并函数的内存上限...")
+        concat = ConcatMerge(separator="|", max_chars=6)
+        for index, output in [(3, "ddd"), (0, "aa"), (1, "bb"), (2, "cc")]:
+            concat.add(result(index, output))
+        self.assertEqual(concat.value(), {"items": 4, "text": "aa|bb|cc", "truncated": True})
+
+        vote = VoteMerge(max_groups=2)
+        for i, question in enumerate(["q1", "q2", "q1", "q3"]):
+            vote.add(result(i, "yes", {"q": question}))
+        value = vote.value()
+        self.assertEqual((value["groups"], value["votes"], value["untracked_votes"]), (2, 3, 1))
+
+        # 大量互不相同的自由文本答案：每组和全局只逐个统计有限个答案，其余计入 "other"
+        vote = VoteMerge()
+        for i in range(5000):
+            vote.add(result(i, f"free text answer {i}", {"q": i % 2}))
+        vote.add(result(5000, "free text answer 0", {"q": 0}))
+        self.assertLessEqual(sum(len(votes) for votes in vote._groups.values()), 2 * VoteMerge.MAX_GROUP_ANSWERS)
+        self.assertEqual(len(vote._answers), VoteMerge.MAX_TRACKED_ANSWERS)
+        value = vote.value()
+        self.assertEqual(value["votes"], 5001)
+        self.assertEqual(value["other_answers"], 5001 - VoteMerge.MAX_TRACKED_ANSWERS - 1)
+        self.assertEqual(value["top_answers"][0], ("free text answer 0", 2))
+        self.assertEqual({winner["of"] for winner in value["winners"]}, {2500, 2501})
+
+        # 按唯一字段（如 id）统计：只单独保存有限个类别
+        stats = StatsMerge("id", max_categories=3)
+        for i in range(100):
+            stats.add(result(i, "ok", {"id": i}))
+        stats.add(result(100, "ok", {"id": 0}))
+        value = stats.value()
+        self.assertEqual(sorted(value["categories"]), ["0", "1", "2"])
+        self.assertEqual(value["categories"]["0"]["count"], 2)
+        self.assertEqual((value["other"]["count"], value["other"]["avg_output_chars"]), (97, 2.0))
+
+    def test_merge_must_implement_add_and_value(self):
+        """
+        测试: 合并函数是抽象基类，未实现 add 与 value 的子类不能实例化。
+        """
+        print("    - 验证合并函数的抽象接口...")
+
+        class Incomplete(Merge):
+            name = "incomplete"
+
+            def add(self, result):
+                pass
+
+        with self.assertRaises(TypeError):
+            Incomplete()
+
+    def test_unknown_merge(self):
+        """
+        测试: 未知的合并函数名称会被拒绝。
+        """
+        print("    - 验证未知合并函数...")
+        with self.assertRaises(ValueError):
+            build_merges("concat,median")
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
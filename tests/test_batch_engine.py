@@ -0,0 +1,473 @@
+# tests/test_batch_engine.py
+
+import asyncio
+import json
+import sys
+import unittest
+import unittest.mock
+from collections import Counter
+
+import httpx
+
+# 假设可以从 gateway 模块导入
+from services.batch_engine import run_batch, item_to_messages, item_key, estimate_cost, BatchStats, BATCH_RETRIES
+from services import batch_engine
+from services.batch_engine import scheduler_index, node_clients, acquire_lease, release_lease, admission_queue
+from services.locking import release_all_leases
+
+settings = batch_engine.settings
+# batch_engine 使用的 locking 模块实例（经由 gateway 包导入，与 services.locking 不是同一个）
+locking = sys.modules[batch_engine.Lease.__module__]
+
+
+class TestBatchEngine(unittest.TestCase):
+    """
+    对数据集并行处理引擎的单元测试。
+    """
+
+    def setUp(self):
+        print(f"\n--- Setting up for {self.id()} ---")
+        # 除 QoS 测试外，批处理可以用满所有槽位
+        self.reserved_slots = settings.QOS_INTERACTIVE_RESERVED_SLOTS
+        settings.QOS_INTERACTIVE_RESERVED_SLOTS = 0
+        self.nodes = [
+            {"id": 970 + i, "name": f"Batch Test Node {i}", "llm_url": f"http://batch-node-{i}:11434/api/chat",
+             "monitor_base_url": f"http://batch-node-{i}:8001", "static_weight": 1.0, "max_concurrency": 2}
+            for i in (1, 2, 3)
+        ]
+        for node in self.nodes:
+            scheduler_index.update_node(node, online=True, metrics={"locked": False, "model_id": "m", "gpu": {}, "memory": {}})
+
+    def tearDown(self):
+        asyncio.run(node_clients.aclose())  # 丢弃绑定到模拟传输层的客户端
+        node_clients.transport = None
+        for node in self.nodes:
+            release_all_leases(node["id"])
+            scheduler_index.remove_node(node["id"])
+        settings.QOS_INTERACTIVE_RESERVED_SLOTS = self.reserved_slots
+        print(f"--- Tearing down {self.id()} ---")
+
+    def test_item_to_messages(self):
+        """
+        测试: 数据项可以是现成的 messages、带 prompt 字段的对象、字符串或任意 JSON 值。
+        """
+        print("    - 验证数据项到聊天消息的转换...")
+        messages = [{"role": "user", "content": "hi"}]
+        self.assertIs(item_to_messages({"messages": messages}), messages)
+        self.assertEqual(item_to_messages({"prompt": "hi"}), messages)
+        self.assertEqual(item_to_messages("hi"), messages)
+        self.assertEqual(item_to_messages([1, 2])[0]["content"], "[1, 2]")
+
+    def test_parallel_processing_with_retries(self):
+        """
+        测试: 数据项并发地在所有节点上运行，每个节点的并发数不超过其槽位；在故障节点上失败的数据项被重试到其他节点。
+        """
+        print("    - 验证并行处理、并发上限与失败重试...")
+        running = Counter()
+        peak = Counter()
+
+        async def handler(request):
+            host = request.url.host
+            running[host] += 1
+            peak[host] = max(peak[host], running[host])
+            try:
+                await asyncio.sleep(0.01)
+                if host == "batch-node-3":
+                    return httpx.Response(500)
+                prompt = json.loads(request.content)["messages"][0]["content"]
+                return httpx.Response(200, json={"message": {"role": "assistant", "content": prompt.upper()}, "done": True})
+            finally:
+                running[host] -= 1
+
+        node_clients.transport = httpx.MockTransport(handler)
+        outcomes = []
+        retries_before = BATCH_RETRIES.value()
+        asyncio.run(run_batch((f"item {i}" for i in range(30)), outcomes.append))
+
+        self.assertEqual(len(outcomes), 30)
+        self.assertTrue(all(outcome.error is None for outcome in outcomes))
+        self.assertEqual(sorted(outcome.index for outcome in outcomes), list(range(30)))
+        self.assertEqual(outcomes[0].output, outcomes[0].item.upper())
+        self.assertNotIn("Batch Test Node 3", {outcome.node_name for outcome in outcomes})
+        self.assertGreater(BATCH_RETRIES.value() - retries_before, 0)
+        for host in ("batch-node-1", "batch-node-2"):
+            self.assertEqual(peak[host], 2, host)  # 每个节点的所有槽位都被用满，但没有超出
+
+    def test_item_fails_after_max_attempts(self):
+        """
+        测试: 所有节点都失败时，数据项在达到最大尝试次数后以错误结束，而不是无限重试。
+        """
+        print("    - 验证达到最大尝试次数后失败...")
+        node_clients.transport = httpx.MockTransport(lambda request: httpx.Response(500))
+        outcomes = []
+        asyncio.run(run_batch(["a", "b"], outcomes.append))
+
+        self.assertEqual(len(outcomes), 2)
+        for outcome in outcomes:
+            self.assertIn("500", outcome.error)
+            self.assertEqual(outcome.attempts, 3)
+
+    def test_duplicates_run_once(self):
+        """
+        测试: 开启去重时相同的数据项只运行一次，结果分发给每个副本；memo 中已知输出的数据项不会发送到节点。
+        """
+        print("    - 验证数据项去重与 memo...")
+        requests = Counter()
+
+        async def handler(request):
+            prompt = json.loads(request.content)["messages"][0]["content"]
+            requests[prompt] += 1
+            await asyncio.sleep(0.01)
+            return httpx.Response(200, json={"message": {"role": "assistant", "content": prompt.upper()}, "done": True})
+
+        node_clients.transport = httpx.MockTransport(handler)
+        items = ["a", {"prompt": "a"}, "b", "c", "a", "b", "c", "a"]
+        known = {item_key("c"): "FROM MEMO"}
+        outcomes = []
+        asyncio.run(run_batch(items, outcomes.append, dedupe=True, memo=known.get))
+
+        self.assertEqual(requests, Counter({"a": 1, "b": 1}))
+        self.assertEqual(sorted(outcome.index for outcome in outcomes), list(range(8)))
+        outputs = {outcome.index: outcome.output for outcome in outcomes}
+        self.assertEqual([outputs[i] for i in range(8)], ["A", "A", "B", "FROM MEMO", "A", "B", "FROM MEMO", "A"])
+        self.assertEqual(sum(not outcome.reused for outcome in outcomes), 2)
+        self.assertEqual(item_key("a"), item_key({"prompt": "a"}))
+        self.assertNotEqual(item_key("a"), item_key("a", model="other"))
+
+        # 不去重时每个副本都会运行
+        requests.clear()
+        asyncio.run(run_batch(items, outcomes.append))
+        self.assertEqual(requests, Counter({"a": 4, "b": 2, "c": 2}))
+
+    def test_max_tokens_limits_generation(self):
+        """
+        测试: 数据项的 max_tokens 作为 options.num_predict 发送给节点，并计入数据项的去重键。
+        """
+        print("    - 验证 max_tokens 的传递...")
+        payloads = []
+
+        def handler(request):
+            payloads.append(json.loads(request.content))
+            return httpx.Response(200, json={"message": {"role": "assistant", "content": "ok"}, "done": True})
+
+        node_clients.transport = httpx.MockTransport(handler)
+        asyncio.run(run_batch([{"prompt": "short", "max_tokens": 16}], [].append))
+        asyncio.run(run_batch(["unlimited"], [].append))
+
+        self.assertEqual(payloads[0]["options"], {"num_predict": 16})
+        self.assertNotIn("options", payloads[1])
+        self.assertNotEqual(item_key({"prompt": "short", "max_tokens": 16}), item_key({"prompt": "short"}))
+
+    def test_malformed_response_fails_the_item(self):
+        """
+        测试: 节点返回格式异常的响应体时，数据项被重试并最终以失败结果上报，而不是静默丢失；message 为 null 视为空输出。
+        """
+        print("    - 验证格式异常的响应...")
+
+        def handler(request):
+            prompt = json.loads(request.content)["messages"][0]["content"]
+            if prompt == "null message":
+                return httpx.Response(200, json={"message": None, "done": True})
+            return httpx.Response(200, json=["not", "an", "object"])
+
+        node_clients.transport = httpx.MockTransport(handler)
+        outcomes = []
+        asyncio.run(run_batch(["null message", "list body"], outcomes.append))
+
+        by_item = {outcome.item: outcome for outcome in outcomes}
+        self.assertEqual(len(outcomes), 2)
+        self.assertEqual((by_item["null message"].output, by_item["null message"].error), ("", None))
+        self.assertIn("AttributeError", by_item["list body"].error)
+        self.assertEqual(by_item["list body"].attempts, 3)
+
+    def test_lease_is_renewed_while_item_runs(self):
+        """
+        测试: 运行时间超过租约 TTL 的数据项在运行期间持续续租，槽位不会因过期而被回收给其他请求。
+        """
+        print("    - 验证批处理租约的续租...")
+        request_timeout = settings.REQUEST_TIMEOUT
+        settings.REQUEST_TIMEOUT = 0.1
+        expired = []
+
+        async def handler(request):
+            for _ in range(4):
+                await asyncio.sleep(0.1)
+                expired.extend(locking.expire_stale_leases())
+            return httpx.Response(200, json={"message": {"role": "assistant", "content": "slow"}, "done": True})
+
+        node_clients.transport = httpx.MockTransport(handler)
+        outcomes = []
+        try:
+            asyncio.run(run_batch(["slow item"], outcomes.append))
+        finally:
+            settings.REQUEST_TIMEOUT = request_timeout
+
+        self.assertEqual(expired, [])
+        self.assertEqual(outcomes[0].output, "slow")
+
+    def test_item_moves_when_its_lease_is_refused(self):
+        """
+        测试: 数据项运行期间节点拒绝了它的租约，它在该节点上的请求被中止并改到另一个节点运行，槽位随之释放。
+        """
+        print("    - 验证被拒绝的租约使数据项换节点...")
+        renew_interval = settings.LEASE_RENEW_INTERVAL
+        settings.LEASE_RENEW_INTERVAL = 0.01
+        served = []
+
+        async def handler(request):
+            served.append(request.url.host)
+            if len(served) == 1:
+                node = next(node for node in self.nodes if node["llm_url"] == str(request.url))
+                locking.refuse_leases(node["id"], [lease.lease_id for lease in locking._leases.values()
+                                                   if lease.node_id == node["id"]])
+                await asyncio.sleep(5)
+            return httpx.Response(200, json={"message": {"role": "assistant", "content": "ok"}, "done": True})
+
+        node_clients.transport = httpx.MockTransport(handler)
+        outcomes = []
+        held = set(locking._leases)
+        try:
+            asyncio.run(asyncio.wait_for(run_batch(["one item"], outcomes.append), timeout=2))
+        finally:
+            settings.LEASE_RENEW_INTERVAL = renew_interval
+
+        self.assertEqual(outcomes[0].output, "ok")
+        self.assertEqual(len(served), 2)
+        self.assertNotEqual(served[0], served[1])
+        self.assertEqual(set(locking._leases), held)  # 包括被拒绝的租约在内都已释放
+
+    def test_failing_outcome_handler_records_item_as_failed(self):
+        """
+        测试: on_outcome 处理某个成功结果时抛出异常，异常不会被吞掉：数据项改为以失败结果上报，其余数据项不受影响。
+        """
+        print("    - 验证 on_outcome 异常的处理...")
+        node_clients.transport = httpx.MockTransport(
+            lambda request: httpx.Response(200, json={"message": {"role": "assistant", "content": "ok"}, "done": True}))
+        outcomes = []
+
+        def on_outcome(outcome):
+            if outcome.item == "bad" and outcome.error is None:
+                raise OSError("disk full")
+            outcomes.append(outcome)
+
+        asyncio.run(run_batch(["good", "bad", "good too"], on_outcome))
+
+        by_item = {outcome.item: outcome for outcome in outcomes}
+        self.assertEqual(len(outcomes), 3)
+        self.assertIsNone(by_item["good"].error)
+        self.assertIn("disk full", by_item["bad"].error)
+        self.assertIsNone(by_item["bad"].output)
+
+
+    def test_cost_estimate_and_eta(self):
+        """
+        测试: 数据项的成本由提示长度与预期输出（max_tokens 或 complexity 提示）估算；剩余时间按已完成的吞吐估算。
+        """
+        print("    - 验证成本估算与剩余时间...")
+        self.assertGreater(estimate_cost("x" * 4000), estimate_cost("x"))
+        self.assertEqual(estimate_cost({"prompt": "", "max_tokens": 100}), 100)
+        simple = estimate_cost({"prompt": "q", "metadata": {"complexity": 1}})
+        hard = estimate_cost({"prompt": "q", "metadata": {"complexity": 10}})
+        self.assertAlmostEqual(hard / simple, 10, places=2)
+
+        stats = BatchStats(started=0.0, seen_items=4, seen_cost=400.0, done_items=2, done_cost=100.0)
+        with unittest.mock.patch("time.monotonic", return_value=10.0):
+            # 吞吐 10/s；已读未完成 300，另有 2 个未读项按平均成本 100 计
+            self.assertAlmostEqual(stats.eta(remaining_items=4), 50.0)
+        self.assertIsNone(BatchStats().eta(10))
+
+    def test_longest_items_go_first_to_the_fastest_node(self):
+        """
+        测试: 最长的数据项优先派发，并交给最快的节点；较慢的节点分到较短的数据项。
+        """
+        print("    - 验证按长度的派发顺序...")
+        fast, slow, extra = self.nodes
+        scheduler_index.remove_node(extra["id"])
+        for node, weight in ((fast, 10.0), (slow, 1.0)):
+            node.update(static_weight=weight, max_concurrency=1)
+            scheduler_index.update_node(node, online=True, metrics={"locked": False, "model_id": "m", "gpu": {}, "memory": {}})
+        served = {}
+
+        async def handler(request):
+            served[json.loads(request.content)["messages"][0]["content"]] = request.url.host
+            await asyncio.sleep(0.01)
+            return httpx.Response(200, json={"message": {"role": "assistant", "content": "ok"}, "done": True})
+
+        node_clients.transport = httpx.MockTransport(handler)
+        items = [{"prompt": str(tokens), "max_tokens": tokens} for tokens in (20, 50, 10, 40, 30)]
+
+        flows = []
+        open_flow = batch_engine.batch_queue.open
+
+        def record_flow(*args, **kwargs):
+            # 记下此时的虚拟时间：只有这一个批处理时，它的 finish tag 从这里开始累计
+            flows.append((open_flow(*args, **kwargs), batch_engine.batch_queue._virtual_time))
+            return flows[-1][0]
+
+        async def scenario():
+            # 两个节点先被占满，让所有数据项进入预读窗口
+            leases = [acquire_lease(node, ttl=5) for node in (fast, slow)]
+            asyncio.get_running_loop().call_later(0.05, lambda: [release_lease(lease) for lease in leases])
+            await run_batch(items, [].append)
+
+        with unittest.mock.patch.object(batch_engine.batch_queue, "open", record_flow):
+            asyncio.run(scenario())
+        self.assertEqual(served["50"], "batch-node-1")
+        self.assertEqual(served["10"], "batch-node-2")
+        # 公平队列按实际运行的数据项计费（换入的数据项），每个数据项恰好一次
+        flow, virtual_start = flows[0]
+        self.assertAlmostEqual(flow.finish_tag - virtual_start, sum(max(estimate_cost(item), 1.0) for item in items))
+
+
+    def test_concurrent_batches_share_nodes_by_weight(self):
+        """
+        测试: 并发的批处理按权重分享节点槽位（加权公平排队），每个批处理运行中的数据项不超过其并发上限。
+        """
+        print("    - 验证批处理之间的加权公平调度与并发上限...")
+        node, *others = self.nodes
+        for other in others:
+            scheduler_index.remove_node(other["id"])
+        node.update(max_concurrency=1)
+        scheduler_index.update_node(node, online=True, metrics={"locked": False, "model_id": "m", "gpu": {}, "memory": {}})
+        served = []
+        running = Counter()
+        peak = Counter()
+
+        async def handler(request):
+            job = json.loads(request.content)["messages"][0]["content"].split()[0]
+            served.append(job)
+            running[job] += 1
+            peak[job] = max(peak[job], running[job])
+            await asyncio.sleep(0.002)
+            running[job] -= 1
+            return httpx.Response(200, json={"message": {"role": "assistant", "content": "ok"}, "done": True})
+
+        node_clients.transport = httpx.MockTransport(handler)
+
+        async def scenario():
+            await asyncio.gather(
+                run_batch([f"heavy {i}" for i in range(40)], [].append, weight=3.0),
+                run_batch([f"light {i}" for i in range(40)], [].append, weight=1.0),
+            )
+
+        asyncio.run(scenario())
+        # 两个批处理都在排队时，权重 3 的批处理得到约 3/4 的槽位
+        self.assertEqual(len(served), 80)
+        self.assertIn(Counter(served[:40])["heavy"], range(28, 33))
+
+        # 并发上限：即使有空闲槽位，批处理同时运行的数据项也不超过上限
+        node.update(max_concurrency=4)
+        scheduler_index.update_node(node, online=True, metrics={"locked": False, "model_id": "m", "gpu": {}, "memory": {}})
+        served.clear()
+        peak.clear()
+
+        async def capped():
+            await asyncio.gather(
+                run_batch([f"capped {i}" for i in range(10)], [].append, max_in_flight=1),
+                run_batch([f"free {i}" for i in range(10)], [].append),
+            )
+
+        asyncio.run(capped())
+        self.assertEqual(len(served), 20)
+        self.assertEqual(peak["capped"], 1)
+        self.assertEqual(peak["free"], 3)  # 其余的槽位都给了另一个批处理
+
+
+    def test_batch_uses_only_slots_spare_from_interactive_traffic(self):
+        """
+        测试: 批处理只使用为交互请求预留之外的空闲槽位；有交互请求在准入队列中等待时，批处理不占用新的槽位。
+        """
+        print("    - 验证交互请求的预留槽位...")
+        node, *others = self.nodes
+        for other in others:
+            scheduler_index.remove_node(other["id"])
+        node.update(max_concurrency=3)
+        scheduler_index.update_node(node, online=True, metrics={"locked": False, "model_id": "m", "gpu": {}, "memory": {}})
+        settings.QOS_INTERACTIVE_RESERVED_SLOTS = 1
+        running = 0
+        peak = 0
+        batch_slots = []
+        first_request = []
+
+        async def handler(request):
+            nonlocal running, peak
+            first_request.append(asyncio.get_running_loop().time())
+            running += 1
+            peak = max(peak, running)
+            batch_slots.append(scheduler_index.class_usage()["batch"])
+            await asyncio.sleep(0.005)
+            running -= 1
+            return httpx.Response(200, json={"message": {"role": "assistant", "content": "ok"}, "done": True})
+
+        node_clients.transport = httpx.MockTransport(handler)
+        asyncio.run(run_batch([f"item {i}" for i in range(10)], [].append))
+        self.assertEqual(peak, 2)  # 3 个槽位中的 1 个留给交互请求
+        self.assertEqual(max(batch_slots), 2)
+        self.assertEqual(scheduler_index.class_usage(), {"interactive": 0, "batch": 0})
+
+        # 交互请求占用 2 个槽位后只剩 1 个空闲槽位，即预留的那个：批处理等待
+        async def behind_interactive_lease():
+            leases = [acquire_lease(node, ttl=5) for _ in range(2)]
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            loop.call_later(0.05, release_lease, leases[0])
+            await run_batch(["a", "b"], [].append)
+            return started
+
+        first_request.clear()
+        started = asyncio.run(behind_interactive_lease())
+        self.assertGreaterEqual(first_request[0] - started, 0.04)
+
+        # 交互请求在准入队列中等待时，批处理让出槽位，直到队列清空
+        async def behind_queued_request():
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            waiter = asyncio.ensure_future(admission_queue.admit(lambda: None, release=lambda _: None, timeout=0.05))
+            await asyncio.sleep(0)
+            await run_batch(["a", "b"], [].append)
+            with self.assertRaises(Exception) as raised:
+                await waiter
+            self.assertEqual(raised.exception.reason, "deadline")
+            return started
+
+        first_request.clear()
+        started = asyncio.run(behind_queued_request())
+        self.assertGreaterEqual(first_request[0] - started, 0.04)
+
+    def test_batch_outlasts_idle_timeout_under_interactive_load(self):
+        """
+        测试: 批处理等待交互请求占用（或预留）的槽位时不计入空闲超时，交互负载持续超过超时时间后所有数据项仍然成功；只有没有节点在线时才会超时失败。
+        """
+        print("    - 验证交互负载下的空闲超时...")
+        node, *others = self.nodes
+        for other in others:
+            scheduler_index.remove_node(other["id"])
+        settings.QOS_INTERACTIVE_RESERVED_SLOTS = 1
+        idle_timeout = settings.BATCH_IDLE_TIMEOUT
+        settings.BATCH_IDLE_TIMEOUT = 0.05
+        self.addCleanup(setattr, settings, "BATCH_IDLE_TIMEOUT", idle_timeout)
+        node_clients.transport = httpx.MockTransport(
+            lambda request: httpx.Response(200, json={"message": {"role": "assistant", "content": "ok"}, "done": True})
+        )
+
+        async def under_interactive_load():
+            # 交互请求占用 1 个槽位，另一个为交互请求预留：批处理在 4 倍的超时时间内无槽位可用
+            lease = acquire_lease(node, ttl=5)
+            asyncio.get_running_loop().call_later(0.2, release_lease, lease)
+            outcomes = []
+            await run_batch(["a", "b", "c"], outcomes.append)
+            return outcomes
+
+        outcomes = asyncio.run(under_interactive_load())
+        self.assertEqual(len(outcomes), 3)
+        self.assertTrue(all(outcome.error is None for outcome in outcomes))
+
+        # 没有节点在线时，超时后剩余的数据项失败
+        scheduler_index.update_node(node, online=False, metrics=None)
+        outcomes = []
+        asyncio.run(run_batch(["a", "b"], outcomes.append))
+        self.assertEqual([outcome.error for outcome in outcomes], ["No node available."] * 2)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
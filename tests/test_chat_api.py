@@ -0,0 +1,301 @@
+# tests/test_chat_api.py
+
+import asyncio
+import json
+import sys
+import unittest
+
+import httpx
+
+# 假设可以从 gateway 模块导入
+from api.v1 import chat
+
+settings = chat.settings
+# chat 使用的 health 模块实例（经由 gateway 包导入）
+health = sys.modules[chat.quarantine_node.__module__]
+
+
+class FakeRequest:
+    """模拟一个从不断开的 ASGI 连接。"""
+
+    async def receive(self):
+        await asyncio.sleep(3600)
+
+
+def ndjson(*messages):
+    return b"".join(json.dumps(message).encode("utf-8") + b"\n" for message in messages)
+
+
+class TestChatProxy(unittest.TestCase):
+    """
+    对聊天代理的流中故障转移与请求错误处理的单元测试。
+    """
+
+    def setUp(self):
+        print(f"\n--- Setting up for {self.id()} ---")
+        self.nodes = [
+            {"id": 950 + i, "name": f"Chat Test Node {i}", "llm_url": f"http://chat-node-{i}:11434/api/chat",
+             "monitor_base_url": f"http://chat-node-{i}:8001", "static_weight": weight, "max_concurrency": 1}
+            for i, weight in ((1, 10.0), (2, 1.0))
+        ]
+        health.state.initialize_state(self.nodes)
+        for node in self.nodes:
+            chat.scheduler_index.update_node(node, online=True, metrics={"locked": False, "model_id": "m", "gpu": {}, "memory": {}})
+        self.cache_enabled = settings.RESPONSE_CACHE_ENABLED
+        settings.RESPONSE_CACHE_ENABLED = False
+        self.payloads = []
+
+    def tearDown(self):
+        settings.RESPONSE_CACHE_ENABLED = self.cache_enabled
+        asyncio.run(chat.node_clients.aclose())
+        chat.node_clients.transport = None
+        for node in self.nodes:
+            chat.scheduler_index.remove_node(node["id"])
+            health.state.NODE_STATUS_CACHE.pop(node["id"], None)
+            health._quarantined_until.pop(node["id"], None)
+        print(f"--- Tearing down {self.id()} ---")
+
+    def test_stream_resumes_on_another_node_after_partial_output(self):
+        """
+        测试: 节点在输出一部分内容后断开，请求带着已输出的内容转移到另一个节点继续生成，客户端收到的文本既不中断也不重复。
+        """
+        print("    - 验证流中故障转移...")
+
+        async def broken_stream():
+            yield ndjson({"message": {"role": "assistant", "content": "Hel"}, "done": False},
+                         {"message": {"role": "assistant", "content": "lo"}, "done": False})
+            raise httpx.ReadError("connection reset")
+
+        def handler(request):
+            self.payloads.append((request.url.host, json.loads(request.content)))
+            if request.url.host == "chat-node-1":
+                return httpx.Response(200, content=broken_stream())
+            return httpx.Response(200, content=ndjson(
+                {"message": {"role": "assistant", "content": " wor"}, "done": False},
+                {"message": {"role": "assistant", "content": "ld"}, "done": False},
+                {"message": {"role": "assistant", "content": ""}, "done": True},
+            ))
+
+        chat.node_clients.transport = httpx.MockTransport(handler)
+        request = chat.ChatRequest(messages=[{"role": "user", "content": "Say hello world"}])
+
+        async def scenario():
+            response = await chat.chat_proxy(request, FakeRequest())
+            return [chunk async for chunk in response.body_iterator]
+
+        chunks = asyncio.run(scenario())
+        messages = [json.loads(chunk) for chunk in chunks if isinstance(chunk, bytes)]
+        events = [chunk for chunk in chunks if isinstance(chunk, str)]
+        self.assertEqual("".join(message["message"]["content"] for message in messages), "Hello world")
+        self.assertTrue(messages[-1]["done"])
+        self.assertEqual(len(events), 2)  # 两次 node_assigned 事件，没有错误
+        self.assertIn("Chat Test Node 2", events[1])
+
+        # 第二个节点收到原始对话加上已输出的部分回答
+        self.assertEqual([host for host, _ in self.payloads], ["chat-node-1", "chat-node-2"])
+        self.assertEqual(self.payloads[1][1]["messages"][-1], {"role": "assistant", "content": "Hello"})
+        self.assertEqual(chat.scheduler_index.free_slots(self.nodes[0]["id"]), 0)  # 故障节点离线
+
+    def test_failed_node_stays_out_after_telemetry_update(self):
+        """
+        测试: 节点在请求中出错后被隔离，其代理随后上报的指标不会让它立即重新上线被选中；隔离期过后才恢复。
+        """
+        print("    - 验证故障节点的隔离...")
+
+        def handler(request):
+            self.payloads.append((request.url.host, json.loads(request.content)))
+            if request.url.host == "chat-node-1":
+                return httpx.Response(500, json={"error": "model server crashed"})
+            return httpx.Response(200, content=ndjson({"message": {"role": "assistant", "content": "ok"}, "done": True}))
+
+        chat.node_clients.transport = httpx.MockTransport(handler)
+        request = chat.ChatRequest(messages=[{"role": "user", "content": "hi"}], stream=False)
+        metrics = {"locked": False, "model_id": "m", "gpu": {}, "memory": {}}
+
+        async def scenario():
+            response = await chat.chat_proxy(request, FakeRequest())
+            health.apply_node_metrics(self.nodes[0], metrics)  # 代理照常上报
+            return response, chat.select_node()
+
+        response, picked = asyncio.run(scenario())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([host for host, _ in self.payloads], ["chat-node-1", "chat-node-2"])
+        self.assertEqual(picked["id"], self.nodes[1]["id"])
+        self.assertEqual(chat.scheduler_index.free_slots(self.nodes[0]["id"]), 0)
+
+        # 隔离期结束后，下一次上报让节点重新上线
+        health._quarantined_until[self.nodes[0]["id"]] = 0
+
+        async def report():
+            health.apply_node_metrics(self.nodes[0], metrics)
+
+        asyncio.run(report())
+        self.assertEqual(chat.scheduler_index.free_slots(self.nodes[0]["id"]), 1)
+
+    def test_request_rejected_by_node_is_not_failed_over(self):
+        """
+        测试: 节点因请求本身出错返回 4xx 时，错误直接返回给客户端，不重试其他节点，也不把节点标记为离线。
+        """
+        print("    - 验证 4xx 错误不触发故障转移...")
+
+        def handler(request):
+            self.payloads.append((request.url.host, json.loads(request.content)))
+            return httpx.Response(404, json={"error": "model 'nope' not found"})
+
+        chat.node_clients.transport = httpx.MockTransport(handler)
+        request = chat.ChatRequest(messages=[{"role": "user", "content": "hi"}], stream=False)
+        response = asyncio.run(chat.chat_proxy(request, FakeRequest()))
+
+        self.assertEqual(response.status_code, 404)
+        self.assertIn("model 'nope' not found", json.loads(response.body)["error"])
+        self.assertEqual(len(self.payloads), 1)
+        for node in self.nodes:
+            self.assertEqual(chat.scheduler_index.free_slots(node["id"]), 1)
+
+    def test_node_failure_is_answered_with_502(self):
+        """
+        测试: stream=false 时节点故障且不再转移，客户端收到 502；状态码由错误标记决定，而不是响应体的内容。
+        """
+        print("    - 验证节点故障返回 502...")
+        attempts = settings.STREAM_FAILOVER_ATTEMPTS
+        settings.STREAM_FAILOVER_ATTEMPTS = 0
+
+        def handler(request):
+            self.payloads.append((request.url.host, json.loads(request.content)))
+            return httpx.Response(500, json={"error": "out of memory"})
+
+        chat.node_clients.transport = httpx.MockTransport(handler)
+        request = chat.ChatRequest(messages=[{"role": "user", "content": "hi"}], stream=False)
+        try:
+            response = asyncio.run(chat.chat_proxy(request, FakeRequest()))
+        finally:
+            settings.STREAM_FAILOVER_ATTEMPTS = attempts
+
+        self.assertEqual(response.status_code, 502)
+        self.assertIn("failed", json.loads(response.body)["error"])
+        self.assertEqual(len(self.payloads), 1)
+
+    def test_failover_waits_only_for_the_rest_of_the_deadline(self):
+        """
+        测试: 故障转移重新排队时只等待客户端 deadline 的剩余时间，而不是默认的排队期限。
+        """
+        print("    - 验证故障转移沿用剩余的 deadline...")
+
+        def handler(request):
+            self.payloads.append((request.url.host, json.loads(request.content)))
+            return httpx.Response(500, json={"error": "crashed"})
+
+        chat.node_clients.transport = httpx.MockTransport(handler)
+        request = chat.ChatRequest(messages=[{"role": "user", "content": "hi"}], stream=False, deadline_ms=100)
+
+        async def scenario():
+            held = chat.acquire_lease(self.nodes[1])  # 另一个节点一直被占用
+            try:
+                started = chat.time.monotonic()
+                response = await asyncio.wait_for(chat.chat_proxy(request, FakeRequest()), timeout=5)
+                return response, chat.time.monotonic() - started
+            finally:
+                chat.release_lease(held)
+
+        response, elapsed = asyncio.run(scenario())
+        self.assertEqual(response.status_code, 502)
+        self.assertIn("no other node", json.loads(response.body)["error"])
+        self.assertLess(elapsed, 1.0)
+        self.assertEqual([host for host, _ in self.payloads], ["chat-node-1"])
+
+    def test_hedge_never_uses_another_model(self):
+        """
+        测试: 指定模型的请求在首个 token 变慢时，只在服务同一模型的节点上对冲；没有这样的空闲节点就不对冲。
+        """
+        print("    - 验证对冲不回退到其他模型...")
+        chat.scheduler_index.update_node(self.nodes[1], online=True,
+                                         metrics={"locked": False, "model_id": "other", "gpu": {}, "memory": {}})
+        delay = settings.HEDGE_FALLBACK_DELAY
+        settings.HEDGE_FALLBACK_DELAY = 0.01
+        chat.hedge_budget.record_request()
+        chat.hedge_budget.refund()  # 确保预算足以发起一次对冲
+
+        async def handler(request):
+            self.payloads.append((request.url.host, json.loads(request.content)))
+            await asyncio.sleep(0.05)
+            return httpx.Response(200, content=ndjson({"message": {"role": "assistant", "content": "m"}, "done": True}))
+
+        chat.node_clients.transport = httpx.MockTransport(handler)
+        request = chat.ChatRequest(messages=[{"role": "user", "content": "hi"}], model="m", hedge=True, stream=False)
+        try:
+            response = asyncio.run(chat.chat_proxy(request, FakeRequest()))
+        finally:
+            settings.HEDGE_FALLBACK_DELAY = delay
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([host for host, _ in self.payloads], ["chat-node-1"])
+
+    def test_rejection_reaches_coalesced_followers(self):
+        """
+        测试: 合并请求的 leader 被节点以 4xx 拒绝时，follower 收到相同的状态码，而不是 502。
+        """
+        print("    - 验证合并请求的 4xx 状态码...")
+        settings.RESPONSE_CACHE_ENABLED = True
+
+        async def handler(request):
+            self.payloads.append((request.url.host, json.loads(request.content)))
+            await asyncio.sleep(0.05)
+            return httpx.Response(400, json={"error": "invalid options"})
+
+        chat.node_clients.transport = httpx.MockTransport(handler)
+        request = chat.ChatRequest(messages=[{"role": "user", "content": "rejected twice"}], stream=False,
+                                   options={"temperature": 0})
+
+        async def scenario():
+            leader = asyncio.ensure_future(chat.chat_proxy(request, FakeRequest()))
+            await asyncio.sleep(0)
+            follower = asyncio.ensure_future(chat.chat_proxy(request, FakeRequest()))
+            return await asyncio.gather(leader, follower)
+
+        responses = asyncio.run(scenario())
+        self.assertEqual([response.status_code for response in responses], [400, 400])
+        for response in responses:
+            self.assertIn("invalid options", json.loads(response.body)["error"])
+        self.assertEqual(len(self.payloads), 1)
+
+    def test_follower_queues_again_when_leader_gives_up(self):
+        """
+        测试: 合并请求的 leader 在排队时超过自己的 deadline，它的 503 不会传给 follower；follower 自己重新排队并拿到完整回答。
+        """
+        print("    - 验证 leader 放弃后 follower 重新排队...")
+        settings.RESPONSE_CACHE_ENABLED = True
+
+        def handler(request):
+            self.payloads.append((request.url.host, json.loads(request.content)))
+            return httpx.Response(200, content=ndjson(
+                {"message": {"role": "assistant", "content": "still here"}, "done": False},
+                {"message": {"role": "assistant", "content": ""}, "done": True},
+            ))
+
+        chat.node_clients.transport = httpx.MockTransport(handler)
+        messages = [{"role": "user", "content": "leader gives up"}]
+        leader = chat.ChatRequest(messages=messages, stream=False, options={"temperature": 0}, deadline_ms=50)
+        follower = chat.ChatRequest(messages=messages, stream=False, options={"temperature": 0})
+
+        async def scenario():
+            held = [chat.acquire_lease(node) for node in self.nodes]  # 所有槽位都被占用
+            leader_task = asyncio.ensure_future(chat.chat_proxy(leader, FakeRequest()))
+            await asyncio.sleep(0)
+            follower_task = asyncio.ensure_future(chat.chat_proxy(follower, FakeRequest()))
+            with self.assertRaises(chat.HTTPException) as raised:
+                await leader_task
+            self.assertEqual(raised.exception.status_code, 503)
+            self.assertFalse(follower_task.done())
+            for lease in held:
+                chat.release_lease(lease)
+            return await asyncio.wait_for(follower_task, timeout=5)
+
+        response = asyncio.run(scenario())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.body)["message"]["content"], "still here")
+        self.assertEqual(len(self.payloads), 1)
+        self.assertIsNone(chat.chat_flights.get(chat.request_cache_key(follower)))
+
+
+if __name__ == "__main__":
+    unittest.main()
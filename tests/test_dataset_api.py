@@ -0,0 +1,376 @@
+# tests/test_dataset_api.py
+
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+# 假设可以从 gateway 模块导入
+from api.v1 import dataset
+from services.memo_store import MemoStore
+
+
+class FakeRequest:
+    """模拟一个从不断开的 ASGI 连接。"""
+
+    def __init__(self, headers=None):
+        self.headers = headers or {}
+
+    async def receive(self):
+        await asyncio.sleep(3600)
+
+
+class TestDatasetProgressAPI(unittest.TestCase):
+    """
+    对任务进度、分页结果与 SSE 进度流端点的单元测试。
+    """
+
+    def setUp(self):
+        print(f"\n--- Setting up for {self.id()} ---")
+        self.store = dataset.job_store
+        self.original_directory = self.store.directory
+        self.store.directory = tempfile.mkdtemp(prefix="inferops-test-")
+        self.job_id = "progress-test-job"
+        self.store.create(self.job_id, status="processing", total_items=5)
+        for i in range(3):
+            self.store.append_result(self.job_id, {"index": i, "original": i, "output": str(i), "node": "n"})
+
+    def tearDown(self):
+        self.store.update(self.job_id, status="completed")
+        self.store.evict(now=float("inf"))  # 删除本测试的任务
+        shutil.rmtree(self.store.directory, ignore_errors=True)
+        self.store.directory = self.original_directory
+        print(f"--- Tearing down {self.id()} ---")
+
+    def test_progress_and_result_pages(self):
+        """
+        测试: 进度端点不返回结果；结果按游标分页，任务结束且读完后标记为 complete。
+        """
+        print("    - 验证进度与结果分页...")
+
+        async def scenario():
+            progress = await dataset.get_dataset_progress(self.job_id)
+            self.assertEqual(progress["results_available"], 3)
+            self.assertNotIn("results", progress)
+
+            page = await dataset.get_dataset_results(self.job_id, cursor=0, limit=2)
+            self.assertEqual([r["index"] for r in page["results"]], [0, 1])
+            page = await dataset.get_dataset_results(self.job_id, cursor=page["next_cursor"], limit=2)
+            self.assertEqual([r["index"] for r in page["results"]], [2])
+            self.assertFalse(page["complete"])  # 任务仍在运行
+
+            self.store.update(self.job_id, status="completed")
+            page = await dataset.get_dataset_results(self.job_id, cursor=3)
+            self.assertEqual((page["results"], page["next_cursor"], page["complete"]), ([], 3, True))
+
+        asyncio.run(scenario())
+
+    def test_event_stream_pushes_only_new_results(self):
+        """
+        测试: SSE 流从 Last-Event-ID 之后开始，只推送新结果与进度变化，任务结束时发送 end 事件。
+        """
+        print("    - 验证 SSE 进度流...")
+
+        async def scenario():
+            response = await dataset.stream_dataset_events(self.job_id, FakeRequest({"last-event-id": "2"}))
+            events = []
+
+            async def consume():
+                async for chunk in response.body_iterator:
+                    events.append(chunk)
+
+            consumer = asyncio.ensure_future(consume())
+            await asyncio.sleep(0.01)
+            self.assertTrue(events[0].startswith("id: 3\nevent: result\n"))
+            self.assertIn("event: progress", events[1])
+
+            for i in (3, 4):
+                self.store.append_result(self.job_id, {"index": i, "original": i, "output": str(i), "node": "n"})
+            self.store.update(self.job_id, status="completed")
+            dataset._notify(self.job_id)
+            await asyncio.wait_for(consumer, 1)
+
+            result_ids = [e.split("\n")[0] for e in events if "event: result" in e]
+            self.assertEqual(result_ids, ["id: 3", "id: 4", "id: 5"])
+            final_progress = json.loads([e for e in events if "event: progress" in e][-1].split("data: ")[1])
+            self.assertEqual(final_progress["status"], "completed")
+            self.assertTrue(events[-1].startswith("event: end"))
+
+        asyncio.run(scenario())
+
+    def test_export_ranges_and_formats(self):
+        """
+        测试: 导出端点按游标范围流式返回结果；已结束任务的完整 JSONL 导出直接返回结果文件；未知或不可用的格式被拒绝。
+        """
+        print("    - 验证结果导出端点...")
+
+        async def download(**params):
+            params = dict({"fmt": "jsonl", "cursor": 0, "end": None, "header": True}, **params)
+            response = await dataset.export_dataset_results(self.job_id, **params)
+            body = b"".join([chunk async for chunk in response.body_iterator])
+            return response, body
+
+        async def scenario():
+            response, body = await download(cursor=1, end=2)
+            self.assertEqual([json.loads(line)["index"] for line in body.splitlines()], [1])
+            self.assertEqual((response.headers["x-export-start"], response.headers["x-export-end"]), ("1", "2"))
+
+            response, body = await download(fmt="csv", cursor=1)
+            self.assertEqual(body.decode("utf-8").splitlines(), ["index,node,output,error,original", "1,n,1,,1", "2,n,2,,2"])
+
+            self.store.update(self.job_id, status="completed")
+            response = await dataset.export_dataset_results(self.job_id, fmt="jsonl", cursor=0, end=None, header=True)
+            self.assertIsInstance(response, dataset.FileResponse)
+            with open(response.path, encoding="utf-8") as f:
+                self.assertEqual([json.loads(line)["index"] for line in f], [0, 1, 2])
+
+            with self.assertRaises(dataset.HTTPException) as error:
+                await download(fmt="xml")
+            self.assertEqual(error.exception.status_code, 400)
+            if not dataset.format_available("parquet"):
+                with self.assertRaises(dataset.HTTPException) as error:
+                    await download(fmt="parquet")
+                self.assertEqual(error.exception.status_code, 501)
+
+        asyncio.run(scenario())
+
+
+class TestDatasetResume(unittest.TestCase):
+    """
+    对网关重启后恢复未完成任务的单元测试。
+    """
+
+    def setUp(self):
+        print(f"\n--- Setting up for {self.id()} ---")
+        self.original_store = dataset.job_store
+        self.original_run_batch = dataset.run_batch
+        self.directory = tempfile.mkdtemp(prefix="inferops-test-")
+        self.job_id = "resume-test-job"
+
+        # 重启前：5 个数据项中的 0 和 3 已有结果
+        store = type(self.original_store)(self.directory)
+        store.create(self.job_id, status="processing", total_items=5, aggregate="concat", dedupe=True)
+        with open(store.items_path(self.job_id), "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(f"item {i}") + "\n" for i in range(5))
+        for i in (3, 0):
+            store.append_result(self.job_id, {"index": i, "original": f"item {i}", "output": f"ITEM {i}", "node": "n"})
+
+        # 重启后：新的任务存储从磁盘加载
+        dataset.job_store = type(self.original_store)(self.directory)
+        dataset.job_store.load()
+
+    def tearDown(self):
+        dataset.job_store = self.original_store
+        dataset.run_batch = self.original_run_batch
+        dataset.aggregator_hubs.pop(self.job_id, None)
+        shutil.rmtree(self.directory, ignore_errors=True)
+        print(f"--- Tearing down {self.id()} ---")
+
+    def test_resume_runs_only_missing_items(self):
+        """
+        测试: 恢复的任务只处理尚无结果的数据项（保留其原始序号），已有的结果可供去重复用，重复的结果不会被记录两次，聚合包含全部结果。
+        """
+        print("    - 验证任务恢复只处理缺失的数据项...")
+        ran = []
+
+        async def fake_run_batch(items, on_outcome, indexed=False, dedupe=False, memo=None, **options):
+            self.assertTrue(indexed and dedupe)
+            self.assertEqual(memo(dataset.item_key("item 3")), "ITEM 3")
+            async for index, item in items:
+                ran.append(index)
+                on_outcome(dataset.ItemOutcome(index, item, output=item.upper(), node_name="n"))
+            on_outcome(dataset.ItemOutcome(1, "item 1", output="DUPLICATE", node_name="n"))
+
+        dataset.run_batch = fake_run_batch
+
+        async def scenario():
+            dataset.resume_unfinished_jobs()
+            await dataset._RUNNING_JOBS[self.job_id]
+
+        asyncio.run(scenario())
+
+        self.assertEqual(ran, [1, 2, 4])
+        job = dataset.job_store.get(self.job_id)
+        self.assertEqual((job["status"], job["processed_items"], job["results_available"]), ("completed", 5, 5))
+        results = dataset.job_store.read_results(self.job_id, 0, 10)
+        self.assertEqual(sorted(r["index"] for r in results), [0, 1, 2, 3, 4])
+        self.assertEqual({r["index"]: r["output"] for r in results}[1], "ITEM 1")
+        self.assertEqual(dataset.aggregator_hubs[self.job_id].snapshot()["merges"]["concat"]["items"], 5)
+        self.assertFalse(os.path.exists(dataset.job_store.items_path(self.job_id)))  # 完成后删除数据项
+
+    def test_unexpected_error_fails_the_job(self):
+        """
+        测试: run_batch 抛出意外异常时任务标记为失败，并释放运行表、吞吐统计与数据项文件，而不是一直停在 processing。
+        """
+        print("    - 验证意外异常使任务失败...")
+
+        async def failing_run_batch(items, on_outcome, **options):
+            raise OSError("disk full")
+
+        dataset.run_batch = failing_run_batch
+
+        async def scenario():
+            dataset.resume_unfinished_jobs()
+            await dataset._RUNNING_JOBS[self.job_id]
+
+        asyncio.run(scenario())
+
+        job = dataset.job_store.get(self.job_id)
+        self.assertEqual((job["status"], job["error"]), ("failed", "disk full"))
+        self.assertNotIn(self.job_id, dataset._RUNNING_JOBS)
+        self.assertNotIn(self.job_id, dataset._BATCH_STATS)
+        self.assertFalse(os.path.exists(dataset.job_store.items_path(self.job_id)))
+
+    def test_aggregate_of_finished_job_survives_restart(self):
+        """
+        测试: 任务完成时保存最终聚合；重启后没有内存中的聚合中心，聚合端点返回保存的聚合，而不是重新合并（或发起新的节点请求）。
+        """
+        print("    - 验证重启后已完成任务的聚合...")
+
+        async def fake_run_batch(items, on_outcome, **options):
+            async for index, item in items:
+                on_outcome(dataset.ItemOutcome(index, item, output=item.upper(), node_name="n"))
+
+        dataset.run_batch = fake_run_batch
+
+        async def scenario():
+            dataset.resume_unfinished_jobs()
+            await dataset._RUNNING_JOBS[self.job_id]
+
+        asyncio.run(scenario())
+        dataset.aggregator_hubs.pop(self.job_id)
+        dataset.job_store = type(self.original_store)(self.directory)
+        dataset.job_store.load()
+
+        aggregate = asyncio.run(dataset.get_dataset_aggregate(self.job_id))
+        self.assertNotIn(self.job_id, dataset.aggregator_hubs)
+        self.assertEqual((aggregate["state"], aggregate["items_merged"], aggregate["processed_items"]), ("final", 5, 5))
+        self.assertEqual(aggregate["merges"]["concat"]["text"], "ITEM 0\n\nITEM 1\n\nITEM 2\n\nITEM 3\n\nITEM 4")
+
+        # 没有保存聚合的任务（例如失败的任务）返回 404，而不是重新计算
+        job_id = "failed-test-job"
+        dataset.job_store.create(job_id, status="failed", aggregate="concat")
+        for missing in (job_id, "no-such-job"):
+            with self.assertRaises(dataset.HTTPException) as raised:
+                asyncio.run(dataset.get_dataset_aggregate(missing))
+            self.assertEqual(raised.exception.status_code, 404)
+
+
+class TestDatasetMemo(unittest.TestCase):
+    """
+    对跨任务 memo 复用按模型区分的单元测试。
+    """
+
+    def setUp(self):
+        print(f"\n--- Setting up for {self.id()} ---")
+        self.original_store = dataset.job_store
+        self.original_memo = dataset.memo_store
+        self.original_run_batch = dataset.run_batch
+        self.directory = tempfile.mkdtemp(prefix="inferops-test-")
+        dataset.job_store = type(self.original_store)(self.directory)
+        dataset.memo_store = MemoStore(os.path.join(self.directory, "memo.sqlite"), max_bytes=1 << 20)
+
+    def tearDown(self):
+        dataset.job_store = self.original_store
+        dataset.memo_store = self.original_memo
+        dataset.run_batch = self.original_run_batch
+        for job_id in ("job-a", "job-b", "job-any"):
+            dataset.aggregator_hubs.pop(job_id, None)
+        shutil.rmtree(self.directory, ignore_errors=True)
+        print(f"--- Tearing down {self.id()} ---")
+
+    def run_job(self, job_id, model, node_model):
+        """运行一个只有一个数据项的任务，返回 run_batch 收到的 model 与 memo 查到的输出。"""
+        dataset.job_store.create(job_id, status="processing", total_items=1, aggregate="concat", dedupe=True, model=model)
+        with open(dataset.job_store.items_path(job_id), "w", encoding="utf-8") as f:
+            f.write(json.dumps("same prompt") + "\n")
+        seen = {}
+
+        async def fake_run_batch(items, on_outcome, model=None, memo=None, **options):
+            seen["model"] = model
+            seen["memo"] = memo(dataset.item_key("same prompt", model))
+            async for index, item in items:
+                on_outcome(dataset.ItemOutcome(index, item, output=f"from {node_model}", node_name="n", model=node_model))
+
+        dataset.run_batch = fake_run_batch
+
+        async def scenario():
+            dataset.resume_unfinished_jobs()
+            await dataset._RUNNING_JOBS[job_id]
+
+        asyncio.run(scenario())
+        return seen
+
+    def test_memo_entries_are_not_shared_between_models(self):
+        """
+        测试: memo 按产生输出的模型存储；另一个模型的任务查不到它，未指定模型的任务不查 memo，但其输出按节点的模型存入。
+        """
+        print("    - 验证 memo 按模型区分...")
+        self.assertEqual(self.run_job("job-a", "a", "a"), {"model": "a", "memo": None})
+        self.assertEqual(self.run_job("job-b", "b", "b"), {"model": "b", "memo": None})
+        self.assertEqual(self.run_job("job-any", None, "a"), {"model": None, "memo": None})
+
+        self.assertEqual(dataset.memo_store.get(dataset.item_key("same prompt", "a")), "from a")
+        self.assertEqual(dataset.memo_store.get(dataset.item_key("same prompt", "b")), "from b")
+        self.assertIsNone(dataset.memo_store.get(dataset.item_key("same prompt")))
+
+
+class TestDatasetUpload(unittest.TestCase):
+    """
+    对数据集上传被拒绝时清理任务的单元测试。
+    """
+
+    def setUp(self):
+        print(f"\n--- Setting up for {self.id()} ---")
+        self.original_store = dataset.job_store
+        self.original_run_batch = dataset.run_batch
+        self.directory = tempfile.mkdtemp(prefix="inferops-test-")
+        dataset.job_store = type(self.original_store)(self.directory)
+        dataset.job_store.add_evict_listener(dataset._forget_job)
+
+    def tearDown(self):
+        dataset.job_store = self.original_store
+        dataset.run_batch = self.original_run_batch
+        shutil.rmtree(self.directory, ignore_errors=True)
+        print(f"--- Tearing down {self.id()} ---")
+
+    def test_rejected_upload_leaves_no_job(self):
+        """
+        测试: 上传的数据集在处理开始后被判定无效时返回 400，已创建的任务被取消并连同文件一起删除，不留给 TTL 淘汰。
+        """
+        print("    - 验证无效上传不留下任务...")
+        started = []
+
+        async def fake_run_batch(items, on_outcome, **options):
+            started.append(True)
+            async for index, item in items:
+                on_outcome(dataset.ItemOutcome(index, item, output="ok", node_name="n"))
+
+        dataset.run_batch = fake_run_batch
+        chunks = [b'["first item", ', b'"second item", {broken']
+
+        async def receive():
+            if chunks:
+                await asyncio.sleep(0.01)
+                return {"type": "http.request", "body": chunks.pop(0), "more_body": bool(chunks)}
+            await asyncio.sleep(3600)
+
+        request = dataset.Request({"type": "http", "method": "POST", "headers": [], "query_string": b""}, receive)
+
+        async def scenario():
+            with self.assertRaises(dataset.HTTPException) as raised:
+                await dataset.upload_dataset(request)
+            return raised.exception
+
+        error = asyncio.run(scenario())
+        self.assertEqual(error.status_code, 400)
+        self.assertTrue(started)  # 任务在上传完成前已开始
+        self.assertEqual(dataset.job_store.job_ids(), [])
+        self.assertEqual(os.listdir(self.directory), [])
+        self.assertEqual(dataset._RUNNING_JOBS, {})
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,103 @@
+# tests/test_disconnect.py
+
+import asyncio
+import unittest
+
+# 假设可以从 gateway 模块导入
+from services.disconnect import until_disconnect, cancel_on_disconnect, record_abandoned_generation
+from services.disconnect import DISCONNECTS, GPU_SECONDS_SAVED, HTTPException
+from services.disconnect import scheduler_index
+
+
+class FakeRequest:
+    """模拟一个在 `disconnect` 事件触发后断开的 ASGI 连接。"""
+
+    def __init__(self):
+        self.disconnect = asyncio.Event()
+
+    async def receive(self):
+        await self.disconnect.wait()
+        return {"type": "http.disconnect"}
+
+
+class TestDisconnect(unittest.TestCase):
+    """
+    对客户端断开连接处理的单元测试。
+    """
+
+    def setUp(self):
+        print(f"\n--- Setting up for {self.id()} ---")
+
+    def tearDown(self):
+        print(f"--- Tearing down {self.id()} ---")
+
+    def test_body_is_cancelled_on_disconnect(self):
+        """
+        测试: 响应体等待下一个 token 时客户端断开，响应体立即被取消并执行清理，外层流正常结束。
+        """
+        print("    - 验证断开连接时立即取消上游...")
+
+        async def scenario():
+            request = FakeRequest()
+            cleaned_up = asyncio.Event()
+
+            async def body():
+                try:
+                    yield "first"
+                    await asyncio.sleep(100)  # 等待一个永远不会到来的 token
+                    yield "never"
+                finally:
+                    cleaned_up.set()
+
+            async def consume():
+                return [chunk async for chunk in until_disconnect(request, body())]
+
+            consumer = asyncio.ensure_future(consume())
+            await asyncio.sleep(0.01)
+            request.disconnect.set()
+            self.assertEqual(await asyncio.wait_for(consumer, 1), ["first"])
+            self.assertTrue(cleaned_up.is_set())
+
+        asyncio.run(scenario())
+
+    def test_only_queue_waits_count_as_queued(self):
+        """
+        测试: 排队等待被取消时计为 queued；收集流（由生成器自己计数）被取消时不重复计数。
+        """
+        print("    - 验证断开连接只计数一次...")
+
+        async def cancelled(queued):
+            request = FakeRequest()
+            work = asyncio.ensure_future(cancel_on_disconnect(request, asyncio.sleep(100), queued=queued))
+            await asyncio.sleep(0.01)
+            request.disconnect.set()
+            with self.assertRaises(HTTPException):
+                await asyncio.wait_for(work, 1)
+
+        before = DISCONNECTS.value(stage="queued")
+        asyncio.run(cancelled(queued=True))
+        self.assertEqual(DISCONNECTS.value(stage="queued") - before, 1)
+        asyncio.run(cancelled(queued=False))
+        self.assertEqual(DISCONNECTS.value(stage="queued") - before, 1)
+
+    def test_gpu_seconds_saved_estimate(self):
+        """
+        测试: 节省的 GPU 时间按节点的解码速率估算剩余的生成时间。
+        """
+        print("    - 验证节省的 GPU 时间估算...")
+        node = {"id": 961, "name": "Disconnect Test Node", "static_weight": 1.0, "max_concurrency": 1}
+        scheduler_index.update_node(node, online=True, metrics={"locked": False, "model_id": "m", "gpu": {}, "memory": {}})
+        try:
+            self.assertEqual(record_abandoned_generation(961, 10), 0.0)  # 尚无延迟统计
+
+            scheduler_index.observe_latency(961, ttft=1.0, tokens_per_sec=50.0)
+            before = GPU_SECONDS_SAVED.value()
+            saved = record_abandoned_generation(961, 56)  # 默认预期输出 256 个 token，还剩 200 个
+            self.assertAlmostEqual(saved, 4.0)
+            self.assertAlmostEqual(GPU_SECONDS_SAVED.value() - before, 4.0)
+        finally:
+            scheduler_index.remove_node(961)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
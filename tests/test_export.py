@@ -0,0 +1,73 @@
+# tests/test_export.py
+
+import csv
+import importlib.util
+import io
+import json
+import unittest
+
+# 假设可以从 gateway 模块导入
+from services.export import export_results, format_available
+
+RESULTS = [
+    {"index": 0, "original": {"prompt": "你好"}, "output": "Hello", "node": "n1"},
+    {"index": 2, "original": "a, \"quoted\"\nline", "output": "x", "node": "n2"},
+    {"index": 1, "original": 42, "output": None, "node": "n1", "error": "HTTPStatusError: 500"},
+]
+PAGES = [RESULTS[:2], RESULTS[2:]]
+
+
+class TestExport(unittest.TestCase):
+    """
+    对任务结果导出格式的单元测试。
+    """
+
+    def setUp(self):
+        print(f"\n--- Setting up for {self.id()} ---")
+
+    def tearDown(self):
+        print(f"--- Tearing down {self.id()} ---")
+
+    def test_jsonl_and_csv(self):
+        """
+        测试: JSONL 与 CSV 导出按页逐块生成，内容可以被还原（CSV 中非字符串的 original 为其 JSON 文本）。
+        """
+        print("    - 验证 JSONL 与 CSV 导出...")
+        chunks = list(export_results("jsonl", iter(PAGES)))
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual([json.loads(line) for line in b"".join(chunks).decode("utf-8").splitlines()], RESULTS)
+
+        chunks = list(export_results("csv", iter(PAGES)))
+        self.assertEqual(len(chunks), 2)
+        rows = list(csv.DictReader(io.StringIO(b"".join(chunks).decode("utf-8"))))
+        self.assertEqual([row["index"] for row in rows], ["0", "2", "1"])
+        self.assertEqual(json.loads(rows[0]["original"]), {"prompt": "你好"})
+        self.assertEqual(rows[1]["original"], "a, \"quoted\"\nline")
+        self.assertEqual((rows[2]["output"], rows[2]["error"]), ("", "HTTPStatusError: 500"))
+
+        # 续传时不重复表头；没有结果时只有表头
+        self.assertFalse(b"".join(export_results("csv", iter(PAGES[1:]), header=False)).startswith(b"index"))
+        self.assertEqual(b"".join(export_results("csv", iter([]))).decode("utf-8").strip(), "index,node,output,error,original")
+
+        with self.assertRaises(ValueError):
+            export_results("xml", iter(PAGES))
+
+    @unittest.skipUnless(importlib.util.find_spec("pyarrow"), "pyarrow is not installed")
+    def test_parquet(self):
+        """
+        测试: Parquet 导出每页一个行组，拼接后的字节是完整的 Parquet 文件。
+        """
+        print("    - 验证 Parquet 导出...")
+        import pyarrow.parquet as pq
+
+        self.assertTrue(format_available("parquet"))
+        data = b"".join(export_results("parquet", iter(PAGES)))
+        parquet = pq.ParquetFile(io.BytesIO(data))
+        self.assertEqual(parquet.metadata.num_row_groups, 2)
+        table = parquet.read()
+        self.assertEqual(table.column("index").to_pylist(), [0, 2, 1])
+        self.assertEqual(table.column("error").to_pylist(), [None, None, "HTTPStatusError: 500"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,140 @@
+# tests/test_health.py
+
+import asyncio
+import json
+import unittest
+
+import httpx
+
+# 假设可以从 gateway 模块导入
+from core import health
+
+state = health.state
+settings = health.settings
+
+
+def line(message):
+    return json.dumps(message).encode("utf-8") + b"\n"
+
+
+class TestTelemetryPush(unittest.TestCase):
+    """
+    对节点代理推送遥测（快照、增量、心跳与超时下线）的单元测试。
+    """
+
+    def setUp(self):
+        print(f"\n--- Setting up for {self.id()} ---")
+        self.node = {"id": 990, "name": "Telemetry Test Node", "llm_url": "http://telemetry-node:11434/api/chat",
+                     "monitor_base_url": "http://telemetry-node:8001", "static_weight": 1.0, "max_concurrency": 2}
+        self.metrics = {"locked": False, "slots_total": 2, "slots_in_use": 0, "leases_in_use": 0,
+                        "model_id": "m", "cpu_usage_percent": 5.0, "gpu": {}, "memory": {"percent": 10}}
+        state.initialize_state([self.node])
+        health.node_clients.transport = httpx.MockTransport(lambda request: httpx.Response(200, json={}))
+        self.timeout = settings.TELEMETRY_HEARTBEAT_TIMEOUT
+
+    def tearDown(self):
+        settings.TELEMETRY_HEARTBEAT_TIMEOUT = self.timeout
+        asyncio.run(health.node_clients.aclose())
+        health.node_clients.transport = None
+        health.scheduler_index.remove_node(self.node["id"])
+        state.NODE_STATUS_CACHE.pop(self.node["id"], None)
+        print(f"--- Tearing down {self.id()} ---")
+
+    def test_snapshot_deltas_and_heartbeats(self):
+        """
+        测试: 推送的快照使节点上线，增量只更新变化的字段，心跳不改变指标；推送期间该节点不被轮询。
+        """
+        print("    - 验证快照、增量与心跳...")
+        pushing = []
+
+        async def stream():
+            snapshot = line({"full": True, "metrics": self.metrics})
+            yield snapshot[:10]  # 消息可以跨越多个分块
+            yield snapshot[10:] + line({"metrics": {"slots_in_use": 2, "locked": True}})
+            pushing.append(self.node["id"] in health._pushing)
+            self.assertEqual(health.scheduler_index.free_slots(self.node["id"]), 0)
+            yield line({}) + line({"metrics": {"slots_in_use": 1, "locked": False}})
+
+        received = asyncio.run(health.receive_telemetry(self.node, stream()))
+        self.assertEqual(received, 4)
+        self.assertEqual(pushing, [True])
+        self.assertNotIn(self.node["id"], health._pushing)  # 流结束后恢复轮询
+
+        status = state.NODE_STATUS_CACHE[self.node["id"]]
+        self.assertTrue(status["online"])
+        self.assertEqual(status["metrics"], dict(self.metrics, slots_in_use=1))
+        self.assertEqual(health.scheduler_index.free_slots(self.node["id"]), 1)
+
+        with self.assertRaises(ValueError):
+            asyncio.run(health.receive_telemetry(self.node, self._chunks(line({"metrics": {"locked": True}}))))
+
+    def test_node_goes_offline_when_heartbeat_stops(self):
+        """
+        测试: 推送流停止发送心跳超过超时时间后，节点被标记为离线并移出调度池。
+        """
+        print("    - 验证心跳超时下线...")
+        settings.TELEMETRY_HEARTBEAT_TIMEOUT = 0.05
+
+        async def stalled():
+            yield line({"full": True, "metrics": self.metrics})
+            await asyncio.sleep(10)
+            yield line({})
+
+        received = asyncio.run(health.receive_telemetry(self.node, stalled()))
+        self.assertEqual(received, 1)
+        self.assertFalse(state.NODE_STATUS_CACHE[self.node["id"]]["online"])
+        self.assertEqual(health.scheduler_index.free_slots(self.node["id"]), 0)
+        self.assertNotIn(self.node["id"], health._pushing)
+
+    def test_reconnected_agent_fences_the_old_stream(self):
+        """
+        测试: 代理重连后，旧推送流上迟到的增量被丢弃，旧流随即结束。
+        """
+        print("    - 验证旧推送流被新流取代...")
+
+        async def scenario():
+            reconnected = asyncio.Event()
+
+            async def old_stream():
+                yield line({"full": True, "metrics": self.metrics})
+                await reconnected.wait()
+                yield line({"metrics": {"slots_in_use": 2}})
+
+            async def new_stream():
+                yield line({"full": True, "metrics": dict(self.metrics, slots_in_use=1)})
+                reconnected.set()
+                await asyncio.sleep(0.05)  # 旧流在此期间收到迟到的增量
+                yield line({})
+
+            old = asyncio.ensure_future(health.receive_telemetry(self.node, old_stream()))
+            await asyncio.sleep(0.01)  # 旧流的快照先被应用
+            generation = health._pushing[self.node["id"]]
+            new_received = await health.receive_telemetry(self.node, new_stream())
+            self.assertNotEqual(health._pushing.get(self.node["id"]), generation)
+            return await old, new_received
+
+        old_received, new_received = asyncio.run(scenario())
+        self.assertEqual(old_received, 1)
+        self.assertEqual(new_received, 2)
+        self.assertEqual(state.NODE_STATUS_CACHE[self.node["id"]]["metrics"]["slots_in_use"], 1)
+        self.assertNotIn(self.node["id"], health._pushing)
+
+    def test_is_node_address(self):
+        """
+        测试: 只有节点配置的 URL 所对应的地址才被视为该节点（含 IPv4 映射的 IPv6 地址）。
+        """
+        print("    - 验证推送来源地址检查...")
+        node = dict(self.node, llm_url="http://127.0.0.1:11434/api/chat", monitor_base_url="http://127.0.0.1:8001")
+        self.assertTrue(asyncio.run(health.is_node_address(node, "127.0.0.1")))
+        self.assertTrue(asyncio.run(health.is_node_address(node, "::ffff:127.0.0.1")))
+        self.assertFalse(asyncio.run(health.is_node_address(node, "10.0.0.9")))
+        self.assertFalse(asyncio.run(health.is_node_address(node, "not-an-ip")))
+
+    @staticmethod
+    async def _chunks(*chunks):
+        for chunk in chunks:
+            yield chunk
+
+
+if __name__ == "__main__":
+    unittest.main()
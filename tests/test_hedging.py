@@ -0,0 +1,91 @@
+# tests/test_hedging.py
+
+import asyncio
+import unittest
+
+# 假设可以从 gateway 模块导入
+from services.hedging import HedgeBudget, race_with_hedge
+
+
+class TestHedging(unittest.TestCase):
+    """
+    对对冲请求 (hedged requests) 机制的单元测试。
+    """
+
+    def setUp(self):
+        print(f"\n--- Setting up for {self.id()} ---")
+
+    def tearDown(self):
+        print(f"--- Tearing down {self.id()} ---")
+
+    def test_budget_caps_hedges(self):
+        """
+        测试: 对冲预算按流量比例累积，5% 的预算下每 20 个请求才允许一次对冲。
+        """
+        print("    - 验证对冲预算...")
+        budget = HedgeBudget(percent=5.0)
+        self.assertFalse(budget.try_spend())
+
+        for _ in range(20):
+            budget.record_request()
+        self.assertTrue(budget.try_spend())
+        self.assertFalse(budget.try_spend())
+
+        budget.refund()
+        self.assertTrue(budget.try_spend())
+
+    def test_hedge_wins_and_primary_is_cancelled(self):
+        """
+        测试: 主请求超过延迟仍未返回时发出对冲请求；对冲先完成则胜出，主请求被取消。
+        """
+        print("    - 验证对冲请求胜出与败者取消...")
+        budget = HedgeBudget(percent=100.0)
+        budget.record_request()
+
+        async def scenario():
+            primary_cancelled = asyncio.Event()
+
+            async def slow():
+                try:
+                    await asyncio.sleep(10)
+                except asyncio.CancelledError:
+                    primary_cancelled.set()
+                    raise
+
+            async def fast():
+                return "hedge"
+
+            async def discard(_index, _result):
+                self.fail("没有需要丢弃的结果")
+
+            winner, result = await race_with_hedge(slow(), 0.01, fast, discard, budget=budget)
+            self.assertEqual((winner, result), (1, "hedge"))
+            self.assertTrue(primary_cancelled.is_set())
+
+        asyncio.run(scenario())
+
+    def test_no_hedge_without_budget(self):
+        """
+        测试: 预算耗尽时不发出对冲请求，仍等待主请求的结果。
+        """
+        print("    - 验证预算耗尽时不对冲...")
+        budget = HedgeBudget(percent=5.0)
+
+        async def scenario():
+            async def primary():
+                await asyncio.sleep(0.02)
+                return "primary"
+
+            def launch():
+                self.fail("预算耗尽时不应发出对冲请求")
+
+            async def discard(_index, _result):
+                pass
+
+            self.assertEqual(await race_with_hedge(primary(), 0.001, launch, discard, budget=budget), (0, "primary"))
+
+        asyncio.run(scenario())
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
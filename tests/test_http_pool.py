@@ -0,0 +1,91 @@
+# tests/test_http_pool.py
+
+import asyncio
+import unittest
+
+import httpx
+
+# 假设可以从 gateway 模块导入
+from services.http_pool import NodeClientRegistry, POOL_SATURATED, POOL_WARMED
+
+
+class OpenStream(httpx.AsyncByteStream):
+    """一个流式响应体，在客户端关闭之前一直占用连接。"""
+
+    async def __aiter__(self):
+        yield b"ok"
+
+
+class TestNodeClientRegistry(unittest.TestCase):
+    """
+    对按节点划分的 HTTP 连接池的单元测试。
+    """
+
+    def setUp(self):
+        print(f"\n--- Setting up for {self.id()} ---")
+        self.node = {"id": 951, "name": "Pool Test Node", "llm_url": "http://pool-node:11434/api/chat",
+                     "monitor_base_url": "http://pool-node:8001", "max_concurrency": 1}
+
+    def tearDown(self):
+        print(f"--- Tearing down {self.id()} ---")
+
+    def test_clients_are_per_node(self):
+        """
+        测试: 每个节点拥有独立的客户端，LLM 与监控代理使用不同的连接池。
+        """
+        print("    - 验证客户端按节点隔离...")
+        registry = NodeClientRegistry(transport=httpx.MockTransport(lambda request: httpx.Response(200)))
+        other = dict(self.node, id=952)
+        self.assertIs(registry.llm(self.node), registry.llm(self.node))
+        self.assertIsNot(registry.llm(self.node), registry.llm(other))
+        self.assertIsNot(registry.llm(self.node), registry.monitor(self.node))
+
+    def test_usage_and_saturation(self):
+        """
+        测试: 连接池统计正在使用的连接数；所有连接都忙时记录一次饱和。
+        """
+        print("    - 验证连接池使用量与饱和统计...")
+
+        async def scenario():
+            registry = NodeClientRegistry(transport=httpx.MockTransport(lambda request: httpx.Response(200, stream=OpenStream())))
+            client = registry.llm(self.node)
+            saturated_before = POOL_SATURATED.value(node="951", pool="llm")
+
+            responses = [await client.send(client.build_request("GET", "http://pool-node:11434/"), stream=True)
+                         for _ in range(4)]
+            in_use, limit = registry.pool_usage(self.node["id"])
+            self.assertEqual(in_use, 4)
+            self.assertEqual(limit, 3)  # 1 个并发槽位 + 2 个备用连接
+            self.assertEqual(POOL_SATURATED.value(node="951", pool="llm") - saturated_before, 1)
+
+            for response in responses:
+                await response.aclose()
+            self.assertEqual(registry.pool_usage(self.node["id"]), (0, 3))
+            await registry.aclose()
+
+        asyncio.run(scenario())
+
+    def test_warm_up(self):
+        """
+        测试: 预热为每个并发槽位向 Ollama 的 /api/version 发起一次请求。
+        """
+        print("    - 验证连接预热...")
+        seen = []
+
+        def handler(request):
+            seen.append(str(request.url))
+            return httpx.Response(200, json={"version": "0.1"})
+
+        async def scenario():
+            registry = NodeClientRegistry(transport=httpx.MockTransport(handler))
+            node = dict(self.node, id=953, max_concurrency=2)
+            await registry.warm_up(node)
+            self.assertEqual(seen, ["http://pool-node:11434/api/version"] * 2)
+            self.assertEqual(POOL_WARMED.value(node="953"), 2)
+            self.assertEqual(registry.pool_usage(953), (0, 4))
+
+        asyncio.run(scenario())
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,179 @@
+# tests/test_job_store.py
+
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+# 假设可以从 gateway 模块导入
+from services import job_store as job_store_module
+from services.job_store import JobStore, ResultLog
+
+settings = job_store_module.settings
+
+
+def make_result(i, error=None):
+    result = {"index": i, "original": {"prompt": f"问题 {i}"}, "output": None if error else f"回答 {i}", "node": "n"}
+    if error:
+        result["error"] = error
+    return result
+
+
+class TestJobStore(unittest.TestCase):
+    """
+    对磁盘任务存储（结果日志、重启加载与淘汰）的单元测试。
+    """
+
+    def setUp(self):
+        print(f"\n--- Setting up for {self.id()} ---")
+        self.directory = tempfile.mkdtemp(prefix="inferops-test-")
+        self.original_settings = (settings.JOB_STORE_TTL, settings.JOB_STORE_MAX_BYTES, settings.JOB_STORE_HOT_RESULTS,
+                                  settings.JOB_STORE_MIN_RETENTION)
+
+    def tearDown(self):
+        (settings.JOB_STORE_TTL, settings.JOB_STORE_MAX_BYTES, settings.JOB_STORE_HOT_RESULTS,
+         settings.JOB_STORE_MIN_RETENTION) = self.original_settings
+        shutil.rmtree(self.directory, ignore_errors=True)
+        print(f"--- Tearing down {self.id()} ---")
+
+    def test_reads_across_hot_results_and_disk(self):
+        """
+        测试: 结果日志只在内存中保留最新的结果，更早的结果从磁盘读取，任意游标读出的结果都正确。
+        """
+        print("    - 验证内存尾部与磁盘读取的一致性...")
+        log = ResultLog(self.directory, hot_results=3)
+        expected = [make_result(i) for i in range(10)]
+        for i, result in enumerate(expected):
+            self.assertEqual(log.append(result), i)
+            # 写入过程中读取已写入的结果（需要重新映射文件）
+            self.assertEqual(log.read(0, i + 1), expected[:i + 1])
+
+        self.assertEqual(len(log._hot), 3)
+        for start in range(11):
+            for limit in (1, 4, 20):
+                self.assertEqual(log.read(start, limit), expected[start:start + limit], f"start {start}, limit {limit}")
+
+        log.seal()
+        self.assertEqual(log.read(0, 20), expected)  # 封存后全部从磁盘读取
+        log.close()
+
+        with open(os.path.join(self.directory, "results.jsonl"), encoding="utf-8") as f:
+            self.assertEqual([json.loads(line) for line in f], expected)
+
+    def test_partial_write_is_dropped_on_reopen(self):
+        """
+        测试: 网关在写入结果时停止，重新打开结果日志会丢弃未写入索引的半条结果，之后的追加与读取正常。
+        """
+        print("    - 验证结果日志的崩溃恢复...")
+        log = ResultLog(self.directory, hot_results=0)
+        log.append(make_result(0))
+        log.append(make_result(1))
+        log.close()
+        with open(os.path.join(self.directory, "results.jsonl"), "ab") as f:
+            f.write(b'{"index": 2, "orig')  # 结果写了一半，索引尚未写入
+        with open(os.path.join(self.directory, "results.idx"), "ab") as f:
+            f.write(b"\x00\x01")  # 索引项写了一半
+
+        log = ResultLog(self.directory, hot_results=0)
+        self.assertEqual(log.count, 2)
+        self.assertEqual(log.append(make_result(2)), 2)
+        self.assertEqual(log.read(0, 10), [make_result(i) for i in range(3)])
+        log.close()
+
+    def test_unfinished_jobs_are_queued_on_load(self):
+        """
+        测试: 重启后加载磁盘上的任务；未完成的任务重新排队等待恢复，计数从结果文件重建；上传被中断的任务被标记为失败。
+        """
+        print("    - 验证重启后的任务加载...")
+        store = JobStore(self.directory)
+        store.create("done", status="processing", total_items=1)
+        store.append_result("done", make_result(0))
+        store.update("done", status="completed")
+        store.create("running", status="processing", total_items=5)
+        store.append_result("running", make_result(0))
+        store.append_result("running", make_result(1, error="HTTPStatusError: 500"), failed=True)
+        store.create("uploading", status="processing", ingesting=True)
+
+        restarted = JobStore(self.directory)
+        restarted.load()
+        self.assertEqual(sorted(restarted.job_ids()), ["done", "running", "uploading"])
+        self.assertEqual(restarted.unfinished_job_ids(), ["running"])
+
+        done = restarted.get("done")
+        self.assertEqual(done["status"], "completed")
+        self.assertEqual(done["results_available"], 1)
+
+        running = restarted.get("running")
+        self.assertEqual(running["status"], "queued")
+        self.assertEqual((running["total_items"], running["processed_items"], running["failed_items"]), (5, 2, 1))
+        self.assertEqual(restarted.read_results("running", 0, 10), [make_result(0), make_result(1, "HTTPStatusError: 500")])
+        restarted.append_result("running", make_result(2))  # 恢复的任务可以继续写入结果
+        self.assertEqual(restarted.result_count("running"), 3)
+
+        uploading = restarted.get("uploading")
+        self.assertEqual(uploading["status"], "failed")
+        self.assertIsNotNone(uploading["error"])
+
+    def test_eviction_by_ttl_and_size(self):
+        """
+        测试: 已结束的任务过期或总大小超出预算时被淘汰（最早结束的优先），运行中的任务不会被淘汰。
+        """
+        print("    - 验证按 TTL 与大小淘汰任务...")
+        settings.JOB_STORE_TTL = float("inf")
+        settings.JOB_STORE_MAX_BYTES = 10 ** 9
+        settings.JOB_STORE_MIN_RETENTION = 0
+        store = JobStore(self.directory)
+        evicted = []
+        store.add_evict_listener(evicted.append)
+
+        for job_id, end_time in (("old", 1000.0), ("newer", 1050.0), ("newest", 1080.0)):
+            store.create(job_id, status="processing")
+            store.append_result(job_id, make_result(0))
+            store.update(job_id, status="completed", end_time=end_time)
+        store.create("running", status="processing", start_time=0.0)
+        store.append_result("running", make_result(0))
+
+        settings.JOB_STORE_TTL = 100
+        self.assertEqual(store.evict(now=1120.0), ["old"])
+        self.assertFalse(os.path.exists(os.path.join(self.directory, "old")))
+        self.assertIsNone(store.get("old"))
+        self.assertEqual(store.read_results("old", 0, 10), [])
+
+        # 超出大小预算：淘汰最早结束的任务，直到剩余的已结束任务不超过预算
+        settings.JOB_STORE_MAX_BYTES = os.path.getsize(os.path.join(self.directory, "newest", "results.jsonl"))
+        self.assertEqual(store.evict(now=1120.0), ["newer"])
+        self.assertEqual(sorted(store.job_ids()), ["newest", "running"])
+
+        self.assertEqual(store.evict(now=float("inf")), ["newest"])
+        self.assertEqual(store.job_ids(), ["running"])
+        self.assertEqual(evicted, ["old", "newer", "newest"])
+
+    def test_over_budget_job_is_kept_for_min_retention(self):
+        """
+        测试: 单个超出大小预算的任务结束后不会立即被淘汰，保留到最短保留期结束（或 TTL 先到期）后才删除。
+        """
+        print("    - 验证超出预算的任务的最短保留期...")
+        settings.JOB_STORE_TTL = float("inf")
+        settings.JOB_STORE_MAX_BYTES = 1
+        settings.JOB_STORE_MIN_RETENTION = 600
+        store = JobStore(self.directory)
+
+        store.create("big", status="processing")
+        store.append_result("big", make_result(0))
+        end_time = time.time()
+        store.update("big", status="completed", end_time=end_time)  # 结束时的淘汰不会删除它
+        self.assertEqual(store.read_results("big", 0, 10)[0]["output"], "回答 0")
+        self.assertEqual(store.evict(now=end_time + 300), [])
+        self.assertEqual(store.evict(now=end_time + 600), ["big"])
+
+        # TTL 比保留期短时按 TTL 淘汰
+        settings.JOB_STORE_TTL = 100
+        store.create("short", status="processing")
+        store.update("short", status="completed", end_time=end_time)
+        self.assertEqual(store.evict(now=end_time + 100), ["short"])
+
+
+if __name__ == "__main__":
+    unittest.main()
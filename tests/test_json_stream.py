@@ -0,0 +1,219 @@
+# tests/test_json_stream.py
+
+import asyncio
+import json
+import unittest
+
+# 假设可以从 gateway 模块导入
+from utils import json_stream
+from utils.json_stream import JSONItemParser, DatasetFormatError
+from services import ingest
+from services.ingest import DatasetSpool, upload_parts
+
+
+def parse_in_chunks(data: bytes, size: int):
+    parser = JSONItemParser()
+    items = []
+    for i in range(0, len(data), size):
+        items.extend(parser.feed(data[i:i + size]))
+    items.extend(parser.close())
+    return parser, items
+
+
+class TestJSONItemParser(unittest.TestCase):
+    """
+    对数据集增量解析器的单元测试。
+    """
+
+    def setUp(self):
+        print(f"\n--- Setting up for {self.id()} ---")
+
+    def tearDown(self):
+        print(f"--- Tearing down {self.id()} ---")
+
+    def test_array_and_jsonl_in_any_chunking(self):
+        """
+        测试: JSON 数组与 JSON Lines 无论如何分块（包括切开多字节字符和数字）都能解析出相同的数据项。
+        """
+        print("    - 验证数组与 JSONL 的增量解析...")
+        expected = [{"prompt": "你好"}, "text", 12345, [1, 2], None, {"nested": {"a": [True, 1.5]}}]
+        uploads = {
+            "array": ("\ufeff" + json.dumps(expected, ensure_ascii=False, indent=2)).encode("utf-8"),
+            "jsonl": "\n".join(json.dumps(item, ensure_ascii=False) for item in expected).encode("utf-8"),
+        }
+        for fmt, data in uploads.items():
+            for size in (1, 2, 5, 64, len(data)):
+                parser, items = parse_in_chunks(data, size)
+                self.assertEqual(parser.format, fmt)
+                self.assertEqual(items, expected, f"{fmt}, chunk size {size}")
+
+        self.assertEqual(parse_in_chunks(b"[ ]", 1)[1], [])
+
+    def test_items_are_returned_as_they_complete(self):
+        """
+        测试: 每个数据项一旦完整到达就被返回，不必等待上传结束。
+        """
+        print("    - 验证数据项的及时返回...")
+        parser = JSONItemParser()
+        self.assertEqual(parser.feed(b'[{"a": 1}, {"b"'), [{"a": 1}])
+        self.assertEqual(parser.feed(b': 2}, 3'), [{"b": 2}])
+        self.assertEqual(parser.feed(b']'), [3])
+        self.assertEqual(parser.close(), [])
+
+    def test_long_item_is_decoded_once(self):
+        """
+        测试: 跨越许多分块的数据项只扫描新到的分块，完整到达后才解码，而不是每个分块都重新解码整个缓冲区。
+        """
+        print("    - 验证长数据项的增量扫描...")
+        item = {"text": 'escaped \\ "quotes" and ]} brackets ' * 200, "n": [1, {"x": "]"}]}
+        data = (json.dumps(item) + "\n" + json.dumps(item)).encode("utf-8")
+        decoder = json_stream._DECODER
+        calls = []
+
+        class CountingDecoder:
+            def raw_decode(self, text, pos):
+                calls.append(pos)
+                return decoder.raw_decode(text, pos)
+
+        json_stream._DECODER = CountingDecoder()
+        try:
+            parser, items = parse_in_chunks(data, 7)
+        finally:
+            json_stream._DECODER = decoder
+        self.assertEqual(items, [item, item])
+        self.assertLessEqual(len(calls), 4)  # 每个数据项: 第一个分块尝试一次，完整后一次
+
+    def test_invalid_uploads(self):
+        """
+        测试: 语法错误、未结束的数组、数组后多余的数据、空上传以及超长的数据项都会被拒绝。
+        """
+        print("    - 验证无效上传的检测...")
+        for data in (b'[{"a": 1} {"b": 2}]', b'[{"a": 1},', b'[1] [2]', b'{"a": }', b"", b"\xff[]"):
+            with self.assertRaises(DatasetFormatError, msg=data):
+                parse_in_chunks(data, 3)
+
+        with self.assertRaises(DatasetFormatError):
+            JSONItemParser(max_item_bytes=16).feed(b'["' + b"x" * 32)
+
+
+class TestDatasetSpool(unittest.TestCase):
+    """
+    对上传数据暂存文件的单元测试。
+    """
+
+    def setUp(self):
+        print(f"\n--- Setting up for {self.id()} ---")
+
+    def tearDown(self):
+        print(f"--- Tearing down {self.id()} ---")
+
+    def test_reader_follows_the_upload(self):
+        """
+        测试: 读取端在上传仍在进行时就能读到已写入的数据项，并在数量上限处提前结束。
+        """
+        print("    - 验证边上传边读取与数量上限...")
+
+        async def scenario():
+            spool = DatasetSpool()
+            try:
+                reader = spool.items()
+                spool.append([{"i": 0}])
+                self.assertEqual(await asyncio.wait_for(reader.__anext__(), 1), {"i": 0})
+
+                pending = asyncio.ensure_future(reader.__anext__())
+                await asyncio.sleep(0.01)
+                self.assertFalse(pending.done())  # 等待更多数据
+                spool.append([{"i": 1}, {"i": 2}])
+                self.assertEqual(await asyncio.wait_for(pending, 1), {"i": 1})
+
+                spool.limit = 2  # 在写入之后才知道的 data_count
+                spool.append([{"i": 3}])
+                spool.finish()
+                self.assertEqual([item async for item in reader], [])
+                self.assertEqual(spool.count, 2)
+                await reader.aclose()
+            finally:
+                spool.close()
+
+        asyncio.run(scenario())
+
+    def test_upload_error_reaches_the_reader(self):
+        """
+        测试: 上传失败时，读取端在读完已有的数据项后抛出该错误。
+        """
+        print("    - 验证上传错误的传递...")
+
+        async def scenario():
+            spool = DatasetSpool()
+            try:
+                spool.append(["a"])
+                spool.finish(DatasetFormatError("boom"))
+                items = []
+                with self.assertRaises(DatasetFormatError):
+                    async for item in spool.items():
+                        items.append(item)
+                self.assertEqual(items, ["a"])
+            finally:
+                spool.close()
+
+        asyncio.run(scenario())
+
+
+class FakeUpload:
+    """只提供 upload_parts 所需的请求头与分块读取的请求。"""
+
+    def __init__(self, body: bytes, boundary: str = "XyZ"):
+        self.headers = {"content-type": f"multipart/form-data; boundary={boundary}"}
+        self.body = body
+
+    async def stream(self):
+        for i in range(0, len(self.body), 1000):
+            yield self.body[i:i + 1000]
+
+
+def multipart(*fields, boundary: str = "XyZ") -> bytes:
+    body = b""
+    for name, value in fields:
+        body += (f"--{boundary}\r\nContent-Disposition: form-data; name=\"{name}\"\r\n\r\n").encode() + value + b"\r\n"
+    return body + f"--{boundary}--\r\n".encode()
+
+
+class TestUploadParts(unittest.TestCase):
+    """
+    对多部分表单上传拆分的单元测试。
+    """
+
+    def setUp(self):
+        print(f"\n--- Setting up for {self.id()} ---")
+
+    def tearDown(self):
+        print(f"--- Tearing down {self.id()} ---")
+
+    def collect(self, body: bytes):
+        async def scenario():
+            parts = {}
+            async for name, data in upload_parts(FakeUpload(body)):
+                parts[name] = parts.get(name, b"") + data
+            return parts
+        return asyncio.run(scenario())
+
+    def test_form_fields_are_capped(self):
+        """
+        测试: 数据集文件不受限制，而其他表单字段单个或合计超过上限时被拒绝。
+        """
+        print("    - 验证表单字段的大小上限...")
+        dataset = b"[" + b",".join([b'"item"'] * 5000) + b"]"
+        parts = self.collect(multipart(("data_count", b"10"), ("file", dataset)))
+        self.assertEqual(parts, {"data_count": b"10", "file": dataset})
+
+        with self.assertRaises(ingest.DatasetFormatError):
+            self.collect(multipart(("aggregate", b"x" * (ingest.MAX_FIELD_BYTES + 1)), ("file", b"[]")))
+        # 多个各自未超限的字段（包括未知字段）合计超过总上限
+        count = ingest.MAX_FIELDS_BYTES // ingest.MAX_FIELD_BYTES + 1
+        fields = [(f"extra{i}", b"x" * ingest.MAX_FIELD_BYTES) for i in range(count)]
+        with self.assertRaises(ingest.DatasetFormatError):
+            self.collect(multipart(*fields, ("file", b"[]")))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
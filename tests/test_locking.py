@@ -0,0 +1,92 @@
+# tests/test_locking.py
+
+import asyncio
+import unittest
+
+import httpx
+
+# 假设可以从 gateway 模块导入
+from services import locking
+
+
+class TestLeases(unittest.TestCase):
+    """
+    对网关本地租约 (lease) 机制的单元测试。
+    """
+
+    def setUp(self):
+        """注册一个拥有 2 个并发槽位的节点。"""
+        print(f"\n--- Setting up for {self.id()} ---")
+        self.node = {"id": 901, "name": "Lease Test Node", "static_weight": 1.0, "max_concurrency": 2}
+        self.metrics = {"locked": False, "model_id": "llama3", "gpu": {}, "memory": {}}
+        locking.scheduler_index.update_node(self.node, online=True, metrics=self.metrics)
+
+    def tearDown(self):
+        """清理测试节点上残留的租约。"""
+        locking.release_all_leases(self.node["id"])
+        locking.scheduler_index.remove_node(self.node["id"])
+        print(f"--- Tearing down {self.id()} ---")
+
+    def test_leases_respect_slots(self):
+        """
+        测试: 租约数量不能超过节点的并发槽位，释放后槽位可再次租用。
+        """
+        print("    - 验证槽位上限...")
+        first = locking.acquire_lease(self.node)
+        second = locking.acquire_lease(self.node)
+        self.assertIsNotNone(first)
+        self.assertIsNotNone(second)
+        self.assertIsNone(locking.acquire_lease(self.node))
+
+        self.assertTrue(locking.release_lease(first))
+        self.assertIsNotNone(locking.acquire_lease(self.node))
+
+    def test_expired_lease_is_fenced(self):
+        """
+        测试: 过期的租约会自动回收槽位，其持有者之后的续约和释放都会被拒绝。
+        """
+        print("    - 验证租约过期与 fencing token...")
+        stale = locking.acquire_lease(self.node, ttl=-1)
+        expired = locking.expire_stale_leases()
+        self.assertIn(stale, expired)
+        self.assertEqual(locking.scheduler_index.free_slots(self.node["id"]), 2)
+
+        fresh = locking.acquire_lease(self.node)
+        self.assertGreater(fresh.token, stale.token)
+        self.assertFalse(locking.renew_lease(stale))
+        self.assertFalse(locking.release_lease(stale))
+        # 过期持有者的释放不能影响新租约占用的槽位
+        self.assertEqual(locking.scheduler_index.free_slots(self.node["id"]), 1)
+
+    def test_leases_refused_by_agent_stop_their_holders(self):
+        """
+        测试: 代理因没有空闲槽位拒绝的租约不能再续约（持有者据此停止），但槽位保持占用直到持有者释放；下一轮续约会把修正后的租约集合发给代理。
+        """
+        print("    - 验证代理拒绝的租约...")
+        node = dict(self.node, monitor_base_url="http://lease-node:8001")
+        kept = locking.acquire_lease(node)
+        refused = locking.acquire_lease(node)
+
+        def handler(request):
+            return httpx.Response(200, json={"status": "success", "refused": [refused.lease_id]})
+
+        async def scenario():
+            locking.node_clients.transport = httpx.MockTransport(handler)
+            try:
+                await locking._send_renewal(node, [], seq=1)
+            finally:
+                await locking.node_clients.aclose()
+                locking.node_clients.transport = None
+
+        asyncio.run(scenario())
+        self.assertFalse(locking.renew_lease(refused))
+        self.assertTrue(locking.renew_lease(kept))
+        self.assertEqual(locking.scheduler_index.free_slots(self.node["id"]), 0)
+        self.assertIn(self.node["id"], locking._dirty_nodes)
+
+        self.assertTrue(locking.release_lease(refused))
+        self.assertEqual(locking.scheduler_index.free_slots(self.node["id"]), 1)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
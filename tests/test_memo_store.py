@@ -0,0 +1,66 @@
+# tests/test_memo_store.py
+
+import os
+import shutil
+import tempfile
+import unittest
+
+# 假设可以从 gateway 模块导入
+from services.memo_store import MemoStore
+
+
+class TestMemoStore(unittest.TestCase):
+    """
+    对跨任务持久化 memo 存储的单元测试。
+    """
+
+    def setUp(self):
+        print(f"\n--- Setting up for {self.id()} ---")
+        self.directory = tempfile.mkdtemp(prefix="inferops-test-")
+        self.path = os.path.join(self.directory, "memo.sqlite")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        print(f"--- Tearing down {self.id()} ---")
+
+    def test_outputs_persist_across_restarts(self):
+        """
+        测试: 存入的输出可以读取，并且在重新打开存储后仍然存在。
+        """
+        print("    - 验证 memo 的读写与持久化...")
+        store = MemoStore(self.path, max_bytes=1024)
+        self.assertIsNone(store.get("k1"))
+        store.put("k1", "答案")
+        store.put("k1", "新答案")  # 覆盖同一键不会重复计算大小
+        self.assertEqual(store.get("k1"), "新答案")
+        store.close()
+
+        store = MemoStore(self.path, max_bytes=1024)
+        self.assertEqual(store.get("k1"), "新答案")
+        self.assertEqual(store._bytes, len("新答案".encode("utf-8")))
+        store.close()
+
+    def test_least_recently_used_outputs_are_evicted(self):
+        """
+        测试: 超出大小上限时删除最久未使用的输出；超过上限的单个输出不会被存储。
+        """
+        print("    - 验证按大小的 LRU 淘汰...")
+        store = MemoStore(self.path, max_bytes=30)
+        store.put("a", "x" * 10)
+        store.put("b", "x" * 10)
+        store.put("c", "x" * 10)
+        store.get("a")  # a 成为最近使用
+        store.put("d", "x" * 10)
+
+        self.assertIsNone(store.get("b"))
+        for key in ("a", "c", "d"):
+            self.assertIsNotNone(store.get(key), key)
+        self.assertEqual(store._bytes, 30)
+
+        store.put("huge", "x" * 31)
+        self.assertIsNone(store.get("huge"))
+        store.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+# tests/test_response_cache.py
+
+import asyncio
+import unittest
+
+# 假设可以从 gateway 模块导入
+from models.api_models import ChatRequest
+from services.response_cache import ResponseCache, SingleFlight, request_cache_key
+
+
+class TestResponseCache(unittest.TestCase):
+    """
+    对确定性请求的响应缓存与请求合并 (single-flight) 的单元测试。
+    """
+
+    def setUp(self):
+        print(f"\n--- Setting up for {self.id()} ---")
+
+    def tearDown(self):
+        print(f"--- Tearing down {self.id()} ---")
+
+    def test_cache_key_normalisation(self):
+        """
+        测试: 只有 temperature 为 0 的请求可缓存；格式差异不影响缓存键，模型不同则键不同。
+        """
+        print("    - 验证缓存键...")
+        base = {"messages": [{"role": "user", "content": "hello"}], "options": {"temperature": 0}}
+        key = request_cache_key(ChatRequest(**base))
+        self.assertIsNotNone(key)
+
+        reformatted = dict(base, messages=[{"role": "User", "content": "  hello\r\n"}])
+        self.assertEqual(request_cache_key(ChatRequest(**reformatted)), key)
+        self.assertNotEqual(request_cache_key(ChatRequest(**dict(base, model="llama3"))), key)
+        self.assertIsNone(request_cache_key(ChatRequest(messages=base["messages"])))
+        self.assertIsNone(request_cache_key(ChatRequest(messages=base["messages"], options={"temperature": 0.7})))
+
+    def test_lru_and_memory_cap(self):
+        """
+        测试: 超出条目数或内存上限时淘汰最久未使用的条目；过期条目不再返回。
+        """
+        print("    - 验证 LRU 淘汰与内存上限...")
+        cache = ResponseCache(max_entries=2, max_bytes=10, ttl=60)
+        cache.put("a", ["aaa"])
+        cache.put("b", ["bbb"])
+        self.assertEqual(cache.get("a"), ("aaa",))  # 'a' 成为最近使用
+        cache.put("c", ["ccc"])
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(len(cache), 2)
+
+        cache.put("d", ["dddddddd"])  # 超出 10 字节上限，淘汰旧条目
+        self.assertEqual(cache.get("d"), ("dddddddd",))
+        self.assertIsNone(cache.get("a"))
+
+        cache.put("too_big", ["x" * 11])
+        self.assertIsNone(cache.get("too_big"))
+
+        expired = ResponseCache(max_entries=2, max_bytes=10, ttl=-1)
+        expired.put("a", ["aaa"])
+        self.assertIsNone(expired.get("a"))
+
+    def test_flight_fans_out_to_all_subscribers(self):
+        """
+        测试: 同一个 flight 的所有订阅者收到完全相同的流，完成后结果交给回调。
+        """
+        print("    - 验证请求合并与流的分发...")
+
+        async def scenario():
+            flights = SingleFlight()
+            flight = flights.start("k")
+            completed = []
+
+            async def source():
+                for chunk in ("a", "b", "c"):
+                    await asyncio.sleep(0)
+                    yield chunk
+
+            flights.run("k", source(), on_complete=completed.append)
+
+            async def collect():
+                return [chunk async for chunk in flight.subscribe()]
+
+            results = await asyncio.gather(collect(), collect(), collect())
+            self.assertEqual(results, [["a", "b", "c"]] * 3)
+            self.assertEqual(completed, [["a", "b", "c"]])
+            self.assertIsNone(flights.get("k"))
+
+        asyncio.run(scenario())
+
+    def test_follower_leaving_before_leader_reads_keeps_the_flight(self):
+        """
+        测试: follower 加入后、leader 开始读取前断开，共享的上游流不会被取消，leader 仍收到完整的流并写入缓存；所有订阅者都离开后 flight 才被放弃。
+        """
+        print("    - 验证订阅者在加入时计数...")
+
+        async def scenario():
+            flights = SingleFlight()
+            flight = flights.start("k")
+            completed = []
+
+            async def source():
+                for chunk in ("a", "b", "c"):
+                    await asyncio.sleep(0)
+                    yield chunk
+
+            leader = flights.run("k", source(), on_complete=completed.append)
+            follower = flight.subscribe()
+            await follower.aclose()  # follower 的客户端在 leader 读取之前断开
+            await asyncio.sleep(0)
+            self.assertFalse(flight.abandoned)
+
+            self.assertEqual([chunk async for chunk in leader], ["a", "b", "c"])
+            self.assertEqual(completed, [["a", "b", "c"]])
+
+            # 所有订阅者都在结束前离开：上游被取消，之后的请求不会再加入这个 flight
+            flight = flights.start("k2")
+            leader = flights.run("k2", source(), on_complete=completed.append)
+            self.assertEqual(await leader.__anext__(), "a")
+            await leader.aclose()
+            self.assertTrue(flight.abandoned)
+            self.assertIsNone(flights.get("k2"))
+            await asyncio.sleep(0.01)
+            self.assertEqual(len(completed), 1)
+
+        asyncio.run(scenario())
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
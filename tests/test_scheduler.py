@@ -4,16 +4,17 @@ import unittest
 from unittest.mock import patch
 
 # 假设可以从 gateway 模块导入
-from core.scheduler import get_best_node
+from core.scheduler import get_best_node, SchedulerIndex, conversation_affinity_key
+from core.latency import LatencyTracker
 from config import Settings
 
-class TestScheduler(unittest.TestCase):
+class TestScheduler(unittest.IsolatedAsyncioTestCase):
     """
-    对动态调度器 `get_best_node` 函数的模拟单元测试。
+    对动态调度器 `get_best_node` 函数的单元测试（节点状态写入一个独立的 `SchedulerIndex`）。
     """
 
     def setUp(self):
-        """设置模拟的节点配置和状态。"""
+        """设置节点配置和状态，并用一个新的调度索引替换全局索引。"""
         print(f"\n--- Setting up for {self.id()} ---")
         
         # 模拟来自 config.py 的节点配置
@@ -25,7 +26,7 @@ class TestScheduler(unittest.TestCase):
             {"id": 5, "name": "Node 5 (Locked)", "static_weight": 10.0, "monitor_base_url": "...", "llm_url": "..."},
         ]
 
-        # 模拟来自 core/state.py 的实时节点状态缓存
+        # 模拟健康检查上报的实时节点状态
         self.mock_node_status_cache = {
             1: {"id": 1, "online": True, "metrics": {"locked": False, "gpu": {"utilization_percent": 10, "temperature_celsius": 60}, "memory": {"percent": 20}}},
             2: {"id": 2, "online": True, "metrics": {"locked": False, "gpu": {"utilization_percent": 5, "temperature_celsius": 50}, "memory": {"percent": 10}}},
@@ -34,46 +35,49 @@ class TestScheduler(unittest.TestCase):
             5: {"id": 5, "online": True, "metrics": {"locked": True, "gpu": {"utilization_percent": 5, "temperature_celsius": 50}, "memory": {"percent": 10}}},
         }
 
+        self.index = SchedulerIndex()
+        patcher = patch('core.scheduler.scheduler_index', self.index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
     def tearDown(self):
         """清理测试环境。"""
         print(f"--- Tearing down {self.id()} ---")
 
-    @patch('gateway.core.scheduler.settings')
-    @patch('gateway.core.scheduler.state')
-    async def test_select_least_loaded_node(self, mock_state, mock_settings):
+    def apply_status(self):
+        """把节点状态交给调度索引，与健康检查服务的做法相同。"""
+        for node in self.mock_nodes_config:
+            status = self.mock_node_status_cache[node["id"]]
+            self.index.update_node(node, online=status["online"], metrics=status["metrics"])
+
+    async def test_select_best_scoring_node(self):
         """
-        测试: 调度器是否选择了负载最低的节点。
+        测试: 调度器是否选择了综合得分最高的节点。
         
         在这个场景中:
-        - Node 1 负载较低。
-        - Node 2 负载最低。
+        - Node 1 静态权重最高，负载较低。
+        - Node 2 负载最低，但静态权重只有一半。
         - Node 3 负载极高。
         - Node 4 离线。
         - Node 5 被锁定。
         
-        预期结果: 应该选择 Node 2，因为它在线、未锁定且综合负载最低。
+        预期结果: 应该选择 Node 1，因为它在线、未锁定且得分（静态权重 / 动态负载）最高。
         """
-        print("    - 验证调度器是否选择负载最低的节点...")
-        
-        # 配置 mock 对象
-        mock_settings.NODES = self.mock_nodes_config
-        mock_state.NODE_STATUS_CACHE = self.mock_node_status_cache
+        print("    - 验证调度器是否选择得分最高的节点...")
+        self.apply_status()
         
-        # 使用 async/await 来运行异步函数
         best_node = await get_best_node()
         
         self.assertIsNotNone(best_node)
-        self.assertEqual(best_node['id'], 2)
+        self.assertEqual(best_node['id'], 1)
         
         print(f"    - 调度器选择了 Node {best_node['id']}，测试通过。")
 
-    @patch('gateway.core.scheduler.settings')
-    @patch('gateway.core.scheduler.state')
-    async def test_scheduler_avoids_offline_and_locked_nodes(self, mock_state, mock_settings):
+    async def test_scheduler_avoids_offline_and_locked_nodes(self):
         """
         测试: 调度器是否会避开离线和锁定的节点。
         
-        在这个场景中，我们让 Node 1 和 Node 2 也处于不可用状态。
+        在这个场景中，我们让 Node 1、Node 2 和 Node 3 也处于不可用状态。
         
         预期结果: 应该返回 None，因为没有可用的节点。
         """
@@ -82,9 +86,8 @@ class TestScheduler(unittest.TestCase):
         # 修改状态，使所有可用节点都不可调度
         self.mock_node_status_cache[1]['online'] = False
         self.mock_node_status_cache[2]['metrics']['locked'] = True
-        
-        mock_settings.NODES = self.mock_nodes_config
-        mock_state.NODE_STATUS_CACHE = self.mock_node_status_cache
+        self.mock_node_status_cache[3]['metrics']['locked'] = True
+        self.apply_status()
         
         best_node = await get_best_node()
         
@@ -92,16 +95,147 @@ class TestScheduler(unittest.TestCase):
         
         print("    - 调度器正确地忽略了所有不可用节点，测试通过。")
 
+class TestSchedulerIndex(unittest.TestCase):
+    """
+    对增量调度索引 `SchedulerIndex` 的单元测试。
+    """
+
+    def setUp(self):
+        """构建一个包含不同模型与负载的索引。"""
+        print(f"\n--- Setting up for {self.id()} ---")
+        self.index = SchedulerIndex()
+        self.nodes = {
+            1: {"id": 1, "name": "Node 1", "static_weight": 10.0},
+            2: {"id": 2, "name": "Node 2", "static_weight": 5.0},
+            3: {"id": 3, "name": "Node 3", "static_weight": 2.0},
+        }
+        self.metrics = {
+            1: {"locked": False, "model_id": "llama3", "gpu": {"utilization_percent": 10, "temperature_celsius": 60}, "memory": {"percent": 20}},
+            2: {"locked": False, "model_id": "qwen2", "gpu": {"utilization_percent": 5, "temperature_celsius": 50}, "memory": {"percent": 10}},
+            3: {"locked": False, "model_id": "llama3", "gpu": {"utilization_percent": 80, "temperature_celsius": 85}, "memory": {"percent": 90}},
+        }
+        for node_id, node in self.nodes.items():
+            self.index.update_node(node, online=True, metrics=self.metrics[node_id])
+
+    def tearDown(self):
+        print(f"--- Tearing down {self.id()} ---")
+
+    def test_pick_by_model(self):
+        """
+        测试: 按模型选点时只返回运行该模型的节点，且得分最高者优先。
+        """
+        print("    - 验证按模型过滤与排序...")
+        self.assertEqual(self.index.pick()["id"], 1)
+        self.assertEqual(self.index.pick("llama3")["id"], 1)
+        self.assertEqual(self.index.pick("qwen2")["id"], 2)
+        self.assertIsNone(self.index.pick("mistral"))
+
+    def test_pick_with_exclusions(self):
+        """
+        测试: 排除的节点被跳过，且之后的选点不受影响（被排除的节点仍在调度池中）。
+        """
+        print("    - 验证排除节点...")
+        self.assertEqual(self.index.pick(exclude=(1,))["id"], 2)
+        self.assertEqual(self.index.pick("llama3", exclude=[1])["id"], 3)
+        self.assertIsNone(self.index.pick("llama3", exclude={1, 3}))
+        self.assertEqual(self.index.pick()["id"], 1)
+        self.assertEqual(self.index.pick("llama3")["id"], 1)
+
+    def test_reserve_and_release(self):
+        """
+        测试: 预留的节点不会被再次选中，释放后重新回到调度池。
+        """
+        print("    - 验证预留与释放...")
+        self.index.reserve(1)
+        self.assertEqual(self.index.pick("llama3")["id"], 3)
+        self.index.reserve(3)
+        self.assertIsNone(self.index.pick("llama3"))
+        self.index.release(1)
+        self.assertEqual(self.index.pick("llama3")["id"], 1)
+
+    def test_health_updates_are_incremental(self):
+        """
+        测试: 健康检查的更新（离线、负载变化）会立即反映在选点结果中。
+        """
+        print("    - 验证增量更新...")
+        self.index.update_node(self.nodes[1], online=False, metrics=None)
+        self.assertEqual(self.index.pick()["id"], 2)
+        busy = dict(self.metrics[1], gpu={"utilization_percent": 100, "temperature_celsius": 90}, memory={"percent": 100})
+        self.index.update_node(self.nodes[1], online=True, metrics=busy)
+        self.index.update_node(self.nodes[3], online=True, metrics=dict(self.metrics[1]))
+        self.assertEqual(self.index.pick("llama3")["id"], 3)
+
+    def test_multi_slot_nodes(self):
+        """
+        测试: 多槽位节点可以同时承接多个请求，且得分随空闲槽位减少而降低。
+        """
+        print("    - 验证多槽位调度...")
+        strong = dict(self.nodes[1], max_concurrency=3)
+        self.index.update_node(strong, online=True, metrics=self.metrics[1])
+        self.assertEqual(self.index.free_slots(1), 3)
+
+        self.index.reserve(1)
+        # 仍有空闲槽位，继续承接同模型请求
+        self.assertEqual(self.index.pick("llama3")["id"], 1)
+        # 仅剩 2/3 的空闲槽位，综合得分低于完全空闲的 Node 2
+        self.assertEqual(self.index.pick()["id"], 2)
+        self.index.reserve(1)
+        self.index.reserve(1)
+        self.assertEqual(self.index.pick("llama3")["id"], 3)
+        self.assertEqual(self.index.free_slots(1), 0)
+
+        for _ in range(3):
+            self.index.release(1)
+        self.assertEqual(self.index.free_slots(1), 3)
+
+        # Agent 上报的槽位数会限制配置中的并发数；网关自身租约之外占用的槽位同样计入
+        reported = dict(self.metrics[1], slots_total=2, slots_in_use=2, leases_in_use=1)
+        self.index.update_node(strong, online=True, metrics=reported)
+        self.assertEqual(self.index.free_slots(1), 1)
+
+    def test_latency_aware_scoring(self):
+        """
+        测试: 观测到的 TTFT 与解码速率会影响选点，预计最快完成的节点优先。
+        """
+        print("    - 验证基于延迟的调度...")
+        index = SchedulerIndex(latency=LatencyTracker(alpha=0.5))
+        for node_id, node in self.nodes.items():
+            index.update_node(node, online=True, metrics=self.metrics[node_id])
+        self.assertEqual(index.pick("llama3")["id"], 1)
+
+        # Node 3 虽然静态负载较高，但实测首 token 极快、解码速度极高
+        index.observe_latency(3, ttft=0.1, tokens_per_sec=1000.0)
+        index.observe_latency(1, ttft=2.0, tokens_per_sec=20.0)
+        self.assertEqual(index.pick("llama3")["id"], 3)
+
+        # EWMA 会随新的慢速观测逐步回落
+        for _ in range(10):
+            index.observe_latency(3, ttft=5.0, tokens_per_sec=5.0)
+        self.assertEqual(index.pick("llama3")["id"], 1)
+
+    def test_prefix_affinity_routing(self):
+        """
+        测试: 同一会话的后续轮次会回到持有 KV 缓存的节点；负载超过上限时会溢出到其他节点。
+        """
+        print("    - 验证前缀亲和路由...")
+        for node_id in self.nodes:
+            self.index.update_node(dict(self.nodes[node_id], max_concurrency=4), online=True, metrics=self.metrics[node_id])
+
+        turn1 = [{"role": "system", "content": "你是助手"}, {"role": "user", "content": "你好"}]
+        turn2 = turn1 + [{"role": "assistant", "content": "你好！"}, {"role": "user", "content": "讲个笑话"}]
+        key = conversation_affinity_key(turn1)
+        self.assertEqual(key, conversation_affinity_key(turn2))
+        self.assertNotEqual(key, conversation_affinity_key([{"role": "user", "content": "另一个会话"}]))
+
+        first = self.index.pick_affinity(key)
+        self.assertEqual(self.index.pick_affinity(key)["id"], first["id"])
+
+        # 该节点已承担远超其公平份额的负载时，会话必须迁移到其他节点
+        for _ in range(3):
+            self.index.reserve(first["id"])
+        moved = self.index.pick_affinity(key)
+        self.assertNotEqual(moved["id"], first["id"])
+
 # 使得可以直接运行此文件
 if __name__ == '__main__':
-    import asyncio
-    # unittest 不直接支持异步测试的 setUp/tearDown，但支持异步测试方法
-    # 为了简单起见，我们手动运行异步测试
-    suite = unittest.TestSuite()
-    suite.addTest(unittest.makeSuite(TestScheduler))
-    runner = unittest.TextTestRunner(verbosity=2)
-    
-    # 为了运行 async def test_* 方法，我们需要一个事件循环
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(runner.run(suite))
-
+    unittest.main()
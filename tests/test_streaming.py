@@ -0,0 +1,104 @@
+# tests/test_streaming.py
+
+import json
+import unittest
+
+# 假设可以从 gateway 模块导入
+from utils.streaming import NDJSONFramer, FramingError, OpenAIStreamTranslator, ChatAggregator, StreamRenderer
+
+
+class TestNDJSONFramer(unittest.TestCase):
+    """
+    对 NDJSON 增量分帧器的单元测试。
+    """
+
+    def setUp(self):
+        print(f"\n--- Setting up for {self.id()} ---")
+
+    def tearDown(self):
+        print(f"--- Tearing down {self.id()} ---")
+
+    def test_lines_split_across_chunks(self):
+        """
+        测试: 无论网络分块如何切分（包括把 "done":true 标记切开），都能还原出完整的行。
+        """
+        print("    - 验证跨分块的行还原...")
+        stream = b'{"message":{"content":"Hi"},"done":false}\n\n{"message":{"content":""},"done":true}\n'
+        for size in (1, 3, 7, len(stream)):
+            framer = NDJSONFramer()
+            lines = []
+            for i in range(0, len(stream), size):
+                lines.extend(framer.feed(stream[i:i + size]))
+            self.assertEqual(len(lines), 2, f"chunk size {size}")
+            self.assertTrue(json.loads(lines[-1])["done"])
+            self.assertIsNone(framer.flush())
+
+    def test_unterminated_and_oversized_lines(self):
+        """
+        测试: 末尾没有换行的行在 flush 时返回；超长的行被视为分帧错误。
+        """
+        print("    - 验证未终止行与超长行...")
+        framer = NDJSONFramer()
+        self.assertEqual(framer.feed(b'{"a":1}\n{"b"'), [b'{"a":1}'])
+        self.assertEqual(framer.feed(b':2}'), [])
+        self.assertEqual(framer.flush(), b'{"b":2}')
+
+        with self.assertRaises(FramingError):
+            NDJSONFramer(max_line_bytes=8).feed(b"x" * 9)
+
+    def test_openai_translation(self):
+        """
+        测试: Ollama 消息被转换为 OpenAI 的 chat.completion.chunk 事件，结束时附带 usage 和 [DONE]。
+        """
+        print("    - 验证 OpenAI 格式转换...")
+        translator = OpenAIStreamTranslator("llama3")
+        first = translator.translate({"message": {"role": "assistant", "content": "Hi"}, "done": False})
+        self.assertTrue(first.startswith("data: ") and first.endswith("\n\n"))
+        chunk = json.loads(first[len("data: "):])
+        self.assertEqual(chunk["object"], "chat.completion.chunk")
+        self.assertEqual(chunk["choices"][0]["delta"], {"role": "assistant", "content": "Hi"})
+
+        last = translator.translate({"message": {"content": ""}, "done": True, "prompt_eval_count": 5, "eval_count": 7})
+        events = [e for e in last.split("\n\n") if e]
+        self.assertEqual(events[-1], "data: [DONE]")
+        final = json.loads(events[0][len("data: "):])
+        self.assertEqual(final["id"], chunk["id"])
+        self.assertEqual(final["choices"][0]["finish_reason"], "stop")
+        self.assertEqual(final["usage"]["total_tokens"], 12)
+
+    def test_stream_errors_end_openai_streams(self):
+        """
+        测试: OpenAI 格式的流在错误事件之后以 [DONE] 结束；Ollama 格式只有错误事件。
+        """
+        print("    - 验证错误事件后的 [DONE]...")
+        events = [e for e in StreamRenderer("openai", "llama3").error("node failed").split("\n\n") if e]
+        self.assertEqual(json.loads(events[0][len("data: "):]), {"error": "node failed"})
+        self.assertEqual(events[-1], "data: [DONE]")
+        self.assertEqual(StreamRenderer("ollama", "llama3").error("node failed"), 'data: {"error": "node failed"}\n\n')
+
+    def test_non_streaming_aggregation(self):
+        """
+        测试: 非流式模式下，聚合器只在最终消息到达时输出一个完整的 JSON 文档，并附带 usage 和 timing。
+        """
+        print("    - 验证非流式聚合...")
+        for stream_format in ("ollama", "openai"):
+            aggregator = ChatAggregator(stream_format, "llama3", size_hint=2)
+            self.assertIsNone(aggregator.node_assigned("节点 1"))
+            for piece in ("Hel", "lo", "!"):  # 超过预分配的大小
+                self.assertIsNone(aggregator.message(b"", {"message": {"content": piece}, "done": False}))
+            final = aggregator.message(b"", {"message": {"content": ""}, "done": True,
+                                             "prompt_eval_count": 3, "eval_count": 4, "eval_duration": 2 * 10**9})
+            document = json.loads(final)
+            if stream_format == "openai":
+                self.assertEqual(document["object"], "chat.completion")
+                self.assertEqual(document["choices"][0]["message"]["content"], "Hello!")
+            else:
+                self.assertEqual(document["message"]["content"], "Hello!")
+                self.assertEqual(document["eval_count"], 4)
+            self.assertEqual(document["usage"]["total_tokens"], 7)
+            self.assertEqual(document["timing"]["tokens_per_sec"], 2.0)
+            self.assertEqual(document["node"], "节点 1")
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)